@@ -0,0 +1,637 @@
+import io
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import zipfile
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+# Every benchmark runs against local stand-ins for the exchange: a WebSocket server in its own
+# process pushing synthetic streams, and an HTTP server for ping, exchangeInfo and the monthly
+# kline archives. Nothing touches the network, so two runs on the same machine are comparable.
+# run_all writes every result to one JSON file and compare() reports what got slower.
+
+
+def synthetic_klines(rows, seed=0, start=1704067200000, interval_ms=60000):
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.001, rows)))
+    open_ = np.concatenate([[100.0], close[:-1]])
+    open_time = start + np.arange(rows, dtype=np.int64) * interval_ms
+    volume = rng.random(rows) * 10
+    return {
+        "open_time": open_time, "open": open_, "high": np.maximum(open_, close) * 1.0005, "low": np.minimum(open_, close) * 0.9995,
+        "close": close, "volume": volume, "close_time": open_time + interval_ms - 1, "quote_volume": volume * close,
+        "count": rng.integers(1, 100, rows), "taker_buy_volume": volume / 2, "taker_buy_quote_volume": volume * close / 2,
+    }
+
+
+def kline_archive(pair, interval, month, columns):
+    # a zipped CSV laid out like the data.binance.vision dumps (the trailing "ignore" column included)
+    from src.simple_crypto.kline_store import KLINE_DTYPES
+    fields = [np.asarray(columns[name]) for name in KLINE_DTYPES]
+    formats = ["%d" if np.asarray(column).dtype.kind == "i" else "%.8f" for column in fields]
+    buffer = io.StringIO()
+    np.savetxt(buffer, np.column_stack([column.astype(np.float64) for column in fields] + [np.zeros(len(fields[0]))]), fmt=",".join(formats + ["%d"]))
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+        zip_ref.writestr(f"{pair}-{interval}-{month}.csv", buffer.getvalue())
+    return archive.getvalue()
+
+
+class _ExchangeHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/api/v3/ping":
+            body = b"{}"
+        elif path == "/api/v3/exchangeInfo":
+            body = self.server.exchange_info
+        else:
+            body = self.server.files.get(path)
+        if body is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class LocalExchange:
+    # REST and archive stand-in on a background thread: use rest_client() for MarketAccess and
+    # sources as the HistoryDownloader URL templates
+    def __init__(self, symbols, currency="USD"):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _ExchangeHandler)
+        self.server.daemon_threads = True
+        self.server.files = {}
+        self.server.exchange_info = json.dumps({"symbols": [
+            {"symbol": f"{symbol}{currency}", "status": "TRADING", "baseAsset": symbol, "quoteAsset": currency} for symbol in symbols
+        ]}).encode()
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.sources = [self.url + "/klines/{pair}/{interval}/{pair}-{interval}-{month}.zip"]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def add_archive(self, pair, interval, month, columns):
+        archive = kline_archive(pair, interval, month, columns)
+        self.server.files[f"/klines/{pair}/{interval}/{pair}-{interval}-{month}.zip"] = archive
+        return len(archive)
+
+    def rest_client(self):
+        from src.simple_crypto.rest_client import RestClient
+        return RestClient(bases={True: self.url, False: self.url})
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _frame(stream, n, rng):
+    # E is the send time in fractional milliseconds so the receiving side can measure latency
+    now = time.time() * 1000
+    symbol = stream.split("@")[0].upper()
+    price = 100 + rng.random()
+    if "@trade" in stream:
+        return {"e": "trade", "E": now, "s": symbol, "t": n, "p": f"{price:.2f}", "q": f"{rng.random():.5f}", "T": int(now), "m": n % 2 == 0, "M": True}
+    if "@depth" in stream:
+        return {"e": "depthUpdate", "E": now, "s": symbol, "U": 10 * n + 1, "u": 10 * n + 10,
+                "b": [[f"{price - 0.01 * i:.2f}", f"{rng.random():.4f}"] for i in range(1, 11)],
+                "a": [[f"{price + 0.01 * i:.2f}", f"{rng.random():.4f}"] for i in range(1, 11)]}
+    return {"e": "24hrTicker", "E": now, "s": symbol, "p": "0.50", "P": "0.50", "w": f"{price:.2f}", "c": f"{price:.2f}", "Q": "0.1",
+            "o": "100.00", "h": "101.00", "l": "99.00", "v": "1000.0", "q": "100000.0", "O": int(now) - 86400000, "C": int(now), "F": 0, "L": n, "n": n}
+
+
+async def _serve_streams(port_pipe, rate, messages, seed):
+    import websockets
+
+    async def handler(connection):
+        path = connection.request.path
+        combined = "streams=" in path
+        streams = path.split("streams=")[1].split("/") if combined else [path.rsplit("/", 1)[1]]
+        rng = random.Random(seed)
+        started = time.perf_counter()
+        for n in range(messages):
+            for stream in streams:
+                data = _frame(stream, n, rng)
+                await connection.send(json.dumps({"stream": stream, "data": data} if combined else data))
+            if rate is not None:
+                # `rate` frames a second on every stream
+                ahead = started + (n + 1) / rate - time.perf_counter()
+                if ahead > 0:
+                    await asyncio.sleep(ahead)
+            elif n % 64 == 0:
+                await asyncio.sleep(0)
+        await connection.wait_closed()
+
+    async with websockets.serve(handler, "127.0.0.1", 0, max_queue=None) as server:
+        port_pipe.send(server.sockets[0].getsockname()[1])
+        await asyncio.Future()
+
+
+def _stream_process(port_pipe, rate, messages, seed):
+    asyncio.run(_serve_streams(port_pipe, rate, messages, seed))
+
+
+class LocalStream:
+    # WebSocket stand-in in a separate process, so generating the frames doesn't compete with
+    # MarketAccess for the GIL. Every connection gets `messages` frames per stream, at `rate`
+    # frames a second per stream or as fast as possible with rate=None.
+    def __init__(self, rate=None, messages=1000, seed=1):
+        if rate is not None and rate <= 0:
+            raise ValueError("rate must be positive or None")
+        context = multiprocessing.get_context("spawn")
+        self.pipe, child = context.Pipe()
+        self.process = context.Process(target=_stream_process, args=(child, rate, messages, seed), daemon=True)
+        self.url = None
+
+    def __enter__(self):
+        self.process.start()
+        if not self.pipe.poll(30):
+            self.process.terminate()
+            raise RuntimeError("Stream server failed to start")
+        self.url = f"ws://127.0.0.1:{self.pipe.recv()}"
+        return self
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        self.process.join()
+
+
+def _percentiles(values):
+    if not values:
+        return {"p50_ms": None, "p90_ms": None, "p99_ms": None, "max_ms": None}
+    p50, p90, p99 = np.percentile(values, [50, 90, 99]).tolist()
+    return {"p50_ms": p50, "p90_ms": p90, "p99_ms": p99, "max_ms": max(values)}
+
+
+def bench_ingest(symbols=20, events=("trade", "depth@100ms", "ticker"), rate=None, messages=2000, combined=True, typed=False, timeout=120):
+    # Listener -> queue -> dispatcher -> tracker through a live MarketAccess. Latency is taken
+    # from the stream server stamping a frame to the tracker receiving it.
+    from src.simple_crypto.market_access import MarketAccess
+    from src.simple_crypto.decoding import MessageDecoder, JSON_BACKEND
+
+    class Receiver(MarketAccess.BaseTracker):
+        def __init__(self, symbol, access, sink):
+            super().__init__(symbol, access)
+            self.sink = sink
+
+        def on_event(self, event, msg):
+            self.sink.append(time.time() * 1000 - msg["E"])
+
+    coins = [f"C{n:03d}" for n in range(symbols)]
+    latencies = []
+    with LocalExchange(coins) as exchange, LocalStream(rate, messages) as stream:
+        market = MarketAccess(logger=MarketAccess.BaseLogger(plain=True, level="error"), combined=combined, stream_url=stream.url,
+                              rest_client=exchange.rest_client(), decoder=MessageDecoder(typed=typed))
+        for coin in coins:
+            for event in events:
+                market.subscribe(coin, Receiver(coin, market, latencies), "USD", event)
+        expected = symbols * len(events) * messages
+        market.start()
+        deadline = time.monotonic() + timeout
+        first = None
+        last_count, last_change = 0, time.monotonic()
+        while time.monotonic() < deadline and len(latencies) < expected:
+            time.sleep(0.02)
+            count = len(latencies)
+            now = time.monotonic()
+            if count and first is None:
+                first = now
+            if count != last_count:
+                last_count, last_change = count, now
+            elif count and now - last_change > 2:
+                # conflated snapshot streams never deliver every frame
+                break
+        elapsed = last_change - first if first is not None else 0.0
+        stats = market.queue_stats()
+        market.stop()
+    received = len(latencies)
+    result = {
+        "symbols": symbols,
+        "streams": symbols * len(events),
+        "combined": combined,
+        "typed": typed,
+        "json_backend": JSON_BACKEND,
+        "rate_per_stream": rate,
+        "sent": expected,
+        "received": received,
+        "messages_per_second": received / elapsed if elapsed else None,
+        "latency": _percentiles(latencies),
+        "queue": stats,
+    }
+    throughput = f"{result['messages_per_second']:.0f} msg/s" if result["messages_per_second"] else "n/a"
+    print(f"ingest: {received}/{expected} messages over {result['streams']} streams, {throughput}, "
+          f"latency p50 {result['latency']['p50_ms']:.2f} ms p99 {result['latency']['p99_ms']:.2f} ms" if received else f"ingest: nothing received in {timeout}s")
+    return result
+
+
+def _store_month(data_dir, coins, rows):
+    from src.simple_crypto.kline_store import KlineStore
+    from src.simple_crypto.downloader import months_back
+    month = months_back(1)[0]
+    start = int(month.timestamp()) * 1000
+    store = KlineStore(data_dir)
+    for n, coin in enumerate(coins):
+        store.append_month(coin, "USD", "1m", month.strftime('%Y-%m'), synthetic_klines(rows, seed=n, start=start))
+
+
+def bench_back_market(coins=4, rows=43200, events=("kline_1m", "ticker")):
+    # One month of 1m klines per coin replayed through BackMarket with a tracker on every stream
+    from src.simple_crypto.market_access import MarketAccess
+    from src.simple_crypto.alg_testing.back_market import BackMarket
+
+    class Counter(MarketAccess.BaseTracker):
+        count = 0
+
+        def on_event(self, event, msg):
+            Counter.count += 1
+
+    names = [f"C{n:03d}" for n in range(coins)]
+    with tempfile.TemporaryDirectory() as data_dir:
+        _store_month(data_dir, names, rows)
+        market = BackMarket(data_dir=data_dir, logger=MarketAccess.BaseLogger(plain=True, level="error"), download=False)
+        for name in names:
+            for event in events:
+                market.subscribe(name, Counter(name, market), event=event)
+        started = time.perf_counter()
+        market.run()
+        elapsed = time.perf_counter() - started
+    result = {
+        "coins": coins,
+        "rows_per_coin": rows,
+        "events": market.replayed,
+        "delivered": Counter.count,
+        "seconds": elapsed,
+        "events_per_second": market.replayed / elapsed,
+    }
+    print(f"back market: {result['events']} events in {elapsed:.2f}s ({result['events_per_second']:.0f} events/s)")
+    return result
+
+
+def bench_download(symbols=4, months=3, rows=43200, workers=8):
+    # HistoryDownloader is what get_history runs, pointed at the local archive server
+    from src.simple_crypto.downloader import HistoryDownloader, months_back
+    coins = [f"C{n:03d}" for n in range(symbols)]
+    month_names = [month.strftime('%Y-%m') for month in months_back(months)]
+    with LocalExchange(coins) as exchange:
+        archive_bytes = 0
+        for n, coin in enumerate(coins):
+            for m, month in enumerate(month_names):
+                archive_bytes += exchange.add_archive(f"{coin}USD", "1m", month, synthetic_klines(rows, seed=n * months + m))
+        with tempfile.TemporaryDirectory() as data_dir:
+            downloader = HistoryDownloader(data_dir, workers=workers, sources=exchange.sources)
+            started = time.perf_counter()
+            try:
+                available = downloader.download(coins, "USD", "1m", months)
+            finally:
+                downloader.close()
+            elapsed = time.perf_counter() - started
+    total_rows = symbols * months * rows
+    result = {
+        "archives": symbols * months,
+        "complete": all(len(found) == months for found in available.values()),
+        "rows": total_rows,
+        "archive_bytes": archive_bytes,
+        "seconds": elapsed,
+        "rows_per_second": total_rows / elapsed,
+        "megabytes_per_second": archive_bytes / elapsed / 1e6,
+    }
+    print(f"download: {result['archives']} archives, {total_rows} rows in {elapsed:.2f}s "
+          f"({result['rows_per_second']:.0f} rows/s, {result['megabytes_per_second']:.1f} MB/s)")
+    return result
+
+
+def bench_backtest(coins=2, rows=43200):
+    # The same moving average crossover through the event driven backtest and the vectorized one
+    from src.simple_crypto.market_access import MarketAccess
+    from src.simple_crypto.alg_testing.back_market import BackMarket
+    from src.simple_crypto.alg_testing.tester import AlgTester
+    from src.simple_crypto.trackers import SMA, sma
+
+    class Crossover(MarketAccess.BaseTracker):
+        def __init__(self, symbol, access, wallet):
+            super().__init__(symbol, access)
+            self.wallet = wallet
+            self.fast = SMA(10)
+            self.slow = SMA(50)
+
+        def on_event(self, event, msg):
+            kline = msg["k"]
+            fast = self.fast.update(kline["c"])
+            slow = self.slow.update(kline["c"])
+            if slow is None:
+                return
+            if fast > slow and not self.wallet.position(self.symbol):
+                self.wallet.buy(self.symbol, 1, kline["c"])
+            elif fast < slow and self.wallet.position(self.symbol):
+                self.wallet.sell(self.symbol, 1, kline["c"])
+
+    class Algorithm:
+        def __init__(self, market, wallet, coin, currency):
+            self.trackers = [Crossover(name, market, wallet) for name in names]
+            for tracker in self.trackers:
+                market.subscribe(tracker.symbol, tracker, currency, "kline_1m")
+
+    class Signals:
+        def signals(self, columns):
+            fast = sma(columns["close"], 10)
+            slow = sma(columns["close"], 50)
+            return np.nan_to_num(fast > slow).astype(float)
+
+    names = [f"C{n:03d}" for n in range(coins)]
+    logger = MarketAccess.BaseLogger(plain=True, level="error")
+    tester = AlgTester(initial_balance=1000 * coins)
+    with tempfile.TemporaryDirectory() as data_dir:
+        _store_month(data_dir, names, rows)
+        started = time.perf_counter()
+        tester.backtest(Algorithm, lambda market_class, **kwargs: BackMarket(market_class, logger=logger, download=False, **kwargs), data_dir=data_dir)
+        event_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        tester.backtest_vectorized(Signals(), names, data_dir=data_dir, download=False)
+        vectorized_seconds = time.perf_counter() - started
+    result = {
+        "coins": coins,
+        "bars": coins * rows,
+        "event_seconds": event_seconds,
+        "vectorized_seconds": vectorized_seconds,
+        "event_bars_per_second": coins * rows / event_seconds,
+        "vectorized_bars_per_second": coins * rows / vectorized_seconds,
+    }
+    print(f"backtest: {result['bars']} bars, event driven {event_seconds:.2f}s, vectorized {vectorized_seconds:.3f}s")
+    return result
+
+
+def _busy_tracker(symbol, access, work):
+    # factory for bench_sharding: a tracker burning `work` loop iterations per message
+    from src.simple_crypto.market_access import MarketAccess
+
+    class Busy(MarketAccess.BaseTracker):
+        def on_event(self, event, msg):
+            total = 0
+            for i in range(work):
+                total += i * i
+
+    return Busy(symbol, access)
+
+
+def _feed_streams(market, streams, messages):
+    async def feed():
+        market.connected = True
+        processor = asyncio.create_task(market.msg_processor())
+        for n in range(messages):
+            for stream in streams:
+                await market.msgs.put({'stream': stream, 'data': {"n": n}})
+        market.connected = False
+        await market.msgs.put({'stream': 'end', 'data': None})
+        await processor
+
+    asyncio.run(feed())
+
+
+def bench_sharding(symbols=32, messages=500, work=2000, shards=None):
+    # CPU bound trackers run inline on the dispatcher, then spread over 1..shards processes
+    from src.simple_crypto.market_access import MarketAccess
+    from src.simple_crypto.sharding import ShardedExecutor
+    shards = shards if shards is not None else [1, max(1, (os.cpu_count() or 2) - 1)]
+    coins = [f"C{n:03d}" for n in range(symbols)]
+    streams = [f"{coin.lower()}usd@trade" for coin in coins]
+    logger = MarketAccess.BaseLogger(plain=True, level="error")
+
+    def market_for():
+        market = MarketAccess(logger=logger)
+        market.symbols.symbols = {f"{coin}USD": {"symbol": f"{coin}USD"} for coin in coins}
+        market.symbols.loaded_at = time.time()
+        return market
+
+    market = market_for()
+    for coin in coins:
+        market.stocks.add(f"{coin.lower()}usd@trade", _busy_tracker(coin, market, work))
+    started = time.perf_counter()
+    _feed_streams(market, streams, messages)
+    inline = time.perf_counter() - started
+    result = {"symbols": symbols, "messages": symbols * messages, "work": work, "cpus": os.cpu_count(),
+              "inline_messages_per_second": symbols * messages / inline, "sharded": {}}
+    for count in sorted(set(shards)):
+        market = market_for()
+        executor = ShardedExecutor(market, shards=count)
+        executor.start()
+        try:
+            for coin in coins:
+                executor.subscribe(coin, _busy_tracker, "USD", "trade", work)
+            # shards are up and have built their trackers before the clock starts
+            executor.sync(120)
+            started = time.perf_counter()
+            _feed_streams(market, streams, messages)
+            if not executor.sync(120):
+                raise RuntimeError("Shards failed to keep up with the benchmark")
+            elapsed = time.perf_counter() - started
+        finally:
+            executor.stop()
+        result["sharded"][str(count)] = {"messages_per_second": symbols * messages / elapsed, "speedup": inline / elapsed}
+    print(f"sharding: inline {result['inline_messages_per_second']:.0f} msg/s, " + ", ".join(
+        f"{count} shards {value['messages_per_second']:.0f} msg/s ({value['speedup']:.1f}x)" for count, value in result["sharded"].items()))
+    return result
+
+
+def bench_order_book(symbols=300, seconds=60, levels=1000, changes_per_diff=20, seed=1):
+    # depth@100ms pushes 10 diffs a second per symbol, so this replays `seconds` of that for every symbol
+    from src.simple_crypto.order_book import OrderBook
+    rng = random.Random(seed)
+    books = []
+    diffs = []
+    for s in range(symbols):
+        mid = 100 + s
+        book = OrderBook(f"SYM{s}USD")
+        book.load_snapshot({
+            "lastUpdateId": 0,
+            "bids": [[f"{mid - (i + 1) * 0.01:.2f}", "1.0"] for i in range(levels)],
+            "asks": [[f"{mid + (i + 1) * 0.01:.2f}", "1.0"] for i in range(levels)],
+        })
+        books.append(book)
+    for n in range(seconds * 10):
+        for s, book in enumerate(books):
+            mid = 100 + s
+            bids = [[f"{mid - rng.randint(1, levels) * 0.01:.2f}", rng.choice(["0", "2.5", "0.1"])] for _ in range(changes_per_diff)]
+            asks = [[f"{mid + rng.randint(1, levels) * 0.01:.2f}", rng.choice(["0", "2.5", "0.1"])] for _ in range(changes_per_diff)]
+            diffs.append((book, {"U": n + 1, "u": n + 1, "b": bids, "a": asks}))
+    started = time.perf_counter()
+    for book, diff in diffs:
+        book.apply_diff(diff)
+    elapsed = time.perf_counter() - started
+    started = time.perf_counter()
+    for _ in range(100):
+        for book in books:
+            book.best_bid()
+            book.best_ask()
+            book.top(10)
+    query_elapsed = time.perf_counter() - started
+    result = {
+        "symbols": symbols,
+        "diffs": len(diffs),
+        "diffs_per_second": len(diffs) / elapsed,
+        "realtime_factor": seconds / elapsed,
+        "queries_per_second": 100 * symbols * 3 / query_elapsed,
+    }
+    print(f"order book: {result['diffs']} diffs over {symbols} symbols in {elapsed:.2f}s "
+          f"({result['diffs_per_second']:.0f} diffs/s, {result['realtime_factor']:.1f}x real time), "
+          f"{result['queries_per_second']:.0f} queries/s")
+    return result
+
+
+# Seconds a fresh interpreter may spend importing each module, on top of its own startup. Worker
+# processes and short lived tools import these, so the third party stack has to stay out of them.
+IMPORT_BUDGETS = {
+    "src.simple_crypto": 0.02,
+    "thread_safe_types": 0.02,
+    "decoding": 0.05,
+    "metrics": 0.1,
+    "market_access": 0.25,
+    "sharding": 0.3,
+}
+HEAVY_MODULES = ["pandas", "numpy", "requests", "websockets", "aiofiles", "dateutil"]
+
+_IMPORT_PROBE = """
+import sys, json, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(json.dumps({{"seconds": elapsed, "heavy": [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+
+def bench_import(modules=None, repeat=5):
+    # every import runs in a fresh interpreter, the best of `repeat` runs counts
+    modules = modules if modules is not None else list(IMPORT_BUDGETS)
+    root = os.path.dirname(os.path.abspath(__file__))
+    result = {}
+    for module in modules:
+        name = module if module.startswith("src.") else f"src.simple_crypto.{module}"
+        runs = []
+        for _ in range(repeat):
+            probe = subprocess.run([sys.executable, "-c", _IMPORT_PROBE.format(module=name, heavy=HEAVY_MODULES)], cwd=root, capture_output=True, text=True)
+            if probe.returncode != 0:
+                raise RuntimeError(f"Importing {name} failed: {probe.stderr.strip()}")
+            runs.append(json.loads(probe.stdout))
+        seconds = min(run["seconds"] for run in runs)
+        budget = IMPORT_BUDGETS.get(module)
+        result[module] = {"import_seconds": seconds, "budget_seconds": budget, "over_budget": budget is not None and seconds > budget, "heavy_modules": runs[0]["heavy"]}
+    print("import: " + ", ".join(f"{module} {value['import_seconds'] * 1000:.1f}ms" + (" (OVER BUDGET)" if value["over_budget"] else "") for module, value in result.items()))
+    return result
+
+
+BENCHMARKS = {
+    # name: (function, full size arguments, quick arguments)
+    "ingest_throughput": (bench_ingest, {}, {"symbols": 5, "messages": 300}),
+    "ingest_latency": (bench_ingest, {"rate": 100, "messages": 1000}, {"symbols": 5, "rate": 100, "messages": 200}),
+    "ingest_typed": (bench_ingest, {"typed": True}, {"symbols": 5, "messages": 300, "typed": True}),
+    "back_market": (bench_back_market, {}, {"coins": 2, "rows": 5000}),
+    "download": (bench_download, {}, {"symbols": 2, "months": 2, "rows": 5000}),
+    "backtest": (bench_backtest, {}, {"coins": 2, "rows": 5000}),
+    "order_book": (bench_order_book, {}, {"symbols": 30, "seconds": 10}),
+    "sharding": (bench_sharding, {}, {"symbols": 8, "messages": 100, "work": 1000}),
+    "import": (bench_import, {}, {"repeat": 1}),
+}
+
+
+def run_all(output="benchmark_results.json", only=None, quick=False):
+    from src.simple_crypto import __version__
+    names = only if only is not None else list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        raise ValueError(f"Unknown benchmarks: {', '.join(unknown)}. Available: {', '.join(BENCHMARKS)}")
+    results = {}
+    for name in names:
+        function, full, small = BENCHMARKS[name]
+        results[name] = function(**(small if quick else full))
+    report = {
+        "version": __version__,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "quick": quick,
+        "timestamp": time.time(),
+        "results": results,
+    }
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def _metrics(results, prefix=""):
+    for key, value in results.items():
+        if isinstance(value, dict):
+            yield from _metrics(value, f"{prefix}{key}.")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield f"{prefix}{key}", value
+
+
+def over_budget(report):
+    # benchmarks with a budget flag the results that went over it
+    return [name for name, value in _flags(report["results"]) if value]
+
+
+def _flags(results, prefix=""):
+    for key, value in results.items():
+        if isinstance(value, dict):
+            yield from _flags(value, f"{prefix}{key}.")
+        elif key == "over_budget":
+            yield prefix.rstrip("."), value
+
+
+def compare(baseline, current, tolerance=0.1):
+    # Returns the metrics that got worse by more than `tolerance`: rates (*_per_second,
+    # realtime_factor) that dropped and timings (*_seconds, *_ms, seconds) that grew
+    old = dict(_metrics(baseline["results"]))
+    regressions = {}
+    for name, value in _metrics(current["results"]):
+        before = old.get(name)
+        if not before:
+            continue
+        key = name.rsplit(".", 1)[-1]
+        if key.endswith("per_second") or key == "realtime_factor":
+            change = before / value - 1 if value else float("inf")
+        elif key.endswith("seconds") or key.endswith("_ms"):
+            change = value / before - 1
+        else:
+            continue
+        if change > tolerance:
+            regressions[name] = {"baseline": before, "current": value, "worse_by": change}
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the simple_crypto benchmarks against local exchange stand-ins")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS))
+    parser.add_argument("--quick", action="store_true", help="small sizes, for checking the harness itself")
+    parser.add_argument("--baseline", help="results file of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args()
+    report = run_all(args.output, args.only, args.quick)
+    failed = over_budget(report)
+    for name in failed:
+        print(f"OVER BUDGET {name}")
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            regressions = compare(json.load(f), report, args.tolerance)
+        for name, change in regressions.items():
+            print(f"REGRESSION {name}: {change['baseline']:.4g} -> {change['current']:.4g} ({change['worse_by']:.0%} worse)")
+        sys.exit(1 if regressions or failed else 0)
+    sys.exit(1 if failed else 0)
@@ -1,9 +1,24 @@
-import alg_testing
-import base_processor
-from market_access import MarketAccess
-import misc
-import thread_safe_types
-import trackers
-
-__all__ = ["alg_testing", "base_processor", "MarketAccess", "misc", "thread_safe_types", "trackers"]
-__version__ = "0.1.0"
\ No newline at end of file
+import importlib
+
+# Submodules load on first attribute access, so importing one module (thread_safe_types in a
+# worker process, say) doesn't pay for pandas, requests and websockets pulled in by the others
+_SUBMODULES = {"alg_testing", "base_processor", "data_index", "decoding", "downloader", "kline_store", "market_access", "message_queue", "metrics", "misc",
+               "order_book", "recorder", "resample", "rest_client", "sharding", "symbol_registry", "thread_safe_types", "trackers"}
+_ATTRIBUTES = {"MarketAccess": "market_access"}
+
+__all__ = ["alg_testing", "base_processor", "data_index", "decoding", "downloader", "kline_store", "MarketAccess", "message_queue", "metrics", "misc", "order_book", "recorder", "resample", "rest_client", "sharding", "symbol_registry", "thread_safe_types", "trackers"]
+__version__ = "0.1.0"
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module(f".{name}", __name__)
+    if name in _ATTRIBUTES:
+        value = getattr(importlib.import_module(f".{_ATTRIBUTES[name]}", __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
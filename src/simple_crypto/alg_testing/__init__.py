@@ -1,5 +1,27 @@
-from back_market import BackMarket
-from tester import AlgTester
-from testing_wallet import TestWallet
+import importlib
 
-__all__ = ['BackMarket', 'AlgTester', 'TestWallet']
\ No newline at end of file
+# Loaded on first use, like the package above
+_ATTRIBUTES = {
+    'BackMarket': 'back_market',
+    'AlgTester': 'tester',
+    'TestWallet': 'testing_wallet',
+    'Portfolio': 'portfolio',
+    'PercentageFee': 'portfolio',
+    'FlatFee': 'portfolio',
+    'BpsSlippage': 'portfolio',
+    'Sweep': 'sweep',
+}
+
+__all__ = ['BackMarket', 'AlgTester', 'TestWallet', 'Portfolio', 'PercentageFee', 'FlatFee', 'BpsSlippage', 'Sweep']
+
+
+def __getattr__(name):
+    if name in _ATTRIBUTES:
+        value = getattr(importlib.import_module(f".{_ATTRIBUTES[name]}", __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -1,109 +1,165 @@
 import asyncio
-import os
+import heapq
 from src.simple_crypto.market_access import MarketAccess
-from datetime import datetime
-import pandas as pd
 from typing import Literal
-import src.simple_crypto.thread_safe_types as tst
-from src.simple_crypto.misc import async_csv_to_df
+from src.simple_crypto.misc import INTERVAL_MS
+from src.simple_crypto.kline_store import KlineStore
+from src.simple_crypto.downloader import months_back
+from src.simple_crypto.message_queue import DEFAULT_POLICIES
+from src.simple_crypto.resample import ResampleCache, interval_ms
+from src.simple_crypto.alg_testing.rolling_window import RollingWindow
 from colorama import Fore
 
-class BackMarket:
+BACK_EVENTS = ["miniTicker", "ticker"] + [f"kline_{interval}" for interval in INTERVAL_MS]
 
-    class BackListener:
-        def __init__(self, market_access:'BackMarket', coin:str, currency:str, event:str="miniTicker"):
-            # Only does miniTicker event for now, planning to expand to more
-            if not isinstance(event, str):
-                raise TypeError("Event must be a string")
-            if not isinstance(market_access, BackMarket):
-                raise TypeError("market_access must be an instance of BackMarket")
-            self.coin = coin
-            self.currency = currency
-            self.event = event
-            self.market_access = market_access
-            self.stopped = asyncio.Event()
 
-        async def start(self, interval: Literal["1s", "1m", "3m", "5m", "15m", "30m", "1h", "2h", "4h", "6h", "8h", "12h", "1d"] = "1m", months=1):
-            identifier = f"{self.coin}{self.currency}@{self.event} for {months} months at {interval} interval"
-            self.market_access.logger.log(content=f"Starting backtest listener for {identifier}", title="BACKLISTENER-START", color=Fore.GREEN)
-            today = datetime.now()
-            files = []
-            self.market_access.logger.log(content=f"Backtest listener for {identifier} gathering historical data files...", title="BACKLISTENER-DATA", color=Fore.YELLOW)
-            MarketAccess.get_history(self.coin, self.currency, interval, months)
-            available_data = MarketAccess.get_available_data(self.market_access.data_dir)
-            for timespan in available_data[self.coin][self.currency][interval]:
-                breakdown = timespan.split("-")
-                year = int(breakdown[0])
-                month = int(breakdown[1])
-                date = datetime(year=year, month=month, day=1)
-                if (today.year - year) * 12 + (today.month - month) <= months:
-                    files.append((date, available_data[self.coin][self.currency][interval][timespan]))
-            self.market_access.logger.log(content=f"Backtest listener for {identifier} found {len(files)} data files to process.", title="BACKLISTENER-DATA", color=Fore.GREEN)
-            files.sort(key=lambda file: file[0])
-            current = None
-            self.market_access.logger.log(content="Backtest listener for {identifier} beginning data playback...", title="BACKLISTENER-PLAYBACK", color=Fore.GREEN)
-            for file in files:
-                if self.stopped.is_set():
-                    self.market_access.logger.log(content=f"Backtest listener for {identifier} stopping data playback as requested.", title="BACKLISTENER-STOP", color=Fore.RED)
-                    return
-                self.market_access.logger.log(content=f"Backtest listener for {identifier} processing file for {file[0].strftime('%Y-%m')}...", title="BACKLISTENER-FILE", color=Fore.YELLOW)
-                data = await async_csv_to_df(os.path.join(self.market_access.data_dir, file[1]))
-                start = 0
-                if current is None:
-                    between = data.iloc[0, 0] - data.iloc[0, 6]
-                    rows_per_day = 86400000 / between
-                    current = data.iloc[:rows_per_day]
-                    frame = {}
-                    if self.event == "miniTicker":
-                        frame = {
-                            "e": "24hrMiniTicker",
-                            "E": current.iloc[-1, 6],
-                            "s": (self.coin + self.currency).upper(),
-                            "c": current.iloc[-1, 4],
-                            "o": current.iloc[0, 1],
-                            "h": current['high'].max(),
-                            "l": current['low'].min(),
-                            "v": current['volume'].sum(),
-                            "q": current['quote_volume'].sum()
-                        }
-                    await self.market_access.msgs.put(frame)
-                    await asyncio.sleep(0)
-                    start = rows_per_day
-                for i in range(start, data.shape[0]):
-                    if self.stopped.is_set():
-                        self.market_access.logger.log(content=f"Backtest listener for {identifier} stopping data playback as requested.", title="BACKLISTENER-STOP", color=Fore.RED)
-                        return
-                    current = current.iloc[1:]
-                    current = current.append(data.iloc[i], ignore_index=True)
-                    frame = {}
-                    if self.event == "miniTicker":
-                        frame = {
-                            "e": "24hrMiniTicker",
-                            "E": current.iloc[-1, 6],
-                            "s": (self.coin + self.currency).upper(),
-                            "c": current.iloc[-1, 4],
-                            "o": current.iloc[0, 1],
-                            "h": current['high'].max(),
-                            "l": current['low'].min(),
-                            "v": current['volume'].sum(),
-                            "q": current['quote_volume'].sum()
-                        }
-                    await self.market_access.msgs.put(frame)
-                    await asyncio.sleep(0)
-            self.market_access.logger.log(content=f"Backtest listener for {identifier} completed data playback.", title="BACKLISTENER-COMPLETE", color=Fore.GREEN)
+class BackMarket(MarketAccess):
+    # Drop-in stand-in for MarketAccess that replays stored klines. Every subscribed
+    # symbol/interval is one source, and a single driver merges all sources on event time
+    # through a heap before queueing their events, so trackers on different coins see them in
+    # the order they happened. Equal event times go to the source whose stream sorts first.
 
-        def stop(self):
-            self.stopped.set()
-
-    def __init__ (self, market_class=MarketAccess, data_dir:str="Data", logger=None):
-        self.stocks = tst.ThreadSafeStockList()
-        self.msgs = asyncio.Queue(maxsize=100)
+    def __init__(self, market_class=MarketAccess, data_dir: str = "Data", logger=None, months=1, interval: Literal["1s", "1m", "3m", "5m", "15m", "30m", "1h", "2h", "4h", "6h", "8h", "12h", "1d"] = "1m",
+                 download=True, dispatch_batch=256, queue_size=10000, resample_from: str | None = None, metrics=None, decoder=None):
+        # interval is the kline resolution the 24hr ticker and miniTicker windows are built from.
+        # With resample_from every other interval is built from that one instead of being downloaded.
+        # The synthesized events go through decoder like live frames do, so typed trackers get typed messages.
+        if interval not in INTERVAL_MS:
+            raise ValueError(f"Invalid interval. Must be one of: {', '.join(INTERVAL_MS)}")
+        if not isinstance(months, int) or months <= 0:
+            raise ValueError("months must be a positive integer")
+        if resample_from is not None and resample_from not in INTERVAL_MS:
+            raise ValueError(f"Invalid resample_from interval. Must be one of: {', '.join(INTERVAL_MS)}")
+        # a backtest must not lose events, so nothing is conflated however far the trackers fall behind
+        super().__init__(logger=logger, dispatch_batch=dispatch_batch, queue_size=queue_size, queue_policies={event: "block" for event in DEFAULT_POLICIES}, metrics=metrics, decoder=decoder)
         self.market_class = market_class
         self.data_dir = data_dir
-        self.listener_class = BackMarket.BackListener
-        if logger is None:
-            self.logger = MarketAccess.BaseLogger()
+        self.months = months
+        self.interval = interval
+        self.download = download
+        self.resample_from = resample_from
+        self.subscriptions = {}
+        self.replayed = 0
+        # keep the merged timeline intact through the batched dispatcher
+        self.ordered_dispatch = True
+
+    def _validate_subscription(self, symbol, instance, currency, event):
+        if not isinstance(instance, MarketAccess.BaseTracker):
+            raise ValueError("Instance must be a subclass of BaseTracker")
+        if not isinstance(currency, str):
+            raise ValueError("Currency must be a string")
+        if not isinstance(symbol, str):
+            raise ValueError("Symbol must be a string")
+        if event.startswith("kline_") and event not in BACK_EVENTS:
+            # custom intervals are resampled from stored data
+            interval_ms(event[len("kline_"):])
+        elif event not in BACK_EVENTS:
+            raise ValueError(f"Event {event} not supported in backtests. Supported events: {', '.join(BACK_EVENTS)}")
+        return f"{symbol.lower()}{currency.lower()}@{event}"
+
+    def subscribe(self, symbol, instance, currency="USD", event="ticker"):
+        stream = self._validate_subscription(symbol, instance, currency, event)
+        self.subscriptions[stream] = (symbol.upper(), currency.upper(), event)
+        if not self.stocks.add(stream, instance):
+            return True
+        return False
+
+    def unsubscribe(self, symbol, instance, currency="USD", event="ticker"):
+        if not isinstance(instance, MarketAccess.BaseTracker):
+            raise ValueError("Instance must be a subclass of BaseTracker")
+        if not isinstance(currency, str):
+            raise ValueError("Currency must be a string")
+        if not isinstance(symbol, str):
+            raise ValueError("Symbol must be a string")
+        if not isinstance(event, str):
+            raise ValueError("Event must be a string")
+        if not self.stocks.remove(f"{symbol.lower()}{currency.lower()}@{event}", instance):
+            return True
+        return False
+
+    def _load(self, coin, currency, interval):
+        if interval in INTERVAL_MS and self.resample_from in (None, interval):
+            if self.download:
+                self.market_class.get_history(coin, currency, interval, self.months, data_dir=self.data_dir)
+            dataset = KlineStore(self.data_dir).open(coin, currency, interval)
         else:
-            self.logger = logger
+            if self.download and self.resample_from is not None:
+                self.market_class.get_history(coin, currency, self.resample_from, self.months, data_dir=self.data_dir)
+            dataset = ResampleCache(self.data_dir).open(coin, currency, interval, self.resample_from)
+        wanted = [month.strftime('%Y-%m') for month in months_back(self.months)]
+        present = [month for month in dataset.months if month in wanted]
+        if not present:
+            raise ValueError(f"No {interval} data for {coin}{currency} in the last {self.months} months")
+        span = slice(dataset.month_slice(present[0]).start, dataset.month_slice(present[-1]).stop)
+        return {name: column[span] for name, column in dataset.columns.items()}
+
+    def _source(self, coin, currency, interval, streams):
+        # Yields (event time, stream, data) for every subscribed event built from one kline series
+        columns = self._load(coin, currency, interval)
+        symbol = f"{coin}{currency}"
+        kline_stream = streams.get(f"kline_{interval}")
+        mini_stream = streams.get("miniTicker")
+        ticker_stream = streams.get("ticker")
+        convert = self.decoder.convert
+        window = RollingWindow(86400000 // INTERVAL_MS[interval]) if mini_stream or ticker_stream else None
+        self.logger.log(content=f"Replaying {len(columns['close'])} {interval} klines for {symbol}", title="[BACKMARKET-SOURCE]", title_color=Fore.YELLOW)
+        names = ["open_time", "open", "high", "low", "close", "volume", "close_time", "quote_volume", "count", "taker_buy_volume", "taker_buy_quote_volume"]
+        for open_time, open_price, high, low, close, volume, close_time, quote_volume, count, taker_volume, taker_quote_volume in zip(*[columns[name].tolist() for name in names]):
+            if kline_stream is not None:
+                yield close_time, kline_stream, convert(kline_stream, {
+                    "e": "kline", "E": close_time, "s": symbol,
+                    "k": {"t": open_time, "T": close_time, "s": symbol, "i": interval, "o": open_price, "c": close, "h": high, "l": low,
+                          "v": volume, "n": count, "x": True, "q": quote_volume, "V": taker_volume, "Q": taker_quote_volume},
+                })
+            if window is None:
+                continue
+            window.push(open_price, high, low, close, volume, quote_volume, close_time, count)
+            if not window.full:
+                continue
+            if ticker_stream is not None:
+                yield close_time, ticker_stream, convert(ticker_stream, window.ticker(symbol))
+            if mini_stream is not None:
+                yield close_time, mini_stream, convert(mini_stream, window.mini_ticker(symbol))
+
+    def sources(self):
+        # Groups the subscribed streams by the kline series they are built from
+        grouped = {}
+        for stream in sorted(self.stocks.keys()):
+            coin, currency, event = self.subscriptions[stream]
+            interval = event[len("kline_"):] if event.startswith("kline_") else self.interval
+            grouped.setdefault((coin, currency, interval), {})[event] = stream
+        return [self._source(coin, currency, interval, streams) for (coin, currency, interval), streams in grouped.items()]
+
+    def events(self):
+        return heapq.merge(*self.sources(), key=lambda event: event[0])
+
+    async def _drive(self):
+        count = 0
+        for event_time, stream, data in self.events():
+            if not self.connected:
+                self.logger.log(content=f"Replay stopped after {count} events", title="[BACKMARKET-STOP]", title_color=Fore.YELLOW)
+                break
+            await self.msgs.put({'stream': stream, 'data': data})
+            count += 1
+        self.replayed = count
+        await self.msgs.put({'stream': 'end', 'data': None})
+
+    async def _run(self):
+        self.logger.log(content=f"BackMarket started with {len(self.stocks.keys())} streams", title="[BACKMARKET-STARTED]", title_color=Fore.GREEN)
+        processor_task = asyncio.create_task(self.msg_processor())
+        try:
+            await self._drive()
+            await processor_task
+        finally:
+            with self.connected_lock:
+                self.connected = False
+            if not processor_task.done():
+                processor_task.cancel()
+        self.logger.log(content=f"Replayed {self.replayed} events", title="[BACKMARKET-COMPLETE]", title_color=Fore.GREEN)
+
+    # run, start and stop are inherited: start() replays on a background thread, stop() cuts it short
 
-    # TODO: Implement subscribe and unsubscribe methods and start, run, _run, and stop, to be consistent with MarketAccess
\ No newline at end of file
+    def join(self, timeout=None):
+        # waits for a replay started with start() to run out of data
+        if self.thread is not None:
+            self.thread.join(timeout)
@@ -0,0 +1,218 @@
+import numpy as np
+
+FILL_DTYPE = np.dtype([
+    ("time", np.int64),
+    ("asset", np.int32),
+    ("quantity", np.float64),
+    ("price", np.float64),
+    ("fee", np.float64),
+    ("cash", np.float64),
+])
+
+
+class PercentageFee:
+    def __init__(self, rate: float = 0.001):
+        if rate < 0:
+            raise ValueError("rate must not be negative")
+        self.rate = rate
+
+    def __call__(self, quantities: np.ndarray, prices: np.ndarray):
+        return np.abs(quantities) * prices * self.rate
+
+
+class FlatFee:
+    def __init__(self, fee: float):
+        if fee < 0:
+            raise ValueError("fee must not be negative")
+        self.fee = fee
+
+    def __call__(self, quantities: np.ndarray, prices: np.ndarray):
+        return np.full(len(quantities), self.fee, dtype=np.float64)
+
+
+class BpsSlippage:
+    # Buys fill above and sells below the quoted price by a fixed number of basis points
+    def __init__(self, bps: float = 5):
+        if bps < 0:
+            raise ValueError("bps must not be negative")
+        self.bps = bps
+
+    def __call__(self, quantities: np.ndarray, prices: np.ndarray):
+        return prices * (1 + np.sign(quantities) * self.bps / 10000)
+
+
+class Portfolio:
+    # Cash plus one position slot per asset in a NumPy array, with every fill appended to a
+    # preallocated structured buffer that doubles when it runs out of room.
+    def __init__(self, initial_balance=0, currency='USD', assets: list[str] | None = None, fee_model=None, slippage_model=None, capacity: int = 1024):
+        if fee_model is not None and not callable(fee_model):
+            raise ValueError("fee_model must be callable")
+        if slippage_model is not None and not callable(slippage_model):
+            raise ValueError("slippage_model must be callable")
+        if not isinstance(capacity, int) or capacity <= 0:
+            raise ValueError("capacity must be a positive integer")
+        self.balance = float(initial_balance)
+        self.initial_balance = float(initial_balance)
+        self.currency = currency
+        self.fee_model = fee_model
+        self.slippage_model = slippage_model
+        self.assets = []
+        self.asset_index = {}
+        self.positions = np.zeros(0, dtype=np.float64)
+        self._coins = None
+        self.fills = np.empty(capacity, dtype=FILL_DTYPE)
+        self.fill_count = 0
+        for asset in assets or []:
+            self.asset_id(asset)
+
+    def asset_id(self, symbol: str):
+        index = self.asset_index.get(symbol)
+        if index is None:
+            index = len(self.assets)
+            self.assets.append(symbol)
+            self.asset_index[symbol] = index
+            self.positions = np.append(self.positions, 0.0)
+        return index
+
+    @property
+    def coins(self):
+        # the held assets as {symbol: quantity}, rebuilt only after fills changed the positions
+        if self._coins is None:
+            self._coins = {self.assets[i]: float(self.positions[i]) for i in np.flatnonzero(self.positions)}
+        return self._coins
+
+    def position(self, symbol: str):
+        index = self.asset_index.get(symbol)
+        return float(self.positions[index]) if index is not None else 0.0
+
+    def deposit(self, amount, time=0):
+        if amount > 0:
+            self.balance += amount
+            # logged against asset -1 so the equity curve sees the cash arrive
+            self._reserve(1)
+            self.fills[self.fill_count] = (time, -1, 0.0, 0.0, 0.0, self.balance)
+            self.fill_count += 1
+            return True
+        return False
+
+    def _reserve(self, rows: int):
+        needed = self.fill_count + rows
+        if needed > len(self.fills):
+            capacity = len(self.fills)
+            while capacity < needed:
+                capacity *= 2
+            grown = np.empty(capacity, dtype=FILL_DTYPE)
+            grown[:self.fill_count] = self.fills[:self.fill_count]
+            self.fills = grown
+
+    def _costs(self, quantities: np.ndarray, prices: np.ndarray):
+        if self.slippage_model is not None:
+            prices = np.asarray(self.slippage_model(quantities, prices), dtype=np.float64)
+        if self.fee_model is not None:
+            fees = np.asarray(self.fee_model(quantities, prices), dtype=np.float64)
+        else:
+            fees = np.zeros(len(quantities), dtype=np.float64)
+        return prices, fees
+
+    def apply_fills(self, assets, quantities, prices, times=None):
+        # Positive quantities buy, negative sell. The whole batch is checked against cash and
+        # positions in one vectorized pass; only a batch that would overdraw somewhere is
+        # replayed fill by fill so the offending fills can be rejected. Returns the accepted mask.
+        quantities = np.asarray(quantities, dtype=np.float64)
+        prices = np.asarray(prices, dtype=np.float64)
+        count = len(quantities)
+        if isinstance(assets, str):
+            ids = np.full(count, self.asset_id(assets), dtype=np.int32)
+        else:
+            ids = np.array([self.asset_id(asset) if isinstance(asset, str) else asset for asset in assets], dtype=np.int32)
+        if times is None:
+            times = np.zeros(count, dtype=np.int64)
+        times = np.asarray(times, dtype=np.int64)
+        if not (len(ids) == len(prices) == len(times) == count):
+            raise ValueError("assets, quantities, prices and times must have the same length")
+        if np.any(ids >= len(self.positions)) or np.any(ids < 0):
+            raise ValueError("Unknown asset id in fills")
+        prices, fees = self._costs(quantities, prices)
+        self._coins = None
+        flows = -quantities * prices - fees
+        start = self.balance
+        cash = start + np.cumsum(flows)
+        accepted = np.ones(count, dtype=bool)
+        if count and (cash.min() < -1e-9 or not self._positions_ok(ids, quantities)):
+            accepted = self._apply_sequential(ids, quantities, flows)
+            cash = start + np.cumsum(np.where(accepted, flows, 0.0))
+        else:
+            np.add.at(self.positions, ids, quantities)
+        kept = np.flatnonzero(accepted)
+        self._reserve(len(kept))
+        log = self.fills[self.fill_count:self.fill_count + len(kept)]
+        log["time"] = times[kept]
+        log["asset"] = ids[kept]
+        log["quantity"] = quantities[kept]
+        log["price"] = prices[kept]
+        log["fee"] = fees[kept]
+        log["cash"] = cash[kept]
+        self.fill_count += len(kept)
+        if count:
+            self.balance = float(cash[-1])
+        return accepted
+
+    def _positions_ok(self, ids: np.ndarray, quantities: np.ndarray):
+        if not np.any(quantities < 0):
+            return True
+        # running position of every asset after each fill, grouped by asset with a stable sort
+        order = np.argsort(ids, kind="stable")
+        sorted_ids = ids[order]
+        running = np.cumsum(quantities[order])
+        starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]])
+        offsets = np.repeat(running[starts] - quantities[order][starts], np.diff(np.r_[starts, len(order)]))
+        return bool(np.all(self.positions[sorted_ids] + running - offsets >= -1e-12))
+
+    def _apply_sequential(self, ids, quantities, flows):
+        accepted = np.zeros(len(ids), dtype=bool)
+        for i, (asset, quantity, flow) in enumerate(zip(ids.tolist(), quantities.tolist(), flows.tolist())):
+            if self.balance + flow < -1e-9 or self.positions[asset] + quantity < -1e-12:
+                continue
+            self.balance += flow
+            self.positions[asset] += quantity
+            accepted[i] = True
+        return accepted
+
+    def buy(self, symbol, amount, cost, time=0):
+        if amount <= 0:
+            return False
+        return bool(self.apply_fills(symbol, [amount], [cost / amount], [time])[0])
+
+    def sell(self, symbol, amount, revenue, time=0):
+        # nothing held of an asset the ledger has never seen, and registering it would add an empty slot
+        if symbol not in self.asset_index or amount <= 0:
+            return False
+        return bool(self.apply_fills(symbol, [-amount], [revenue / amount], [time])[0])
+
+    def history(self):
+        return self.fills[:self.fill_count]
+
+    def mark_to_market(self, prices):
+        prices = np.asarray(prices, dtype=np.float64)
+        return self.balance + float(self.positions @ prices[:len(self.positions)])
+
+    def equity_curve(self, times, price_matrix):
+        # price_matrix has one row per entry in times and one column per asset (in asset id
+        # order); positions at each time are rebuilt from the fill log, which is expected to
+        # have been applied in time order
+        times = np.asarray(times, dtype=np.int64)
+        price_matrix = np.asarray(price_matrix, dtype=np.float64)
+        if price_matrix.shape != (len(times), len(self.assets)):
+            raise ValueError(f"price_matrix must have shape ({len(times)}, {len(self.assets)})")
+        fills = self.history()
+        last_fill = np.searchsorted(fills["time"], times, side="right") - 1
+        cash = np.where(last_fill >= 0, fills["cash"][np.maximum(last_fill, 0)], self.initial_balance)
+        equity = cash.copy()
+        for asset in range(len(self.assets)):
+            mine = fills[fills["asset"] == asset]
+            if not mine.size:
+                continue
+            held = np.cumsum(mine["quantity"])
+            index = np.searchsorted(mine["time"], times, side="right") - 1
+            equity += np.where(index >= 0, held[np.maximum(index, 0)], 0.0) * price_matrix[:, asset]
+        return equity
@@ -0,0 +1,116 @@
+from collections import deque
+import numpy as np
+
+
+class RollingWindow:
+    # Fixed-size kline window with amortized O(1) push. High/low come from monotonic
+    # deques, volume sums are kept as running totals and re-summed once per lap of the
+    # ring buffer so floating point drift can't build up over long replays.
+    __slots__ = ("size", "count", "opens", "volumes", "quote_volumes", "trades", "max_deque", "min_deque",
+                 "volume_sum", "quote_volume_sum", "trade_sum", "close", "close_time")
+
+    def __init__(self, size: int):
+        if not isinstance(size, int) or size <= 0:
+            raise ValueError("size must be a positive integer")
+        self.size = size
+        self.count = 0
+        self.opens = np.zeros(size, dtype=np.float64)
+        self.volumes = np.zeros(size, dtype=np.float64)
+        self.quote_volumes = np.zeros(size, dtype=np.float64)
+        self.trades = np.zeros(size, dtype=np.int64)
+        self.max_deque = deque()
+        self.min_deque = deque()
+        self.volume_sum = 0.0
+        self.quote_volume_sum = 0.0
+        self.trade_sum = 0
+        self.close = None
+        self.close_time = None
+
+    def push(self, open_price: float, high: float, low: float, close: float, volume: float, quote_volume: float, close_time: int, trades: int = 0):
+        i = self.count
+        slot = i % self.size
+        if i >= self.size:
+            self.volume_sum -= self.volumes[slot]
+            self.quote_volume_sum -= self.quote_volumes[slot]
+            self.trade_sum -= int(self.trades[slot])
+        self.opens[slot] = open_price
+        self.volumes[slot] = volume
+        self.quote_volumes[slot] = quote_volume
+        self.trades[slot] = trades
+        self.volume_sum += volume
+        self.quote_volume_sum += quote_volume
+        self.trade_sum += trades
+
+        oldest = i - self.size + 1
+        max_deque = self.max_deque
+        while max_deque and max_deque[-1][1] <= high:
+            max_deque.pop()
+        max_deque.append((i, high))
+        if max_deque[0][0] < oldest:
+            max_deque.popleft()
+        min_deque = self.min_deque
+        while min_deque and min_deque[-1][1] >= low:
+            min_deque.pop()
+        min_deque.append((i, low))
+        if min_deque[0][0] < oldest:
+            min_deque.popleft()
+
+        self.close = close
+        self.close_time = close_time
+        self.count = i + 1
+        if self.count % self.size == 0:
+            self.volume_sum = float(self.volumes.sum())
+            self.quote_volume_sum = float(self.quote_volumes.sum())
+
+    @property
+    def full(self):
+        return self.count >= self.size
+
+    @property
+    def open(self):
+        if self.count < self.size:
+            return float(self.opens[0])
+        return float(self.opens[self.count % self.size])
+
+    @property
+    def high(self):
+        return self.max_deque[0][1]
+
+    @property
+    def low(self):
+        return self.min_deque[0][1]
+
+    def mini_ticker(self, symbol: str):
+        return {
+            "e": "24hrMiniTicker",
+            "E": self.close_time,
+            "s": symbol,
+            "c": self.close,
+            "o": self.open,
+            "h": self.high,
+            "l": self.low,
+            "v": self.volume_sum,
+            "q": self.quote_volume_sum
+        }
+
+    def ticker(self, symbol: str, span_ms: int = 86400000):
+        # The 24hr ticker fields that can be rebuilt from klines, book and trade id fields are left out
+        open_price = self.open
+        change = self.close - open_price
+        return {
+            "e": "24hrTicker",
+            "E": self.close_time,
+            "s": symbol,
+            "p": change,
+            "P": change / open_price * 100 if open_price else 0.0,
+            "w": self.quote_volume_sum / self.volume_sum if self.volume_sum else 0.0,
+            "c": self.close,
+            "o": open_price,
+            "h": self.high,
+            "l": self.low,
+            "v": self.volume_sum,
+            "q": self.quote_volume_sum,
+            "O": self.close_time - span_ms + 1,
+            "C": self.close_time,
+            "n": self.trade_sum
+        }
@@ -0,0 +1,195 @@
+import os
+import json
+import hashlib
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+from src.simple_crypto.alg_testing.tester import AlgTester
+
+
+def parameter_grid(grid: dict[str, list]):
+    if not isinstance(grid, dict):
+        raise ValueError("grid must be a dict of parameter name to list of values")
+    names = list(grid.keys())
+    return [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+
+
+def train_test_split(rows: int, train_fraction: float = 0.7):
+    if not 0 < train_fraction < 1:
+        raise ValueError("train_fraction must be between 0 and 1")
+    cut = int(rows * train_fraction)
+    return [(slice(0, cut), slice(cut, rows))]
+
+
+def walk_forward_splits(rows: int, train: int, test: int, step: int | None = None):
+    # Rolling windows of `train` bars followed by `test` bars, moved forward by `step` (default `test`)
+    if train <= 0 or test <= 0:
+        raise ValueError("train and test must be positive")
+    if step is None:
+        step = test
+    splits = []
+    start = 0
+    while start + train + test <= rows:
+        splits.append((slice(start, start + train), slice(start + train, start + train + test)))
+        start += step
+    return splits
+
+
+def _job_config(job):
+    # Everything besides the grid point that shapes a result. Rows carry it, so a checkpoint
+    # written with another fee, data set or balance is never mistaken for this run's results.
+    # months is relative to today and span only counts rows, so the open times of the first and
+    # last loaded kline pin down which data the run actually covered.
+    factory = job["factory"]
+    config = [f"{factory.__module__}.{factory.__qualname__}", job["span"], job["window"], os.path.abspath(job["data_dir"]), job["months"], job["currency"], job["initial_balance"], job["fee"]]
+    return hashlib.sha1(json.dumps(config).encode()).hexdigest()[:16]
+
+
+def _window(columns):
+    open_time = columns["open_time"]
+    return [int(open_time[0]), int(open_time[-1])] if len(open_time) else None
+
+
+def _job_key(job):
+    # rows from checkpoints that predate the config field never match
+    return json.dumps([job["params"], job["coin"], job["interval"], job["split"], job["phase"], job.get("config")], sort_keys=True)
+
+
+def _run_job(job):
+    # Runs in a worker process: the kline columns are memory-mapped, so every worker reads the
+    # same page cache instead of receiving a pickled copy of the data
+    tester = AlgTester(initial_balance=job["initial_balance"], currency=job["currency"])
+    columns = tester.load_klines(job["coin"], job["data_dir"], job["months"], job["interval"], download=False)
+    if _window(columns) != job["window"]:
+        raise ValueError(f"{job['coin']} {job['interval']} klines changed since the sweep was planned")
+    span = job["span"]
+    columns = {name: column[span[0]:span[1]] for name, column in columns.items()}
+    algorithm = job["factory"](**job["params"])
+    result = tester.backtest_vectorized(algorithm, job["coin"], data={job["coin"]: columns}, fee=job["fee"])
+    coin_result = result["coins"][job["coin"]]
+    return {
+        "params": job["params"],
+        "coin": job["coin"],
+        "interval": job["interval"],
+        "split": job["split"],
+        "phase": job["phase"],
+        "config": job["config"],
+        "rows": span[1] - span[0],
+        "final_balance": result["final_balance"],
+        "total_return": result["total_return"],
+        "max_drawdown": coin_result["max_drawdown"],
+        "trades": int(len(coin_result["trades"]["index"])),
+    }
+
+
+class Sweep:
+    def __init__(self, factory, grid: dict[str, list], coins: str | list[str] = "BTC", intervals: str | list[str] = "1m", data_dir="Data", months=1, currency="USD",
+                 initial_balance=1000, fee=0.001, splits=None, workers: int | None = None, checkpoint: str | None = None):
+        # factory(**params) must return an object with signals(columns) and be importable by
+        # the worker processes (a module level class or function)
+        if not callable(factory):
+            raise ValueError("factory must be callable")
+        if isinstance(coins, str):
+            coins = [coins]
+        if isinstance(intervals, str):
+            intervals = [intervals]
+        if splits is not None and not callable(splits):
+            raise ValueError("splits must be a callable taking the row count and returning (train, test) slice pairs")
+        self.factory = factory
+        self.params = parameter_grid(grid)
+        self.coins = coins
+        self.intervals = intervals
+        self.data_dir = data_dir
+        self.months = months
+        self.currency = currency
+        self.initial_balance = initial_balance
+        self.fee = fee
+        self.splits = splits
+        self.workers = workers if workers is not None else os.cpu_count()
+        self.checkpoint = checkpoint
+
+    def jobs(self):
+        tester = AlgTester(initial_balance=self.initial_balance, currency=self.currency)
+        jobs = []
+        for coin in self.coins:
+            for interval in self.intervals:
+                columns = tester.load_klines(coin, self.data_dir, self.months, interval, download=False)
+                rows = len(columns["close"])
+                window = _window(columns)
+                if self.splits is None:
+                    spans = [(None, "full", (0, rows))]
+                else:
+                    spans = []
+                    for n, (train, test) in enumerate(self.splits(rows)):
+                        spans.append((n, "train", (train.start, train.stop)))
+                        spans.append((n, "test", (test.start, test.stop)))
+                for split, phase, span in spans:
+                    for params in self.params:
+                        jobs.append({"factory": self.factory, "params": params, "coin": coin, "interval": interval, "split": split, "phase": phase,
+                                     "span": span, "window": window, "data_dir": self.data_dir, "months": self.months, "currency": self.currency,
+                                     "initial_balance": self.initial_balance, "fee": self.fee})
+                        jobs[-1]["config"] = _job_config(jobs[-1])
+        return jobs
+
+    def _completed(self):
+        done = {}
+        if self.checkpoint is not None and os.path.isfile(self.checkpoint):
+            with open(self.checkpoint, 'r') as f:
+                for line in f:
+                    try:
+                        row = json.loads(line)
+                    except ValueError:
+                        # a line cut short by a crash, that job simply runs again
+                        continue
+                    done[_job_key(row)] = row
+        return done
+
+    def iter_results(self):
+        done = self._completed()
+        pending = []
+        for job in self.jobs():
+            if _job_key(job) in done:
+                yield done[_job_key(job)]
+            else:
+                pending.append(job)
+        if not pending:
+            return
+        checkpoint = None
+        if self.checkpoint is not None:
+            cut_short = False
+            if os.path.isfile(self.checkpoint) and os.path.getsize(self.checkpoint):
+                with open(self.checkpoint, 'rb') as f:
+                    f.seek(-1, os.SEEK_END)
+                    cut_short = f.read(1) != b"\n"
+            checkpoint = open(self.checkpoint, 'a')
+            if cut_short:
+                # don't glue new rows onto a line a crash cut short
+                checkpoint.write("\n")
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                futures = [pool.submit(_run_job, job) for job in pending]
+                for future in as_completed(futures):
+                    row = future.result()
+                    if checkpoint is not None:
+                        checkpoint.write(json.dumps(row) + "\n")
+                        checkpoint.flush()
+                    yield row
+        finally:
+            if checkpoint is not None:
+                checkpoint.close()
+
+    def run(self):
+        rows = list(self.iter_results())
+        table = pd.DataFrame(rows)
+        if len(table):
+            table = pd.concat([table.drop(columns=["params"]), pd.json_normalize(table["params"].tolist())], axis=1)
+        return table
+
+
+def walk_forward_report(table: pd.DataFrame, param_names: list[str], metric: str = "total_return"):
+    # For every split pick the parameters that did best on the train window and report how
+    # those same parameters did on the following test window
+    train = table[table["phase"] == "train"]
+    test = table[table["phase"] == "test"]
+    best = train.loc[train.groupby(["coin", "interval", "split"])[metric].idxmax()]
+    return best[["coin", "interval", "split"] + param_names].merge(test, on=["coin", "interval", "split"] + param_names)
@@ -1,8 +1,15 @@
+from collections import namedtuple
+import numpy as np
 from src.simple_crypto.market_access import MarketAccess
-from testing_wallet import TestWallet
-from back_market import BackMarket
+from src.simple_crypto.kline_store import KlineStore, KLINE_DTYPES
+from src.simple_crypto.downloader import months_back
+from src.simple_crypto.resample import ResampleCache
+from src.simple_crypto.alg_testing.testing_wallet import TestWallet
+from src.simple_crypto.alg_testing.back_market import BackMarket
 from typing import Literal
 
+Kline = namedtuple("Kline", list(KLINE_DTYPES.keys()))
+
 
 class AlgTester:
     def __init__(self, market_class=MarketAccess, wallet_class=TestWallet, initial_balance=1000, currency='USD'):
@@ -12,6 +19,98 @@ class AlgTester:
         self.currency = currency
 
     def backtest(self, algorithm_class, back_market_class=BackMarket, data_dir="Data", months=1, coin="BTC", interval:Literal["1s", "1m", "3m", "5m", "15m", "30m", "1h", "2h", "4h", "6h", "8h", "12h", "1d"]="1m"):
-        back_market = back_market_class(self.market_class, data_dir=data_dir)
+        # the algorithm subscribes its trackers to the BackMarket exactly as it would to a live MarketAccess
+        back_market = back_market_class(self.market_class, data_dir=data_dir, months=months, interval=interval)
+        wallet = self.wallet_class(initial_balance=self.init_balance, currency=self.currency)
+        algorithm = algorithm_class(market=back_market, wallet=wallet, coin=coin, currency=self.currency)
+        back_market.run()
+        return wallet
+
+    def load_klines(self, coin: str, data_dir="Data", months=1, interval="1m", download=True, resample_from: str | None = None):
+        # resample_from builds the interval out of finer stored klines instead of downloading it,
+        # which is also the only way to get custom intervals such as "7m"
+        if resample_from is not None and resample_from != interval:
+            if download:
+                self.market_class.get_history(coin, self.currency, resample_from, months, data_dir=data_dir)
+            dataset = ResampleCache(data_dir).open(coin, self.currency, interval, resample_from)
+        else:
+            if download:
+                self.market_class.get_history(coin, self.currency, interval, months, data_dir=data_dir)
+            dataset = KlineStore(data_dir).open(coin, self.currency, interval)
+        wanted = [month.strftime('%Y-%m') for month in months_back(months)]
+        present = [month for month in dataset.months if month in wanted]
+        if not present:
+            raise ValueError(f"No {interval} data for {coin.upper()}{self.currency.upper()} in the last {months} months")
+        span = slice(dataset.month_slice(present[0]).start, dataset.month_slice(present[-1]).stop)
+        # views into the memory map, nothing is copied until an algorithm touches it
+        return {name: column[span] for name, column in dataset.columns.items()}
+
+    def _gather(self, coins, data, data_dir, months, interval, download):
+        if isinstance(coins, str):
+            coins = [coins]
+        if data is None:
+            data = {coin: self.load_klines(coin, data_dir, months, interval, download) for coin in coins}
+        missing = [coin for coin in coins if coin not in data]
+        if missing:
+            raise ValueError(f"No data given for: {', '.join(missing)}")
+        return coins, data
+
+    def backtest_vectorized(self, algorithm, coins: str | list[str] = "BTC", data_dir="Data", months=1, interval:Literal["1s", "1m", "3m", "5m", "15m", "30m", "1h", "2h", "4h", "6h", "8h", "12h", "1d"]="1m", fee=0.001, data=None, download=True):
+        # algorithm.signals(columns) returns the fraction of a coin's sleeve to hold after each
+        # bar closes. The sleeve is rebalanced to that fraction at the close, so the position
+        # earns the next bar's return and pays `fee` on every change of the fraction.
+        if not hasattr(algorithm, "signals"):
+            raise ValueError("algorithm must provide a signals(columns) method")
+        coins, data = self._gather(coins, data, data_dir, months, interval, download)
+        sleeve = self.init_balance / len(coins)
+        results = {}
+        for coin in coins:
+            columns = data[coin]
+            close = np.asarray(columns["close"], dtype=np.float64)
+            target = np.asarray(algorithm.signals(columns), dtype=np.float64)
+            if target.shape != close.shape:
+                raise ValueError(f"signals for {coin} must have one value per bar ({close.shape[0]}), got {target.shape}")
+            target = np.clip(np.nan_to_num(target), 0, 1)
+            returns = np.zeros_like(close)
+            returns[1:] = close[1:] / close[:-1] - 1
+            held = np.zeros_like(target)
+            held[1:] = target[:-1]
+            turnover = np.abs(np.diff(target, prepend=0.0))
+            equity = sleeve * np.cumprod((1 + held * returns) * (1 - fee * turnover))
+            trades = np.flatnonzero(turnover)
+            peak = np.maximum.accumulate(equity)
+            results[coin] = {
+                "times": np.asarray(columns["close_time"]),
+                "equity": equity,
+                "position": target,
+                "trades": {"index": trades, "price": close[trades], "change": np.diff(target, prepend=0.0)[trades]},
+                "final_balance": float(equity[-1]) if len(equity) else sleeve,
+                "max_drawdown": float(np.max(1 - equity / peak)) if len(equity) else 0.0,
+            }
+        final_balance = sum(result["final_balance"] for result in results.values())
+        return {"coins": results, "final_balance": final_balance, "total_return": final_balance / self.init_balance - 1}
+
+    def backtest_events(self, algorithm_class, coins: str | list[str] = "BTC", data_dir="Data", months=1, interval:Literal["1s", "1m", "3m", "5m", "15m", "30m", "1h", "2h", "4h", "6h", "8h", "12h", "1d"]="1m", data=None, download=True):
+        # Synchronous fallback for algorithms that need per-bar state: every coin's klines are
+        # merged by close time and fed to on_kline(kline) in a plain loop, with no queue or event loop
+        coins, data = self._gather(coins, data, data_dir, months, interval, download)
         wallet = self.wallet_class(initial_balance=self.init_balance, currency=self.currency)
-        algorithm = algorithm_class(market=back_market.market, wallet=wallet, coin=coin, currency=self.currency)
+        if not callable(getattr(wallet, "position", None)):
+            raise ValueError("wallet_class must provide a position(symbol) method")
+        algorithms = [algorithm_class(market=None, wallet=wallet, coin=coin, currency=self.currency) for coin in coins]
+        rows = [list(zip(*[np.asarray(data[coin][name]).tolist() for name in KLINE_DTYPES])) for coin in coins]
+        times = np.concatenate([np.asarray(data[coin]["close_time"]) for coin in coins])
+        coin_ids = np.concatenate([np.full(len(rows[c]), c) for c in range(len(coins))])
+        row_ids = np.concatenate([np.arange(len(rows[c])) for c in range(len(coins))])
+        order = np.argsort(times, kind="stable")
+        # equity only asks the wallet for balance and position(coin), so any wallet class works
+        prices = [0.0] * len(coins)
+        equity = np.empty(len(order), dtype=np.float64)
+        close_index = list(KLINE_DTYPES).index("close")
+        for n, (c, i) in enumerate(zip(coin_ids[order].tolist(), row_ids[order].tolist())):
+            kline = Kline(*rows[c][i])
+            prices[c] = kline[close_index]
+            algorithms[c].on_kline(kline)
+            equity[n] = wallet.balance + sum(wallet.position(coin) * price for coin, price in zip(coins, prices))
+        final_balance = float(equity[-1]) if len(equity) else self.init_balance
+        return {"times": times[order], "equity": equity, "wallet": wallet, "final_balance": final_balance, "total_return": final_balance / self.init_balance - 1}
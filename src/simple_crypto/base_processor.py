@@ -1,34 +1,155 @@
 import pandas as pd
 from typing import Literal
 import os
+from collections import deque
 from datetime import datetime, timedelta
 import numpy as np
+from src.simple_crypto.misc import KLINE_COLUMNS
+from src.simple_crypto.kline_store import KlineDataset, _has_header
 
-def get_peaks(data: str | list[str] | pd.DataFrame, column: str = "close", time_col: str = "close_time",area: int = 20):
+
+def sliding_max(values: np.ndarray, window: int):
+    # van Herk/Gil-Werman: with the array cut into blocks of `window`, any window spans at most
+    # two blocks, so its max is the suffix max of the first block combined with the prefix max
+    # of the second. Three passes over the data whatever the window size.
+    n = len(values)
+    if window > n:
+        return np.empty(0, dtype=values.dtype)
+    blocks = -(-n // window)
+    padded = np.full(blocks * window, -np.inf)
+    padded[:n] = values
+    padded = padded.reshape(blocks, window)
+    prefix = np.maximum.accumulate(padded, axis=1).ravel()
+    suffix = np.maximum.accumulate(padded[:, ::-1], axis=1)[:, ::-1].ravel()
+    return np.maximum(suffix[:n - window + 1], prefix[window - 1:n])
+
+
+def sliding_min(values: np.ndarray, window: int):
+    return -sliding_max(-values, window)
+
+
+def _read_columns(path: str, column: str, time_col: str):
+    # Only the two needed columns are parsed, headerless Binance dumps get the kline names
+    if _has_header(path):
+        data = pd.read_csv(path, usecols=[column, time_col])
+    else:
+        data = pd.read_csv(path, header=None, names=KLINE_COLUMNS, usecols=[column, time_col])
+    if column not in data.columns:
+        raise ValueError(f"Column '{column}' does not exist in data")
+    if time_col not in data.columns:
+        raise ValueError(f"Time column '{time_col}' does not exist in data")
+    return data[column].to_numpy(dtype=np.float64), data[time_col].to_numpy()
+
+
+def find_extrema(values: np.ndarray, area: int):
+    # A point is a peak when it is above the `area` points before it and not below the `area`
+    # points after it (so a flat top counts once, at its first bar), a trough the other way
+    # round. The last `area` points can't be confirmed yet and are never reported.
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    if n <= area:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    padded = np.full(n + 2 * area, -np.inf)
+    padded[area:area + n] = values
+    highs = sliding_max(padded, area)
+    padded[area:area + n] = -values
+    lows = -sliding_max(padded, area)
+    confirmed = values[:n - area]
+    left_high, right_high = highs[:n - area], highs[area + 1:n + 1]
+    left_low, right_low = lows[:n - area], lows[area + 1:n + 1]
+    peaks = np.flatnonzero((confirmed > left_high) & (confirmed >= right_high))
+    troughs = np.flatnonzero((confirmed < left_low) & (confirmed <= right_low))
+    return peaks, troughs
+
+
+def get_peaks(data: str | list[str] | pd.DataFrame | KlineDataset | dict, column: str = "close", time_col: str = "close_time",area: int = 20):
     if isinstance(data, str):
         if not os.path.isfile(data):
             raise ValueError("File does not exist")
-        data = pd.read_csv(data)
+        values, times = _read_columns(data, column, time_col)
     elif isinstance(data, list):
         for item in data:
             if not isinstance(item, str):
                 raise ValueError("All items in the data list must be strings (file paths)")
             if not os.path.isfile(item):
                 raise ValueError(f"File {item} does not exist")
-        data = pd.concat([pd.read_csv(item) for item in data], ignore_index=True)
-    elif not isinstance(data, pd.DataFrame):
-        raise ValueError("Data must be a string (file path), list of strings, or pandas DataFrame")
-
-    if column not in data.columns:
-        raise ValueError(f"Column '{column}' does not exist in data")
-
-    if time_col not in data.columns:
-        raise ValueError(f"Time column '{time_col}' does not exist in data")
+        parts = [_read_columns(item, column, time_col) for item in data]
+        values = np.concatenate([part[0] for part in parts]) if parts else np.empty(0)
+        times = np.concatenate([part[1] for part in parts]) if parts else np.empty(0, dtype=np.int64)
+    elif isinstance(data, (pd.DataFrame, KlineDataset, dict)):
+        # memory-mapped KlineStore columns are read in place, not copied into a DataFrame
+        columns = data.columns if isinstance(data, KlineDataset) else data
+        if column not in columns:
+            raise ValueError(f"Column '{column}' does not exist in data")
+        if time_col not in columns:
+            raise ValueError(f"Time column '{time_col}' does not exist in data")
+        values, times = np.asarray(columns[column]), np.asarray(columns[time_col])
+    else:
+        raise ValueError("Data must be a string (file path), list of strings, pandas DataFrame, KlineDataset or dict of columns")
 
     if not isinstance(area, int) or area <= 0:
         raise ValueError("Area must be a positive integer")
 
-    peaks = []
-    # TODO: Implement using same strategy as sound_processor
+    peak_index, trough_index = find_extrema(values, area)
+    index = np.concatenate([peak_index, trough_index])
+    kinds = np.concatenate([np.ones(len(peak_index), dtype=np.int8), -np.ones(len(trough_index), dtype=np.int8)])
+    order = np.argsort(index, kind="stable")
+    index, kinds = index[order], kinds[order]
+    peaks = [(time, value, "peak" if kind > 0 else "trough") for time, value, kind in zip(times[index].tolist(), values[index].tolist(), kinds.tolist())]
+    return peaks
+
+
+class PeakDetector:
+    # Streaming version of get_peaks: each pushed bar confirms the bar `area` places back, and
+    # the extrema it reports are exactly the ones get_peaks finds on the same series.
+    __slots__ = ("area", "count", "values", "times", "high_window", "low_window", "left_highs", "left_lows")
+
+    def __init__(self, area: int = 20):
+        if not isinstance(area, int) or area <= 0:
+            raise ValueError("Area must be a positive integer")
+        self.area = area
+        self.count = 0
+        self.values = deque(maxlen=area + 1)
+        self.times = deque(maxlen=area + 1)
+        # monotonic deques of (index, value) for the max/min of the last `area` bars
+        self.high_window = deque()
+        self.low_window = deque()
+        # max/min of the `area` bars before each of the last area + 1 bars
+        self.left_highs = deque(maxlen=area + 1)
+        self.left_lows = deque(maxlen=area + 1)
+
+    def push(self, time, value: float):
+        value = float(value)
+        i = self.count
+        self.left_highs.append(self.high_window[0][1] if self.high_window else -np.inf)
+        self.left_lows.append(self.low_window[0][1] if self.low_window else np.inf)
+        while self.high_window and self.high_window[-1][1] <= value:
+            self.high_window.pop()
+        self.high_window.append((i, value))
+        while self.low_window and self.low_window[-1][1] >= value:
+            self.low_window.pop()
+        self.low_window.append((i, value))
+        if self.high_window[0][0] <= i - self.area:
+            self.high_window.popleft()
+        if self.low_window[0][0] <= i - self.area:
+            self.low_window.popleft()
+        self.values.append(value)
+        self.times.append(time)
+        self.count += 1
+        if self.count <= self.area:
+            return []
+        # the bar `area` back now has its full right side: the window maxes over the last `area` bars
+        candidate = self.values[0]
+        found = []
+        if candidate > self.left_highs[0] and candidate >= self.high_window[0][1]:
+            found.append((self.times[0], candidate, "peak"))
+        if candidate < self.left_lows[0] and candidate <= self.low_window[0][1]:
+            found.append((self.times[0], candidate, "trough"))
+        return found
 
-    return peaks
\ No newline at end of file
+    def on_kline(self, msg: dict, field: Literal["o", "h", "l", "c"] = "c"):
+        # Takes a kline stream message and only counts bars once they have closed
+        kline = msg["k"]
+        if not kline["x"]:
+            return []
+        return self.push(kline["T"], float(kline[field]))
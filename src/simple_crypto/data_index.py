@@ -0,0 +1,137 @@
+import os
+import json
+import threading
+
+
+class DataIndex:
+    # Persistent manifest of the months available under a data directory. Each coin is
+    # only rescanned when the mtime of its directory (or one of its datasets) changes.
+    def __init__(self, data_dir: str = "Data", manifest_name: str = "manifest.json"):
+        if not isinstance(data_dir, str):
+            raise ValueError("data_dir must be a string")
+        self.data_dir = data_dir
+        self.manifest_file = os.path.join(data_dir, manifest_name)
+        self.coins = {}
+        self.lock = threading.Lock()
+        if os.path.isfile(self.manifest_file):
+            try:
+                with open(self.manifest_file, 'r') as f:
+                    self.coins = json.load(f)["coins"]
+            except (ValueError, KeyError):
+                self.coins = {}
+
+    def _dir_mtimes(self, coin_dir: str):
+        mtimes = {"": os.stat(coin_dir).st_mtime_ns}
+        for entry in os.scandir(coin_dir):
+            if entry.is_dir():
+                mtimes[entry.name] = entry.stat().st_mtime_ns
+        return mtimes
+
+    def _scan_csv(self, path: str):
+        rows = 0
+        first_line = last_line = None
+        with open(path, 'rb') as f:
+            for line in f:
+                if not line[:1].isdigit():
+                    continue
+                if first_line is None:
+                    first_line = line
+                last_line = line
+                rows += 1
+        first = int(first_line.split(b",")[0]) if first_line else None
+        last = int(last_line.split(b",")[6]) if last_line else None
+        if first is not None and first > 10 ** 14:
+            first //= 1000
+            last //= 1000
+        return rows, first, last
+
+    def _scan_coin(self, coin: str):
+        coin_dir = os.path.join(self.data_dir, coin)
+        entries = {}
+        names = sorted(os.listdir(coin_dir))
+        for name in names:
+            path = os.path.join(coin_dir, name)
+            if not name.endswith(".csv") or not os.path.isfile(path):
+                continue
+            breakdown = name.removesuffix(".csv").split("-")
+            if len(breakdown) != 5:
+                continue
+            rows, first, last = self._scan_csv(path)
+            month = f"{breakdown[3]}-{breakdown[4]}"
+            entries.setdefault(breakdown[1], {}).setdefault(breakdown[2], {})[month] = {"path": path, "rows": rows, "first": first, "last": last}
+        # converted datasets take precedence over leftover CSVs for the same month
+        for name in names:
+            path = os.path.join(coin_dir, name)
+            breakdown = name.split("-")
+            if len(breakdown) != 3 or not os.path.isfile(os.path.join(path, "meta.json")):
+                continue
+            with open(os.path.join(path, "meta.json"), 'r') as f:
+                meta = json.load(f)
+            for month, (start, stop, first, last) in meta["months"].items():
+                entries.setdefault(breakdown[1], {}).setdefault(breakdown[2], {})[month] = {"path": path, "rows": stop - start, "first": first, "last": last}
+        return entries
+
+    def refresh(self):
+        with self.lock:
+            if not os.path.isdir(self.data_dir):
+                changed = bool(self.coins)
+                self.coins = {}
+                return changed
+            changed = False
+            present = set()
+            for entry in os.scandir(self.data_dir):
+                if not entry.is_dir() or entry.name.startswith("."):
+                    continue
+                present.add(entry.name)
+                mtimes = self._dir_mtimes(entry.path)
+                cached = self.coins.get(entry.name)
+                if cached is not None and cached["mtimes"] == mtimes:
+                    continue
+                self.coins[entry.name] = {"mtimes": mtimes, "entries": self._scan_coin(entry.name)}
+                changed = True
+            for coin in [coin for coin in self.coins if coin not in present]:
+                del self.coins[coin]
+                changed = True
+            if changed:
+                with open(self.manifest_file + ".tmp", 'w') as f:
+                    json.dump({"coins": self.coins}, f)
+                os.replace(self.manifest_file + ".tmp", self.manifest_file)
+            return changed
+
+    def available(self):
+        with self.lock:
+            return {coin: {currency: {interval: {month: entry["path"] for month, entry in months.items()}
+                                      for interval, months in intervals.items()}
+                           for currency, intervals in cached["entries"].items()}
+                    for coin, cached in self.coins.items()}
+
+    def entries(self, coin: str, currency: str, interval: str):
+        with self.lock:
+            cached = self.coins.get(coin.upper())
+            if cached is None:
+                return {}
+            return dict(cached["entries"].get(currency.upper(), {}).get(interval, {}))
+
+    def months_covering(self, coin: str, currency: str, interval: str, t0: int, t1: int):
+        if t0 > t1:
+            raise ValueError("t0 must not be after t1")
+        covering = []
+        for month, entry in sorted(self.entries(coin, currency, interval).items()):
+            if entry["first"] is None:
+                continue
+            if entry["first"] <= t1 and entry["last"] >= t0:
+                covering.append(month)
+        return covering
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(data_dir: str = "Data"):
+    with _indexes_lock:
+        index = _indexes.get(data_dir)
+        if index is None:
+            index = DataIndex(data_dir)
+            _indexes[data_dir] = index
+        return index
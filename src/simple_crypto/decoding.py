@@ -0,0 +1,212 @@
+import json
+
+# The fastest JSON parser installed wins, the standard library is the fallback
+try:
+    import orjson
+    json_loads = orjson.loads
+    JSON_BACKEND = "orjson"
+except ImportError:
+    try:
+        import ujson
+        json_loads = ujson.loads
+        JSON_BACKEND = "ujson"
+    except ImportError:
+        json_loads = json.loads
+        JSON_BACKEND = "json"
+
+
+class Message:
+    # Typed stream messages: numeric strings are parsed once at decode time and fields are
+    # plain attributes. KEYS maps Binance's single letter keys onto the attributes, so
+    # trackers written against the raw dicts (msg["p"], msg.get("k")) keep working.
+    __slots__ = ()
+    EVENT = None
+    KEYS = {}
+
+    def __getitem__(self, key):
+        name = self.KEYS.get(key)
+        if name is None:
+            raise KeyError(key)
+        return getattr(self, name)
+
+    def get(self, key, default=None):
+        name = self.KEYS.get(key)
+        if name is None:
+            return default
+        return getattr(self, name)
+
+    def __contains__(self, key):
+        return key in self.KEYS
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)})"
+
+
+class Trade(Message):
+    __slots__ = ("event_time", "symbol", "trade_id", "price", "quantity", "trade_time", "buyer_maker")
+    EVENT = "trade"
+    KEYS = {"e": "EVENT", "E": "event_time", "s": "symbol", "t": "trade_id", "p": "price", "q": "quantity", "T": "trade_time", "m": "buyer_maker"}
+
+    def __init__(self, event_time, symbol, trade_id, price, quantity, trade_time, buyer_maker):
+        self.event_time = event_time
+        self.symbol = symbol
+        self.trade_id = trade_id
+        self.price = price
+        self.quantity = quantity
+        self.trade_time = trade_time
+        self.buyer_maker = buyer_maker
+
+    @classmethod
+    def from_json(cls, data: dict):
+        return cls(data["E"], data["s"], data["t"], float(data["p"]), float(data["q"]), data["T"], data["m"])
+
+
+class AggTrade(Message):
+    __slots__ = ("event_time", "symbol", "agg_id", "price", "quantity", "first_trade_id", "last_trade_id", "trade_time", "buyer_maker")
+    EVENT = "aggTrade"
+    KEYS = {"e": "EVENT", "E": "event_time", "s": "symbol", "a": "agg_id", "p": "price", "q": "quantity", "f": "first_trade_id", "l": "last_trade_id", "T": "trade_time", "m": "buyer_maker"}
+
+    def __init__(self, event_time, symbol, agg_id, price, quantity, first_trade_id, last_trade_id, trade_time, buyer_maker):
+        self.event_time = event_time
+        self.symbol = symbol
+        self.agg_id = agg_id
+        self.price = price
+        self.quantity = quantity
+        self.first_trade_id = first_trade_id
+        self.last_trade_id = last_trade_id
+        self.trade_time = trade_time
+        self.buyer_maker = buyer_maker
+
+    @classmethod
+    def from_json(cls, data: dict):
+        return cls(data["E"], data["s"], data["a"], float(data["p"]), float(data["q"]), data["f"], data["l"], data["T"], data["m"])
+
+
+class Kline(Message):
+    # The nested "k" object is flattened into the message, msg["k"] returns the message itself
+    __slots__ = ("event_time", "symbol", "interval", "open_time", "close_time", "open", "high", "low", "close", "volume",
+                 "trades", "closed", "quote_volume", "taker_buy_volume", "taker_buy_quote_volume")
+    EVENT = "kline"
+    KEYS = {"e": "EVENT", "E": "event_time", "s": "symbol", "k": "kline", "i": "interval", "t": "open_time", "T": "close_time", "o": "open", "h": "high",
+            "l": "low", "c": "close", "v": "volume", "n": "trades", "x": "closed", "q": "quote_volume", "V": "taker_buy_volume", "Q": "taker_buy_quote_volume"}
+
+    def __init__(self, event_time, symbol, interval, open_time, close_time, open, high, low, close, volume, trades, closed, quote_volume, taker_buy_volume, taker_buy_quote_volume):
+        self.event_time = event_time
+        self.symbol = symbol
+        self.interval = interval
+        self.open_time = open_time
+        self.close_time = close_time
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+        self.trades = trades
+        self.closed = closed
+        self.quote_volume = quote_volume
+        self.taker_buy_volume = taker_buy_volume
+        self.taker_buy_quote_volume = taker_buy_quote_volume
+
+    @property
+    def kline(self):
+        return self
+
+    @classmethod
+    def from_json(cls, data: dict):
+        k = data["k"]
+        return cls(data["E"], data["s"], k["i"], k["t"], k["T"], float(k["o"]), float(k["h"]), float(k["l"]), float(k["c"]), float(k["v"]),
+                   k["n"], k["x"], float(k["q"]), float(k["V"]), float(k["Q"]))
+
+
+class BookTicker(Message):
+    __slots__ = ("update_id", "symbol", "bid_price", "bid_quantity", "ask_price", "ask_quantity")
+    EVENT = "bookTicker"
+    KEYS = {"u": "update_id", "s": "symbol", "b": "bid_price", "B": "bid_quantity", "a": "ask_price", "A": "ask_quantity"}
+
+    def __init__(self, update_id, symbol, bid_price, bid_quantity, ask_price, ask_quantity):
+        self.update_id = update_id
+        self.symbol = symbol
+        self.bid_price = bid_price
+        self.bid_quantity = bid_quantity
+        self.ask_price = ask_price
+        self.ask_quantity = ask_quantity
+
+    @classmethod
+    def from_json(cls, data: dict):
+        return cls(data["u"], data["s"], float(data["b"]), float(data["B"]), float(data["a"]), float(data["A"]))
+
+
+class DepthUpdate(Message):
+    # bids and asks are lists of (price, quantity) float tuples
+    __slots__ = ("event_time", "symbol", "first_update_id", "final_update_id", "bids", "asks")
+    EVENT = "depthUpdate"
+    KEYS = {"e": "EVENT", "E": "event_time", "s": "symbol", "U": "first_update_id", "u": "final_update_id", "b": "bids", "a": "asks"}
+
+    def __init__(self, event_time, symbol, first_update_id, final_update_id, bids, asks):
+        self.event_time = event_time
+        self.symbol = symbol
+        self.first_update_id = first_update_id
+        self.final_update_id = final_update_id
+        self.bids = bids
+        self.asks = asks
+
+    @classmethod
+    def from_json(cls, data: dict):
+        return cls(data["E"], data["s"], data["U"], data["u"], [(float(price), float(quantity)) for price, quantity in data["b"]],
+                   [(float(price), float(quantity)) for price, quantity in data["a"]])
+
+
+MESSAGE_TYPES = {
+    "trade": Trade,
+    "aggTrade": AggTrade,
+    "kline": Kline,
+    "bookTicker": BookTicker,
+    "depth": DepthUpdate,
+}
+
+
+class MessageDecoder:
+    # Turns raw frames into what trackers receive. With typed=False the frames stay dicts and
+    # only the faster JSON parser is gained. Streams without a message type (tickers) always
+    # stay dicts.
+    def __init__(self, typed: bool = False, loads=None):
+        if not isinstance(typed, bool):
+            raise ValueError("typed must be a bool")
+        if loads is not None and not callable(loads):
+            raise ValueError("loads must be callable")
+        self.typed = typed
+        self.loads = loads if loads is not None else json_loads
+        self.converters = {}
+
+    def converter(self, stream: str):
+        converter = self.converters.get(stream)
+        if converter is None:
+            # btcusd@kline_1m -> kline, btcusd@depth@100ms -> depth
+            event = stream.split("@")[1].split("_")[0] if "@" in stream else stream
+            message_type = MESSAGE_TYPES.get(event) if self.typed else None
+            converter = message_type.from_json if message_type is not None else False
+            self.converters[stream] = converter
+        return converter
+
+    def convert(self, stream: str, data):
+        converter = self.converter(stream)
+        if converter is False or not isinstance(data, dict):
+            return data
+        return converter(data)
+
+    def decode(self, stream: str, raw):
+        return self.convert(stream, self.loads(raw))
+
+    def decode_combined(self, raw):
+        # Returns (stream, data), stream is None for replies to SUBSCRIBE/UNSUBSCRIBE
+        message = self.loads(raw)
+        stream = message.get("stream")
+        if stream is None or "data" not in message:
+            return None, message
+        return stream, self.convert(stream, message["data"])
@@ -0,0 +1,148 @@
+import os
+import zipfile
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dateutil.relativedelta import relativedelta
+import requests
+from requests.adapters import HTTPAdapter
+from colorama import Fore
+from src.simple_crypto.kline_store import KlineStore, parse_klines
+
+KLINE_SOURCES = [
+    "https://data.binance.vision/data/spot/monthly/klines/{pair}/{interval}/{pair}-{interval}-{month}.zip",
+    "https://data.binance.us/public_data/spot/monthly/klines/{pair}/{interval}/{pair}-{interval}-{month}.zip",
+]
+
+
+def months_back(num_months: int, today: datetime | None = None):
+    if today is None:
+        today = datetime.today()
+    return [today - relativedelta(months=i) for i in range(num_months, 0, -1)]
+
+
+class HistoryDownloader:
+    def __init__(self, data_dir: str = "Data", workers: int = 8, sources: list[str] | None = None, timeout: float = 30, chunk_size: int = 1 << 20, logger=None):
+        if not isinstance(workers, int) or workers <= 0:
+            raise ValueError("workers must be a positive integer")
+        if sources is None:
+            sources = KLINE_SOURCES
+        if not isinstance(sources, list) or not all(isinstance(source, str) for source in sources):
+            raise ValueError("sources must be a list of strings")
+        self.store = KlineStore(data_dir)
+        self.workers = workers
+        self.sources = sources
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.partial_dir = os.path.join(data_dir, ".partial")
+        if logger is None:
+            from src.simple_crypto.market_access import MarketAccess
+            logger = MarketAccess.BaseLogger()
+        self.logger = logger
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _fetch(self, symbol: str, currency: str, interval: str, month: str):
+        legacy_csv = os.path.join(self.store.data_dir, symbol, f"{symbol}-{currency}-{interval}-{month}.csv")
+        if os.path.isfile(legacy_csv):
+            return parse_klines(legacy_csv)
+        os.makedirs(self.partial_dir, exist_ok=True)
+        pair = f"{symbol}{currency}"
+        partial = os.path.join(self.partial_dir, f"{pair}-{interval}-{month}.zip.part")
+        for source in self.sources:
+            url = source.format(pair=pair, interval=interval, month=month)
+            # a corrupt archive is fetched once more from byte 0 before moving on to the next source
+            for attempt in range(2):
+                try:
+                    if not self._download_archive(url, partial):
+                        break
+                    columns = self._read_archive(partial)
+                except zipfile.BadZipFile as e:
+                    os.remove(partial)
+                    self.logger.log(content=f"Corrupt archive from {url} ({e}), starting over", title="[DOWNLOAD-WARNING]", title_color=Fore.YELLOW)
+                    continue
+                except requests.RequestException as e:
+                    # the partial stays behind, the next source or run resumes it
+                    self.logger.log(content=f"Fetching {url} failed: {e}", title="[DOWNLOAD-WARNING]", title_color=Fore.YELLOW)
+                    break
+                except Exception as e:
+                    if os.path.isfile(partial):
+                        os.remove(partial)
+                    self.logger.log(content=f"Reading {url} failed: {e}", title="[DOWNLOAD-WARNING]", title_color=Fore.YELLOW)
+                    break
+                os.remove(partial)
+                return columns
+        self.logger.log(content=f"No source could provide {pair} {interval} {month}", title="[DOWNLOAD-WARNING]", title_color=Fore.YELLOW)
+        return None
+
+    def _download_archive(self, url: str, partial: str):
+        # Returns False when the source doesn't have the archive. A partial file left behind by an
+        # earlier attempt is resumed with a Range request.
+        done = os.path.getsize(partial) if os.path.isfile(partial) else 0
+        headers = {"Range": f"bytes={done}-"} if done else {}
+        with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as r:
+            if r.status_code == 416:
+                # the partial file already holds the whole archive
+                return True
+            if r.status_code not in (200, 206):
+                return False
+            with open(partial, 'ab' if r.status_code == 206 else 'wb') as f:
+                for chunk in r.iter_content(chunk_size=self.chunk_size):
+                    f.write(chunk)
+        return True
+
+    def _read_archive(self, partial: str):
+        with zipfile.ZipFile(partial, 'r') as zip_ref:
+            names = zip_ref.namelist()
+            if not names:
+                raise zipfile.BadZipFile("archive is empty")
+            with zip_ref.open(names[0]) as f:
+                return parse_klines(f)
+
+    def download(self, symbols: str | list[str], currencies: str | list[str] = "USD", intervals: str | list[str] = "1m", num_months: int = 1):
+        if isinstance(symbols, str):
+            symbols = [symbols]
+        if isinstance(currencies, str):
+            currencies = [currencies]
+        if isinstance(intervals, str):
+            intervals = [intervals]
+        if not isinstance(num_months, int) or num_months <= 0:
+            raise ValueError("num_months must be a positive integer")
+        months = [month.strftime('%Y-%m') for month in months_back(num_months)]
+        datasets = [(symbol.upper(), currency.upper(), interval) for symbol in symbols for currency in currencies for interval in intervals]
+        pending = {}
+        for dataset in datasets:
+            stored = self.store.months(*dataset)
+            pending[dataset] = [month for month in months if month not in stored]
+
+        # Months of one dataset are appended strictly in order, holding back any that finish early
+        results = {dataset: {} for dataset in datasets}
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {}
+            for month in months:
+                for dataset in datasets:
+                    if month in pending[dataset]:
+                        futures[pool.submit(self._fetch, *dataset, month)] = (dataset, month)
+            for future in as_completed(futures):
+                dataset, month = futures[future]
+                try:
+                    results[dataset][month] = future.result()
+                except Exception as e:
+                    # one failed month never takes the other downloads down with it
+                    self.logger.log(content=f"Fetching {' '.join(dataset)} {month} failed: {e}", title="[DOWNLOAD-ERROR]", title_color=Fore.RED)
+                    results[dataset][month] = None
+                while pending[dataset] and pending[dataset][0] in results[dataset]:
+                    ready = pending[dataset].pop(0)
+                    columns = results[dataset].pop(ready)
+                    if columns is not None:
+                        self.store.append_month(*dataset, ready, columns)
+
+        available = {}
+        for dataset in datasets:
+            stored = self.store.months(*dataset)
+            available[dataset] = [month for month in months if month in stored]
+        return available
+
+    def close(self):
+        self.session.close()
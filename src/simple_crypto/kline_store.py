@@ -0,0 +1,187 @@
+import os
+import io
+import json
+import numpy as np
+from src.simple_crypto.misc import KLINE_COLUMNS
+
+KLINE_DTYPES = {
+    "open_time": np.int64,
+    "open": np.float64,
+    "high": np.float64,
+    "low": np.float64,
+    "close": np.float64,
+    "volume": np.float64,
+    "close_time": np.int64,
+    "quote_volume": np.float64,
+    "count": np.int64,
+    "taker_buy_volume": np.float64,
+    "taker_buy_quote_volume": np.float64,
+}
+
+
+def _has_header(source):
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            first = f.read(1)
+    else:
+        first = source.peek(1)[:1]
+    return not first.isdigit()
+
+
+def parse_klines(source) -> dict[str, np.ndarray]:
+    # source is a path or a peekable binary file object (e.g. a zip member) holding a Binance kline CSV
+    import pandas as pd
+    if not isinstance(source, str) and not hasattr(source, "peek"):
+        source = io.BytesIO(source.read())
+    # some mirrors ship the dumps with a header row
+    header = 0 if _has_header(source) else None
+    data = pd.read_csv(source, header=header, names=KLINE_COLUMNS, usecols=list(KLINE_DTYPES.keys()), dtype=KLINE_DTYPES)
+    columns = {name: data[name].to_numpy() for name in KLINE_DTYPES}
+    # data.binance.vision switched spot dumps to microsecond timestamps in 2025
+    if len(columns["open_time"]) and columns["open_time"][0] > 10 ** 14:
+        # new arrays: under copy-on-write the ones pandas hands out are read-only
+        columns["open_time"] = columns["open_time"] // 1000
+        columns["close_time"] = columns["close_time"] // 1000
+    return columns
+
+
+class KlineDataset:
+    def __init__(self, path: str, meta: dict):
+        self.path = path
+        self.meta = meta
+        self.rows = meta["rows"]
+        self.columns = {}
+        for name, dtype in KLINE_DTYPES.items():
+            if self.rows == 0:
+                self.columns[name] = np.zeros(0, dtype=dtype)
+            else:
+                self.columns[name] = np.memmap(os.path.join(path, f"{name}.bin"), dtype=dtype, mode='r', shape=(self.rows,))
+
+    @property
+    def months(self):
+        return sorted(self.meta["months"].keys())
+
+    def month_slice(self, month: str):
+        if month not in self.meta["months"]:
+            raise KeyError(f"Month {month} not in dataset")
+        start, stop = self.meta["months"][month][:2]
+        return slice(start, stop)
+
+    def month(self, month: str) -> dict[str, np.ndarray]:
+        s = self.month_slice(month)
+        return {name: column[s] for name, column in self.columns.items()}
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __len__(self):
+        return self.rows
+
+
+class KlineStore:
+    # One directory per symbol/currency/interval with a raw little-endian column file per
+    # kline field, opened through np.memmap so readers share the page cache.
+    def __init__(self, data_dir: str = "Data"):
+        if not isinstance(data_dir, str):
+            raise ValueError("data_dir must be a string")
+        self.data_dir = data_dir
+
+    def dataset_dir(self, symbol: str, currency: str, interval: str):
+        symbol = symbol.upper()
+        currency = currency.upper()
+        return os.path.join(self.data_dir, symbol, f"{symbol}-{currency}-{interval}")
+
+    def read_meta(self, symbol: str, currency: str, interval: str):
+        meta_file = os.path.join(self.dataset_dir(symbol, currency, interval), "meta.json")
+        if not os.path.isfile(meta_file):
+            return {"rows": 0, "months": {}}
+        with open(meta_file, 'r') as f:
+            return json.load(f)
+
+    def _write_meta(self, path: str, meta: dict):
+        with open(os.path.join(path, "meta.json.tmp"), 'w') as f:
+            json.dump(meta, f)
+        os.replace(os.path.join(path, "meta.json.tmp"), os.path.join(path, "meta.json"))
+
+    def has_month(self, symbol: str, currency: str, interval: str, month: str):
+        return month in self.read_meta(symbol, currency, interval)["months"]
+
+    def months(self, symbol: str, currency: str, interval: str):
+        return sorted(self.read_meta(symbol, currency, interval)["months"].keys())
+
+    def append_month(self, symbol: str, currency: str, interval: str, month: str, columns: dict[str, np.ndarray]):
+        if not isinstance(month, str):
+            raise ValueError("month must be a string formatted as YYYY-MM")
+        missing = [name for name in KLINE_DTYPES if name not in columns]
+        if missing:
+            raise ValueError(f"Missing kline columns: {', '.join(missing)}")
+        path = self.dataset_dir(symbol, currency, interval)
+        os.makedirs(path, exist_ok=True)
+        meta = self.read_meta(symbol, currency, interval)
+        if month in meta["months"]:
+            return False
+        rows = len(columns["open_time"])
+        if meta["months"] and month < max(meta["months"]):
+            self._insert_month(path, meta, month, columns)
+            return True
+        for name, dtype in KLINE_DTYPES.items():
+            column_file = os.path.join(path, f"{name}.bin")
+            with open(column_file, 'ab') as f:
+                # drop anything a crashed append left past the committed row count
+                f.truncate(meta["rows"] * np.dtype(dtype).itemsize)
+                f.write(np.ascontiguousarray(columns[name], dtype=dtype).tobytes())
+        meta["months"][month] = self._month_entry(meta["rows"], columns)
+        meta["rows"] += rows
+        self._write_meta(path, meta)
+        return True
+
+    def _month_entry(self, start: int, columns: dict[str, np.ndarray]):
+        rows = len(columns["open_time"])
+        first = int(columns["open_time"][0]) if rows else None
+        last = int(columns["close_time"][-1]) if rows else None
+        return [start, start + rows, first, last]
+
+    def _insert_month(self, path: str, meta: dict, month: str, columns: dict[str, np.ndarray]):
+        # Out of order months are rare (a gap filled later), so just rewrite the dataset
+        dataset = KlineDataset(path, meta)
+        months = {m: {name: np.array(column) for name, column in dataset.month(m).items()} for m in dataset.months}
+        months[month] = columns
+        new_meta = {"rows": 0, "months": {}}
+        merged = {name: [] for name in KLINE_DTYPES}
+        for m in sorted(months):
+            new_meta["months"][m] = self._month_entry(new_meta["rows"], months[m])
+            new_meta["rows"] += len(months[m]["open_time"])
+            for name in KLINE_DTYPES:
+                merged[name].append(np.asarray(months[m][name], dtype=KLINE_DTYPES[name]))
+        del dataset, months
+        for name, parts in merged.items():
+            with open(os.path.join(path, f"{name}.bin.tmp"), 'wb') as f:
+                for part in parts:
+                    f.write(part.tobytes())
+            os.replace(os.path.join(path, f"{name}.bin.tmp"), os.path.join(path, f"{name}.bin"))
+        self._write_meta(path, new_meta)
+
+    def open(self, symbol: str, currency: str, interval: str):
+        return KlineDataset(self.dataset_dir(symbol, currency, interval), self.read_meta(symbol, currency, interval))
+
+    def convert_csvs(self, remove: bool = False):
+        if not os.path.isdir(self.data_dir):
+            return 0
+        converted = 0
+        for coin in os.listdir(self.data_dir):
+            coin_dir = os.path.join(self.data_dir, coin)
+            if not os.path.isdir(coin_dir):
+                continue
+            for csv in sorted(os.listdir(coin_dir)):
+                if not csv.endswith(".csv"):
+                    continue
+                breakdown = csv.removesuffix(".csv").split("-")
+                if len(breakdown) != 5:
+                    continue
+                symbol, currency, interval = breakdown[:3]
+                month = f"{breakdown[3]}-{breakdown[4]}"
+                if self.append_month(symbol, currency, interval, month, parse_klines(os.path.join(coin_dir, csv))):
+                    converted += 1
+                if remove:
+                    os.remove(os.path.join(coin_dir, csv))
+        return converted
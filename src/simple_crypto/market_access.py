@@ -1,13 +1,19 @@
 import threading
 from typing import Literal
 import os
+import sys
+import time
+import atexit
+from collections import deque
 from datetime import datetime
-from dateutil.relativedelta import relativedelta
-import zipfile
-import requests
-import websockets as ws
 from colorama import Fore
 from src.simple_crypto import thread_safe_types as tst
+from src.simple_crypto.data_index import get_index
+from src.simple_crypto.symbol_registry import SymbolRegistry
+from src.simple_crypto.rest_client import shared_client
+from src.simple_crypto.message_queue import MessageQueue
+from src.simple_crypto.decoding import MessageDecoder
+from src.simple_crypto.metrics import MetricsRegistry, DISABLED
 import asyncio
 import json
 import traceback
@@ -30,7 +36,7 @@ WS_EVENTS = [
     "kline_3d",
     "kline_1w",
     "kline_1M",
-    "ticker_1h"
+    "ticker_1h",
     "ticker_4h",
     "ticker",
     "miniTicker",
@@ -39,6 +45,8 @@ WS_EVENTS = [
     "depth@100ms",
 ]
 
+LOG_LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+
 class MarketAccess:
     class BaseTracker:
         def __init__(self, symbol: str, access: 'MarketAccess'):
@@ -49,8 +57,17 @@ class MarketAccess:
             self.symbol = symbol
             self.access = access
 
+        # trackers that set batched = True get every queued message of a stream in one on_events call
+        batched = False
+
         def on_event(self, event, msg):
-            self.access.logger.log(content=f"Received event {event}: {msg}", title="[EVENT]", title_color=Fore.CYAN)
+            # skip building the message at all when debug records are filtered out
+            if self.access.logger.enabled("debug"):
+                self.access.logger.log(content=f"Received event {event}: {msg}", title="[EVENT]", title_color=Fore.CYAN, level="debug")
+
+        def on_events(self, event, msgs):
+            for msg in msgs:
+                self.on_event(event, msg)
 
         def __repr__(self):
             return f"<{self.__class__.__name__} for {self.symbol}>"
@@ -66,10 +83,9 @@ class MarketAccess:
             self.stopped = asyncio.Event()
 
         async def start(self):
-            if self.market_access.us:
-                url = f"wss://stream.binance.us:9443/ws/{self.event}"
-            else:
-                url = f"wss://stream.binance.com:9443/ws/{self.event}"
+            # websockets is only loaded once a listener actually connects
+            import websockets as ws
+            url = f"{self.market_access.ws_base()}/ws/{self.event}"
             while not self.stopped.is_set():
                 try:
                     async with ws.connect(url) as connection:
@@ -91,20 +107,137 @@ class MarketAccess:
                             for task in done:
                                 if task == msg_task:
                                     message = task.result()
-                                    await self.market_access.msgs.put({'stream': self.event, 'data': json.loads(message)})
+                                    if self.market_access.recorder is not None:
+                                        self.market_access.recorder.record(self.event, message)
+                                    await self.market_access.msgs.put({'stream': self.event, 'data': self.market_access.decode_frame(self.event, message)[1]})
                 except ws.exceptions.ConnectionClosed as e:
                     self.market_access.logger.log(content=f"Listener for {self.event} disconnected (line # {traceback.extract_tb(e.__traceback__)[-1].lineno}): {e}. Reconnecting in 5 seconds...", title="[LISTENER-WARNING]", title_color=Fore.YELLOW)
+                    self.market_access.metrics.counter("reconnects_total", listener=self.event).inc()
                     await asyncio.sleep(5)
                 except Exception as e:
                     self.market_access.logger.log(content=f"Listener for {self.event} encountered an error (line # {traceback.extract_tb(e.__traceback__)[-1].lineno}): {e}. Reconnecting in 5 seconds...", title="[LISTENER-ERROR]", title_color=Fore.RED)
+                    self.market_access.metrics.counter("reconnects_total", listener=self.event).inc()
                     await asyncio.sleep(5)
             self.market_access.logger.log(content=f"Listener for {self.event} stopped", title="[LISTENER-STOPPED]", title_color=Fore.GREEN)
 
         def stop(self):
             self.stopped.set()
 
+    class CombinedListener:
+        def __init__(self, market_access: 'MarketAccess', streams: list[str] | None = None, max_streams: int = 1024):
+            if not isinstance(market_access, MarketAccess):
+                raise ValueError("market_access must be an instance of MarketAccess")
+            if streams is None:
+                streams = []
+            if not isinstance(streams, list) or not all(isinstance(stream, str) for stream in streams):
+                raise ValueError("streams must be a list of strings")
+            if not isinstance(max_streams, int) or max_streams <= 0:
+                raise ValueError("max_streams must be a positive integer")
+            if len(streams) > max_streams:
+                raise ValueError(f"Cannot combine more than {max_streams} streams on one connection")
+            self.market_access = market_access
+            self.max_streams = max_streams
+            self.streams = set(streams)
+            self.pending_subscribe = set()
+            self.pending_unsubscribe = set()
+            self.changed = asyncio.Event()
+            self.stopped = asyncio.Event()
+            self.request_id = 0
+
+        def capacity(self):
+            return self.max_streams - len(self.streams)
+
+        def subscribe(self, streams: list[str]):
+            streams = [stream for stream in streams if stream not in self.streams]
+            if len(streams) > self.capacity():
+                raise ValueError(f"Cannot combine more than {self.max_streams} streams on one connection")
+            self.streams.update(streams)
+            self.pending_unsubscribe.difference_update(streams)
+            self.pending_subscribe.update(streams)
+            self.changed.set()
+
+        def unsubscribe(self, streams: list[str]):
+            streams = [stream for stream in streams if stream in self.streams]
+            self.streams.difference_update(streams)
+            self.pending_subscribe.difference_update(streams)
+            self.pending_unsubscribe.update(streams)
+            self.changed.set()
+
+        async def _send_changes(self, connection):
+            # Binance caps incoming control messages per connection, so every pending change
+            # goes out in at most one SUBSCRIBE and one UNSUBSCRIBE frame
+            for method, pending in (("UNSUBSCRIBE", self.pending_unsubscribe), ("SUBSCRIBE", self.pending_subscribe)):
+                if pending:
+                    self.request_id += 1
+                    await connection.send(json.dumps({"method": method, "params": sorted(pending), "id": self.request_id}))
+                    pending.clear()
+
+        async def start(self):
+            import websockets as ws
+            stop_task = asyncio.create_task(self.stopped.wait())
+            while not self.stopped.is_set():
+                if not self.streams:
+                    self.changed.clear()
+                    change_task = asyncio.create_task(self.changed.wait())
+                    await asyncio.wait([change_task, stop_task], return_when=asyncio.FIRST_COMPLETED)
+                    change_task.cancel()
+                    continue
+                # the URL carries the whole stream set, so a reconnect needs no replayed frames
+                self.pending_subscribe.clear()
+                self.pending_unsubscribe.clear()
+                self.changed.clear()
+                url = f"{self.market_access.ws_base()}/stream?streams={'/'.join(sorted(self.streams))}"
+                try:
+                    async with ws.connect(url) as connection:
+                        self.market_access.logger.log(content=f"Combined listener started with {len(self.streams)} streams", title="[LISTENER-START]", title_color=Fore.GREEN)
+                        change_task = asyncio.create_task(self.changed.wait())
+                        msg_task = asyncio.create_task(connection.recv())
+                        while not self.stopped.is_set():
+                            done, pending = await asyncio.wait(
+                                [msg_task, change_task, stop_task],
+                                return_when=asyncio.FIRST_COMPLETED,
+                            )
+                            if self.stopped.is_set():
+                                msg_task.cancel()
+                                change_task.cancel()
+                                self.market_access.logger.log(content=f"Closing combined listener...", title="[LISTENER-WARNING]", title_color=Fore.YELLOW)
+                                await connection.close()
+                                self.market_access.logger.log(content=f"Combined listener connection closed", title="[LISTENER-CONNECTION-CLOSED]", title_color=Fore.GREEN)
+                                break
+                            if change_task in done:
+                                self.changed.clear()
+                                await self._send_changes(connection)
+                                change_task = asyncio.create_task(self.changed.wait())
+                            if msg_task in done:
+                                raw = msg_task.result()
+                                stream, data = self.market_access.decode_frame(None, raw)
+                                msg_task = asyncio.create_task(connection.recv())
+                                # replies to SUBSCRIBE/UNSUBSCRIBE carry an id and no stream
+                                if stream is not None and stream in self.streams:
+                                    if self.market_access.recorder is not None:
+                                        self.market_access.recorder.record(stream, raw)
+                                    await self.market_access.msgs.put({'stream': stream, 'data': data})
+                except ws.exceptions.ConnectionClosed as e:
+                    self.market_access.logger.log(content=f"Combined listener disconnected: {e}. Reconnecting in 5 seconds...", title="[LISTENER-WARNING]", title_color=Fore.YELLOW)
+                    self.market_access.metrics.counter("reconnects_total", listener="combined").inc()
+                    await asyncio.sleep(5)
+                except Exception as e:
+                    self.market_access.logger.log(content=f"Combined listener encountered an error (line # {traceback.extract_tb(e.__traceback__)[-1].lineno}): {e}. Reconnecting in 5 seconds...", title="[LISTENER-ERROR]", title_color=Fore.RED)
+                    self.market_access.metrics.counter("reconnects_total", listener="combined").inc()
+                    await asyncio.sleep(5)
+            stop_task.cancel()
+            self.market_access.logger.log(content=f"Combined listener stopped", title="[LISTENER-STOPPED]", title_color=Fore.GREEN)
+
+        def stop(self):
+            self.stopped.set()
+
     class BaseLogger:
-        def __init__(self, filenames:list[str]|None=None, plain:bool=False, timestamps:bool=True, timestamp_format:str='%Y-%m-%d %H-%M-%S.%f'):
+        # By default every call prints and appends to the log files right away. With
+        # asynchronous=True log() only filters the record and appends it to a deque (atomic
+        # under the GIL, so no lock); a background thread formats the timestamps and writes
+        # whole batches through file handles it keeps open.
+        def __init__(self, filenames:list[str]|None=None, plain:bool=False, timestamps:bool=True, timestamp_format:str='%Y-%m-%d %H-%M-%S.%f',
+                     level:str="debug", asynchronous:bool=False, rate_limit:int|None=None, flush_interval:float=0.1, batch_size:int=512):
             if filenames is None:
                 filenames = []
             if not isinstance(filenames, list) or not all([isinstance(file, str) for file in filenames] + [True]):
@@ -115,56 +248,242 @@ class MarketAccess:
                 raise ValueError("timestamps must be a bool")
             if not isinstance(timestamp_format, str):
                 raise ValueError("timestamp_format must be a str")
+            if level not in LOG_LEVELS:
+                raise ValueError(f"level must be one of: {', '.join(LOG_LEVELS)}")
+            if not isinstance(asynchronous, bool):
+                raise ValueError("asynchronous must be a bool")
+            if rate_limit is not None and (not isinstance(rate_limit, int) or rate_limit <= 0):
+                raise ValueError("rate_limit must be a positive integer or None")
+            if flush_interval <= 0:
+                raise ValueError("flush_interval must be positive")
+            if not isinstance(batch_size, int) or batch_size <= 0:
+                raise ValueError("batch_size must be a positive integer")
             self.filenames = filenames
-            print(self.filenames)
             self.plain = plain
             self.timestamps = timestamps
             self.timestamps_format = timestamp_format
+            self.level = LOG_LEVELS[level]
+            # at most rate_limit records per title each second, the rest are counted and reported once
+            self.rate_limit = rate_limit
+            # log() is called from listener, dispatcher and user threads, the rate counters are shared
+            self.rate_lock = threading.Lock()
+            self.rate_window = 0
+            self.rate_counts = {}
+            self.suppressed = {}
+            self.asynchronous = asynchronous
+            self.flush_interval = flush_interval
+            self.batch_size = batch_size
+            self.records = deque()
+            self.files = None
+            self.wake = threading.Event()
+            self.closed = False
+            self.writer = None
+            if asynchronous:
+                self.writer = threading.Thread(target=self._write_loop, daemon=True)
+                self.writer.start()
+                atexit.register(self.close)
 
-        def log(self, content:str, content_color:str|None=None, title:str|None=None, title_color:str|None=None):
-            if self.plain:
-                content_color = None
-                title_color = None
-            timestamp_insert = f"[{datetime.now().strftime(self.timestamps_format)}] "
-            print(f"{timestamp_insert if self.timestamps else ''}{title_color if title_color is not None else ''}{title if title is not None else ''}{Fore.RESET}{' ' if title is not None else ''}{content_color if content_color is not None else ''}{content}{Fore.RESET}")
+        def _allowed(self, title, now):
+            window = int(now)
+            suppressed = None
+            with self.rate_lock:
+                if window != self.rate_window:
+                    self.rate_window = window
+                    self.rate_counts = {}
+                    if self.suppressed:
+                        suppressed = self.suppressed
+                        self.suppressed = {}
+                count = self.rate_counts.get(title, 0) + 1
+                self.rate_counts[title] = count
+                allowed = count <= self.rate_limit
+                if not allowed:
+                    self.suppressed[title] = self.suppressed.get(title, 0) + 1
+            # the summaries of the previous window are written outside the lock
+            if suppressed:
+                for key, count in suppressed.items():
+                    self._emit((now, f"Suppressed {count} messages over the rate limit", None, key, Fore.YELLOW))
+            return allowed
+
+        def enabled(self, level:str):
+            return LOG_LEVELS[level] >= self.level
+
+        def log(self, content:str, content_color:str|None=None, title:str|None=None, title_color:str|None=None, level:str|None=None):
+            if level is None:
+                # lifecycle messages carry their severity in the title
+                level = "error" if title is not None and "ERROR" in title else "warning" if title is not None and "WARNING" in title else "info"
+            if LOG_LEVELS[level] < self.level:
+                return
+            now = time.time()
+            if self.rate_limit is not None and not self._allowed(title, now):
+                return
+            self._emit((now, content, content_color, title, title_color))
+
+        def _emit(self, record):
+            if self.asynchronous and not self.closed:
+                self.records.append(record)
+                if len(self.records) >= self.batch_size:
+                    self.wake.set()
+                return
+            console, line = self._format(record)
+            print(console)
             for file in self.filenames:
                 if os.path.isfile(file):
                     with open(file, 'a') as f:
-                        f.write(f"{timestamp_insert if self.timestamps else ''}{(title + ' ') if title is not None else ''}{content}\n")
+                        f.write(line)
+
+        def _format(self, record):
+            now, content, content_color, title, title_color = record
+            if self.plain:
+                content_color = None
+                title_color = None
+            timestamp_insert = f"[{datetime.fromtimestamp(now).strftime(self.timestamps_format)}] " if self.timestamps else ''
+            console = f"{timestamp_insert}{title_color if title_color is not None else ''}{title if title is not None else ''}{Fore.RESET}{' ' if title is not None else ''}{content_color if content_color is not None else ''}{content}{Fore.RESET}"
+            return console, f"{timestamp_insert}{(title + ' ') if title is not None else ''}{content}\n"
+
+        def _write_batch(self):
+            if not self.records:
+                return
+            if self.files is None:
+                # like the synchronous path, only files that already exist are written to
+                self.files = [open(file, 'a') for file in self.filenames if os.path.isfile(file)]
+            console = []
+            lines = []
+            markers = []
+            while self.records:
+                record = self.records.popleft()
+                if isinstance(record, threading.Event):
+                    # queued by flush(), set once everything logged before it is written
+                    markers.append(record)
+                    continue
+                text, line = self._format(record)
+                console.append(text)
+                lines.append(line)
+            if console:
+                sys.stdout.write("\n".join(console) + "\n")
+                sys.stdout.flush()
+                text = "".join(lines)
+                for f in self.files:
+                    f.write(text)
+                    f.flush()
+            for marker in markers:
+                marker.set()
 
-    def __init__(self, us=True, listener_class=BaseListener, logger=None):
-        self.stocks = tst.ThreadSafeStockList()
+        def _write_loop(self):
+            while not self.closed:
+                self.wake.wait(self.flush_interval)
+                self.wake.clear()
+                self._write_batch()
+            self._write_batch()
+
+        def flush(self):
+            if self.writer is None or self.closed:
+                return
+            marker = threading.Event()
+            self.records.append(marker)
+            self.wake.set()
+            marker.wait(5)
+
+        def close(self):
+            if self.writer is None or self.closed:
+                return
+            self.closed = True
+            self.wake.set()
+            self.writer.join(5)
+            for f in self.files or []:
+                f.close()
+            self.files = None
+
+    def __init__(self, us=True, listener_class=BaseListener, logger=None, combined=False, streams_per_connection=1024, stream_url=None, symbol_ttl=3600, symbol_cache=None, rest_client=None, dispatch_batch=256, queue_size=10000, queue_policies=None, recorder=None, decoder=None, metrics=None):
+        if not isinstance(combined, bool):
+            raise ValueError("combined must be a bool")
+        if not isinstance(streams_per_connection, int) or streams_per_connection <= 0:
+            raise ValueError("streams_per_connection must be a positive integer")
+        if not isinstance(dispatch_batch, int) or dispatch_batch <= 0:
+            raise ValueError("dispatch_batch must be a positive integer")
+        if decoder is not None and not isinstance(decoder, MessageDecoder):
+            raise ValueError("decoder must be a MessageDecoder")
+        if metrics is not None and not isinstance(metrics, MetricsRegistry):
+            raise ValueError("metrics must be a MetricsRegistry")
+        # metrics are off unless a registry is passed in
+        self.metrics = metrics if metrics is not None else DISABLED
+        self.stocks = tst.ThreadSafeStockList(on_change=self._notify_change)
         self.connected = False
         self.connected_lock = threading.Lock()
-        self.msgs = asyncio.Queue()
+        self.msgs = MessageQueue(queue_size, queue_policies, metrics=self.metrics)
         self.us = us
         self.us_lock = threading.Lock()
         self.thread = None
+        # set while _run is up, subscription changes wake it through the loop
+        self.loop = None
+        self.changed = None
+        self.change_pending = False
+        self.retiring = set()
         self.listener_class = listener_class
+        self.combined = combined
+        self.streams_per_connection = streams_per_connection
+        self.dispatch_batch = dispatch_batch
+        self.ordered_dispatch = False
+        self.stream_url = stream_url
+        self.rest = rest_client if rest_client is not None else shared_client()
+        self.order_books = {}
+        self.recorder = recorder
+        # dicts by default, MessageDecoder(typed=True) hands trackers typed messages instead
+        self.decoder = decoder if decoder is not None else MessageDecoder()
+        self.symbols = SymbolRegistry(lambda: self.request("/api/v3/exchangeInfo"), ttl=symbol_ttl, cache_file=symbol_cache)
+        if self.metrics.enabled:
+            for key in ["depth", "max_depth", "dropped", "conflated", "dispatched", "lag_ms_last"]:
+                self.metrics.gauge(f"queue_{key}", lambda key=key: self.msgs.stats()[key])
+            for base in set(self.rest.bases.values()):
+                self.metrics.gauge("rest_used_weight", lambda base=base: self.rest.used_weight.get(base, (0, None))[0], base=base)
         if logger is None:
             self.logger = MarketAccess.BaseLogger()
         else:
             self.logger = logger
 
-    def subscribe(self, symbol, instance, currency="USD", event="ticker"):
+    def ws_base(self):
+        if self.stream_url is not None:
+            return self.stream_url
+        if self.us:
+            return "wss://stream.binance.us:9443"
+        return "wss://stream.binance.com:9443"
+
+    def _validate_subscription(self, symbol, instance, currency, event):
         if not isinstance(instance, MarketAccess.BaseTracker):
             raise ValueError("Instance must be a subclass of BaseTracker")
         if not isinstance(currency, str):
             raise ValueError("Currency must be a string")
         if not isinstance(symbol, str):
             raise ValueError("Symbol must be a string")
-        symbols = self.request("/api/v3/exchangeInfo")['symbols']
-        if not any(s['symbol'] == f"{symbol.upper()}{currency.upper()}" for s in symbols):
-            raise ValueError(f"Symbol {symbol.upper()}{currency.upper()} not found")
         if event not in WS_EVENTS:
             raise ValueError(f"Event {event} not supported. Supported events: {', '.join(WS_EVENTS)}")
+        return f"{symbol.lower()}{currency.lower()}@{event}"
 
-        currency = currency.lower()
-        symbol = symbol.lower()
-        if not self.stocks.add(f"{symbol}{currency}@{event}", instance):
+    def subscribe(self, symbol, instance, currency="USD", event="ticker"):
+        stream = self._validate_subscription(symbol, instance, currency, event)
+        if f"{symbol.upper()}{currency.upper()}" not in self.symbols:
+            raise ValueError(f"Symbol {symbol.upper()}{currency.upper()} not found")
+        if not self.stocks.add(stream, instance):
             return True
         return False
 
+    def subscribe_many(self, subscriptions: list[tuple], currency="USD", event="ticker"):
+        # each subscription is (symbol, instance) or (symbol, instance, currency[, event]);
+        # everything is validated before any of them is registered
+        if not isinstance(subscriptions, list):
+            raise ValueError("subscriptions must be a list of tuples")
+        streams = []
+        missing = []
+        for subscription in subscriptions:
+            if not isinstance(subscription, tuple) or not 2 <= len(subscription) <= 4:
+                raise ValueError("Each subscription must be a tuple of (symbol, instance[, currency[, event]])")
+            symbol, instance, sub_currency, sub_event = subscription + (currency, event)[len(subscription) - 2:]
+            streams.append((self._validate_subscription(symbol, instance, sub_currency, sub_event), instance))
+            if f"{symbol.upper()}{sub_currency.upper()}" not in self.symbols:
+                missing.append(f"{symbol.upper()}{sub_currency.upper()}")
+        if missing:
+            raise ValueError(f"Symbols not found: {', '.join(missing)}")
+        return [not self.stocks.add(stream, instance) for stream, instance in streams]
+
     def unsubscribe(self, symbol, instance, currency="USD", event="ticker"):
         if not isinstance(instance, MarketAccess.BaseTracker):
             raise ValueError("Instance must be a subclass of BaseTracker")
@@ -183,54 +502,49 @@ class MarketAccess:
 
     @staticmethod
     def static_request(endpoint, us=True):
-        if us:
-            base_url = "https://api.binance.us"
-        else:
-            base_url = "https://eapi.binance.com"
-        r = requests.get(f"{base_url}{endpoint}")
-        if r.status_code == 200:
-            return r.json()
-        else:
-            if r.status_code == 451 and r.json().contains("code") and r.json()['code'] == 0:
-                us = not us
-                if us:
-                    base_url = "https://api.binance.us"
-                else:
-                    base_url = "https://eapi.binance.com"
-                r = requests.get(f"{base_url}{endpoint}")
-                if r.status_code == 200:
-                    return r.json()
-                else:
-                    raise ConnectionError(f"Error {r.status_code}: {r.text}")
-            else:
-                raise ConnectionError(f"Error {r.status_code}: {r.text}")
+        return shared_client().get(endpoint, us)[0]
 
-    def request(self, endpoint):
-        if self.us:
-            base_url = "https://api.binance.us"
-        else:
-            base_url = "https://eapi.binance.com"
-        r = requests.get(f"{base_url}{endpoint}")
-        if r.status_code == 200:
-            return r.json()
+    def _switch_region(self, us):
+        if us != self.us:
+            with self.us_lock:
+                self.us = us
+
+    def request(self, endpoint, params=None):
+        started = time.perf_counter()
+        data, us = self.rest.get(endpoint, self.us, params)
+        if self.metrics.enabled:
+            self.metrics.histogram("rest_seconds", endpoint=endpoint).observe(time.perf_counter() - started)
+        self._switch_region(us)
+        return data
+
+    async def request_async(self, endpoint, params=None):
+        started = time.perf_counter()
+        data, us = await self.rest.get_async(endpoint, self.us, params)
+        if self.metrics.enabled:
+            self.metrics.histogram("rest_seconds", endpoint=endpoint).observe(time.perf_counter() - started)
+        self._switch_region(us)
+        return data
+
+    def decode_frame(self, stream, raw):
+        # Returns (stream, data). stream=None means a frame off a combined connection, which
+        # names its stream itself (None again for control replies).
+        metrics = self.metrics
+        if not metrics.enabled:
+            if stream is None:
+                return self.decoder.decode_combined(raw)
+            return stream, self.decoder.decode(stream, raw)
+        started = time.perf_counter()
+        if stream is None:
+            stream, data = self.decoder.decode_combined(raw)
         else:
-            if r.status_code == 451 and r.json().contains("code") and r.json()['code'] == 0:
-                with self.us_lock:
-                    self.us = not self.us
-                if self.us:
-                    base_url = "https://api.binance.us"
-                else:
-                    base_url = "https://eapi.binance.com"
-                r = requests.get(f"{base_url}{endpoint}")
-                if r.status_code == 200:
-                    return r.json()
-                else:
-                    raise ConnectionError(f"Error {r.status_code}: {r.text}")
-            else:
-                raise ConnectionError(f"Error {r.status_code}: {r.text}")
+            data = self.decoder.decode(stream, raw)
+        metrics.histogram("decode_seconds").observe(time.perf_counter() - started)
+        if stream is not None:
+            metrics.counter("messages_total", stream=stream).inc()
+        return stream, data
 
     @staticmethod
-    def get_history(symbol: str, currency: str = "USD", interval: Literal["1s", "1m", "3m", "5m", "15m", "30m", "1h", "2h", "4h", "6h", "8h", "12h", "1d"] = "1m", num_months: int = 1):
+    def get_history(symbol: str, currency: str = "USD", interval: Literal["1s", "1m", "3m", "5m", "15m", "30m", "1h", "2h", "4h", "6h", "8h", "12h", "1d"] = "1m", num_months: int = 1, data_dir: str = "Data"):
         if not interval in ["1s", "1m", "3m", "5m", "15m", "30m", "1h", "2h", "4h", "6h", "8h", "12h", "1d"]:
             raise ValueError(
                 "Invalid interval. Must be one of: '1s', '1m', '3m', '5m', '15m', '30m', '1h', '2h', '4h', '6h', '8h', '12h', '1d'")
@@ -243,118 +557,180 @@ class MarketAccess:
         if not isinstance(currency, str):
             raise ValueError("currency must be a string")
 
-        today = datetime.today()
-        currency = currency.upper()
-        symbol = symbol.upper()
-        if not os.path.isdir(f"Data\\{symbol}"):
-            os.mkdir(f"Data\\{symbol}")
-        months_available = []
-        for i in range(num_months, 0, -1):
-            month = (today - relativedelta(months=i))
-            if not os.path.isfile(f"Data\\{symbol}\\{symbol}-{currency}-{interval}-{month.strftime('%Y-%m')}.csv"):
-                url = f"https://data.binance.vision/data/spot/monthly/klines/{symbol}{currency}/{interval}/{symbol}{currency}-{interval}-{month.strftime('%Y-%m')}.zip"
-                r = requests.get(url)
-                if r.status_code == 200:
-                    with open(f"Data\\{symbol}\\{symbol}-{currency}-{interval}-{month.strftime('%Y-%m')}.zip",
-                              "wb") as f:
-                        f.write(r.content)
-                    with zipfile.ZipFile(f"Data\\{symbol}\\{symbol}-{currency}-{interval}-{month.strftime('%Y-%m')}.zip",
-                                         'r') as zip_ref:
-                        zip_ref.extractall(f"Data\\{symbol}")
-                    os.remove(f"Data\\{symbol}\\{symbol}-{currency}-{interval}-{month.strftime('%Y-%m')}.zip")
-                else:
-                    url = url = f"https://data.binance.us/public_data/spot/monthly/klines/{symbol}{currency}/{interval}/{symbol}{currency}-{interval}-{month.strftime('%Y-%m')}.zip"
-                    r = requests.get(url)
-                    if r.status_code == 200:
-                        with open(f"Data\\{symbol}\\{symbol}-{currency}-{interval}-{month.strftime('%Y-%m')}.zip",
-                                  "wb") as f:
-                            f.write(r.content)
-                        with zipfile.ZipFile(
-                                f"Data\\{symbol}\\{symbol}-{currency}-{interval}-{month.strftime('%Y-%m')}.zip",
-                                'r') as zip_ref:
-                            file = zip_ref.namelist()[0]
-                            zip_ref.extractall(f"Data\\{symbol}")
-                            os.rename(f"Data\\{symbol}\\{file}", f"Data\\{symbol}\\{symbol}-{currency}-{interval}-{month.strftime('%Y-%m')}.csv")
-                        os.remove(f"Data\\{symbol}\\{symbol}-{currency}-{interval}-{month.strftime('%Y-%m')}.zip")
-                    else:
-                        pass
-            if os.path.isfile(f"Data\\{symbol}\\{symbol}-{currency}-{interval}-{month.strftime('%Y-%m')}.csv"):
-                months_available.append(month)
-        return months_available
+        # the downloader pulls in pandas and dateutil, only history requests need it
+        from src.simple_crypto.downloader import HistoryDownloader, months_back
+        downloader = HistoryDownloader(data_dir)
+        try:
+            available = downloader.download(symbol, currency, interval, num_months)[(symbol.upper(), currency.upper(), interval)]
+        finally:
+            downloader.close()
+        return [month for month in months_back(num_months) if month.strftime('%Y-%m') in available]
 
     @staticmethod
     def get_available_data(data_dir="Data"):
-        if os.path.isdir(data_dir):
-            coins = [f for f in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, f))]
-            data = {}
-            for coin in coins:
-                csvs = [f for f in os.listdir(os.path.join(data_dir, coin)) if os.path.isfile(os.path.join(data_dir, coin, f)) and f.endswith('.csv')]
-                data[coin] = {}
-                for csv in csvs:
-                    breakdown = csv.removesuffix(".csv").split("-")
-                    if breakdown[1] not in data[coin]:
-                        data[coin][breakdown[1]] = {}
-                    if breakdown[2] not in data[coin][breakdown[1]]:
-                        data[coin][breakdown[1]][breakdown[2]] = {}
-                    data[coin][breakdown[1]][breakdown[2]][f"{breakdown[3]}-{breakdown[4]}"] = os.path.join(data_dir, coin, csv)
-            return data
-        else:
-            return {}
+        index = get_index(data_dir)
+        index.refresh()
+        return index.available()
+
+    def order_book(self, symbol, currency="USD", event="depth@100ms"):
+        from src.simple_crypto.order_book import get_order_book
+        return get_order_book(self, symbol, currency, event)
+
+    def queue_stats(self):
+        return self.msgs.stats()
 
     async def msg_processor(self):
         self.logger.log(content=f"Message processor started", title="[MARKET-PROCESSOR-STARTED]", title_color=Fore.GREEN)
         while not self.msgs.empty() or self.connected:
-            msg = await self.msgs.get()
-            if msg['stream'] == 'end':
+            # tracker timing is only taken while metrics are on
+            metrics = self.metrics if self.metrics.enabled else None
+            batch = [await self.msgs.get()]
+            while len(batch) < self.dispatch_batch and not self.msgs.empty():
+                batch.append(self.msgs.get_nowait())
+            # messages keep their order within a stream, streams in a batch are dispatched one after
+            # another. With ordered_dispatch only consecutive runs of a stream are grouped, so the
+            # order across streams is kept too.
+            grouped = {}
+            runs = []
+            end = False
+            for msg in batch:
+                if msg['stream'] == 'end':
+                    end = True
+                    break
+                if self.ordered_dispatch:
+                    if runs and runs[-1][0] == msg['stream']:
+                        runs[-1][1].append(msg['data'])
+                    else:
+                        runs.append((msg['stream'], [msg['data']]))
+                elif msg['stream'] in grouped:
+                    grouped[msg['stream']].append(msg['data'])
+                else:
+                    grouped[msg['stream']] = [msg['data']]
+            for stream, datas in (runs if self.ordered_dispatch else grouped.items()):
+                stock = self.stocks.get(stream)
+                if stock is not None:
+                    stock.notify_batch(stream, datas, metrics)
+                for data in datas:
+                    self.msgs.record_dispatch(data)
+            if end:
                 return
-            stock = self.stocks.get(msg['stream'])
-            if stock is not None:
-                stock.notify(msg['stream'], msg['data'])
+            # let the listeners refill the queue between batches
+            await asyncio.sleep(0)
+
+    def _notify_change(self, stream=None):
+        # Called from any thread when a stream gains its first tracker or loses its last one.
+        # Wakeups are coalesced: one pending call_soon_threadsafe covers any number of changes.
+        loop = self.loop
+        if loop is None or self.change_pending:
+            return
+        self.change_pending = True
+        try:
+            loop.call_soon_threadsafe(self._wake)
+        except RuntimeError:
+            # the loop already closed
+            self.change_pending = False
+
+    def _wake(self):
+        self.change_pending = False
+        if self.changed is not None:
+            self.changed.set()
+
+    def _retire(self, tasks, names):
+        # Stopped listeners get up to 20 seconds to close their connections in the background,
+        # so reconciling never waits on them
+        async def wait():
+            await asyncio.wait(tasks, timeout=20, return_when=asyncio.ALL_COMPLETED)
+            for task, name in zip(tasks, names):
+                if not task.done():
+                    self.logger.log(content=f"Listener for {name} task failed to stop gracefully, cancelling...", title="[MARKET-LISTENER-ERROR]", title_color=Fore.RED)
+                    task.cancel()
+        retiring = asyncio.create_task(wait())
+        self.retiring.add(retiring)
+        retiring.add_done_callback(self.retiring.discard)
+
+    def _update_listeners(self, listeners, stock_events):
+        # listeners maps stream -> (listener, task)
+        wanted = set(stock_events)
+        for event in [event for event in stock_events if event not in listeners]:
+            self.logger.log(content=f"Starting listener for {event}...", title="[MARKET-LISTENER-START]", title_color=Fore.YELLOW)
+            listener = self.listener_class(event, self)
+            listeners[event] = (listener, asyncio.create_task(listener.start()))
+        old_events = [event for event in listeners if event not in wanted]
+        for event in old_events:
+            self.logger.log(content=f"Stopping listener for {event}...", title="[MARKET-LISTENER-STOP]", title_color=Fore.YELLOW)
+            listeners[event][0].stop()
+        if old_events:
+            self._retire([listeners.pop(event)[1] for event in old_events], old_events)
+
+    def _update_combined(self, listeners, stock_events):
+        # listeners maps listener -> task, in the order they were started
+        wanted = set(stock_events)
+        listened = set()
+        for listener in listeners:
+            listened.update(listener.streams)
+        new_events = [event for event in stock_events if event not in listened]
+        for listener in listeners:
+            old_events = [event for event in listener.streams if event not in wanted]
+            if old_events:
+                self.logger.log(content=f"Unsubscribing {len(old_events)} streams from combined listener...", title="[MARKET-LISTENER-STOP]", title_color=Fore.YELLOW)
+                listener.unsubscribe(old_events)
+        for listener in listeners:
+            if not new_events:
+                break
+            added = new_events[:listener.capacity()]
+            if added:
+                self.logger.log(content=f"Subscribing {len(added)} streams on combined listener...", title="[MARKET-LISTENER-START]", title_color=Fore.YELLOW)
+                listener.subscribe(added)
+                new_events = new_events[len(added):]
+        while new_events:
+            self.logger.log(content=f"Starting combined listener for {len(new_events[:self.streams_per_connection])} streams...", title="[MARKET-LISTENER-START]", title_color=Fore.YELLOW)
+            listener = self.CombinedListener(self, new_events[:self.streams_per_connection], self.streams_per_connection)
+            new_events = new_events[self.streams_per_connection:]
+            listeners[listener] = asyncio.create_task(listener.start())
+        idle = [listener for listener in listeners if not listener.streams]
+        for listener in idle:
+            self.logger.log(content=f"Stopping idle combined listener...", title="[MARKET-LISTENER-STOP]", title_color=Fore.YELLOW)
+            listener.stop()
+        if idle:
+            self._retire([listeners.pop(listener) for listener in idle], ["combined"] * len(idle))
 
     async def _run(self):
-        listeners = []
-        listener_tasks = []
+        listeners = {}
+        self.loop = asyncio.get_running_loop()
+        self.changed = asyncio.Event()
+        self.retiring = set()
         self.logger.log(content=f"MarketAccess started", title="[MARKET-STARTED]", title_color=Fore.GREEN)
         self.logger.log(content=f"Testing connection...", title="[MARKET-CONNECTION-TEST]", title_color=Fore.YELLOW)
-        self.request("/api/v3/ping")
+        await self.request_async("/api/v3/ping")
         self.logger.log(content=f"Connection test successful", title="[MARKET-CONNECTION-TEST]", title_color=Fore.GREEN)
         self.logger.log(content=f"Starting message processor...", title="[MARKET-PROCESSOR-START]", title_color=Fore.YELLOW)
         processor_task = asyncio.create_task(self.msg_processor())
+        # the stock list wakes this loop through _notify_change, nothing runs between changes
         while self.connected:
-            stock_events = self.stocks.keys()
-            listened_events = [l.event for l in listeners]
-            new_events = [event for event in stock_events if event not in listened_events]
-            old_events = [event for event in listened_events if event not in stock_events]
-            for event in new_events:
-                self.logger.log(content=f"Starting listener for {event}...", title="[MARKET-LISTENER-START]", title_color=Fore.YELLOW)
-                listener = self.listener_class(event, self)
-                listeners.append(listener)
-                listener_tasks.append(asyncio.create_task(listener.start()))
-            to_remove = []
-            stopped_listeners = []
-            for i, listener in enumerate(listeners):
-                if listener.event in old_events:
-                    self.logger.log(content=f"Stopping listener for {listener.event}...", title="[MARKET-LISTENER-STOP]", title_color=Fore.YELLOW)
-                    listener.stop()
-                    to_remove.append(listener_tasks[i])
-                    stopped_listeners.append(listener)
-                    listeners.remove(listener)
-                    listener_tasks.remove(listener_tasks[i])
-            if to_remove:
-                await asyncio.wait(to_remove, timeout=20, return_when=asyncio.ALL_COMPLETED)
-                for i, task in enumerate(to_remove):
-                    if not task.done():
-                        self.logger.log(content=f"Listener for {stopped_listeners[i].event} task failed to stop gracefully, cancelling...", title="[MARKET-LISTENER-ERROR]", title_color=Fore.RED)
-                        task.cancel()
-            await asyncio.sleep(0.1)
-        for listener in listeners:
-            listener.stop()
-        if not all([task.done() for task in listener_tasks]):
-            await asyncio.wait(listener_tasks, timeout=20, return_when=asyncio.ALL_COMPLETED)
-        for task in listener_tasks:
+            self.changed.clear()
+            if self.combined:
+                self._update_combined(listeners, self.stocks.keys())
+            else:
+                self._update_listeners(listeners, self.stocks.keys())
+            await self.changed.wait()
+        if self.combined:
+            tasks = list(listeners.values())
+            for listener in listeners:
+                listener.stop()
+        else:
+            tasks = [task for listener, task in listeners.values()]
+            for listener, task in listeners.values():
+                listener.stop()
+        tasks += list(self.retiring)
+        if not all([task.done() for task in tasks]):
+            await asyncio.wait(tasks, timeout=20, return_when=asyncio.ALL_COMPLETED)
+        for task in tasks:
             if not task.done():
                 self.logger.log(content=f"Listener task failed to gracefully stop, cancelling", title="[MARKET-LISTENER-ERROR]", title_color=Fore.RED)
                 task.cancel()
+        self.loop = None
+        if self.recorder is not None:
+            self.recorder.flush()
         await self.msgs.put({'stream': 'end', 'data': None})
         if not processor_task.done():
             await asyncio.wait([processor_task], timeout=30, return_when=asyncio.ALL_COMPLETED)
@@ -380,6 +756,7 @@ class MarketAccess:
     def stop(self):
         with self.connected_lock:
             self.connected = False
+        self._notify_change()
         self.thread.join(timeout=20)
         if self.thread.is_alive():
             self.logger.log(content="Failed to stop thread", title="[MARKET-STOP-ERROR]", title_color=Fore.RED)
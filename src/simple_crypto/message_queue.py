@@ -0,0 +1,176 @@
+import time
+import asyncio
+from collections import deque
+from src.simple_crypto.decoding import Message
+
+QUEUE_POLICIES = ["block", "drop_oldest", "conflate"]
+# marks an entry dropped where it sits in the queue, get skips it
+_DROPPED = object()
+
+# Snapshot style streams only matter for their latest value, so a backlog of them is collapsed
+DEFAULT_POLICIES = {
+    "ticker": "conflate",
+    "ticker_1h": "conflate",
+    "ticker_4h": "conflate",
+    "miniTicker": "conflate",
+    "bookTicker": "conflate",
+}
+
+
+class MessageQueue:
+    # Bounded replacement for the asyncio.Queue behind MarketAccess.msgs. Each stream gets a
+    # policy for when the queue is full: block the listener, drop the stream's own oldest queued
+    # message, or (for conflate) overwrite the stream's message that is still waiting in the
+    # queue. A policy only ever gives up messages of its own stream: with nothing of its own
+    # queued, a full queue blocks it like any other.
+    def __init__(self, maxsize: int = 10000, policies: dict | None = None, default_policy: str = "block", metrics=None):
+        if not isinstance(maxsize, int) or maxsize <= 0:
+            raise ValueError("maxsize must be a positive integer")
+        if default_policy not in QUEUE_POLICIES:
+            raise ValueError(f"default_policy must be one of: {', '.join(QUEUE_POLICIES)}")
+        merged = dict(DEFAULT_POLICIES)
+        if policies is not None:
+            if not isinstance(policies, dict):
+                raise ValueError("policies must be a dict of event to policy")
+            merged.update(policies)
+        for event, policy in merged.items():
+            if policy not in QUEUE_POLICIES:
+                raise ValueError(f"Policy for {event} must be one of: {', '.join(QUEUE_POLICIES)}")
+        self.maxsize = maxsize
+        self.policies = merged
+        self.default_policy = default_policy
+        self.stream_policies = {}
+        self.items = deque()
+        self.size = 0
+        self.pending = {}
+        # queued entries of each drop_oldest stream, oldest first
+        self.streams = {}
+        self.readable = asyncio.Event()
+        self.writable = asyncio.Event()
+        self.max_depth = 0
+        self.dropped = 0
+        self.conflated = 0
+        self.dispatched = 0
+        self.lag_count = 0
+        self.lag_total = 0
+        self.lag_max = 0
+        self.lag_last = None
+        # with metrics on, entries carry their enqueue time and get() records how long they waited
+        self.wait = metrics.histogram("queue_wait_seconds") if metrics is not None and metrics.enabled else None
+
+    def policy_for(self, stream: str):
+        policy = self.stream_policies.get(stream)
+        if policy is None:
+            # a stream is named like btcusd@depth@100ms, the policy is keyed on the event part
+            event = stream.split("@", 1)[1] if "@" in stream else stream
+            policy = self.policies.get(event, self.policies.get(event.split("@")[0], self.default_policy))
+            self.stream_policies[stream] = policy
+        return policy
+
+    def _drop_oldest(self, stream: str):
+        own = self.streams[stream]
+        entry = own.popleft()
+        if not own:
+            del self.streams[stream]
+        entry[1] = _DROPPED
+        self.size -= 1
+        self.dropped += 1
+        if len(self.items) > 2 * self.maxsize:
+            # a stalled consumer would otherwise pile up dropped entries
+            self.items = deque(entry for entry in self.items if entry[1] is not _DROPPED)
+
+    async def put(self, msg: dict):
+        stream = msg['stream']
+        policy = self.policy_for(stream)
+        if policy == "conflate":
+            entry = self.pending.get(stream)
+            if entry is not None:
+                entry[1] = msg
+                self.conflated += 1
+                return
+        if self.size >= self.maxsize:
+            if policy == "drop_oldest" and stream in self.streams:
+                self._drop_oldest(stream)
+            else:
+                while self.size >= self.maxsize:
+                    self.writable.clear()
+                    await self.writable.wait()
+        entry = [stream, msg] if self.wait is None else [stream, msg, time.perf_counter()]
+        self.items.append(entry)
+        self.size += 1
+        if policy == "conflate":
+            self.pending[stream] = entry
+        elif policy == "drop_oldest":
+            own = self.streams.get(stream)
+            if own is None:
+                own = self.streams[stream] = deque()
+            own.append(entry)
+        if self.size > self.max_depth:
+            self.max_depth = self.size
+        self.readable.set()
+
+    async def wait_for_space(self, stream: str | None = None):
+        # Returns once a put would go straight in: the queue has room and, with a stream given,
+        # none of that stream's messages is still waiting where a put would conflate it
+        while self.size >= self.maxsize or (stream is not None and stream in self.pending):
+            self.writable.clear()
+            await self.writable.wait()
+
+    def get_nowait(self):
+        items = self.items
+        while items and items[0][1] is _DROPPED:
+            items.popleft()
+        if not items:
+            raise asyncio.QueueEmpty
+        entry = items.popleft()
+        self.size -= 1
+        stream = entry[0]
+        if self.pending.get(stream) is entry:
+            del self.pending[stream]
+        elif self.streams:
+            own = self.streams.get(stream)
+            if own is not None and own[0] is entry:
+                own.popleft()
+                if not own:
+                    del self.streams[stream]
+        if self.wait is not None:
+            self.wait.observe(time.perf_counter() - entry[2])
+        self.writable.set()
+        return entry[1]
+
+    async def get(self):
+        while not self.size:
+            self.readable.clear()
+            await self.readable.wait()
+        return self.get_nowait()
+
+    def record_dispatch(self, data):
+        self.dispatched += 1
+        if isinstance(data, (dict, Message)) and "E" in data:
+            lag = time.time() * 1000 - data["E"]
+            self.lag_count += 1
+            self.lag_total += lag
+            self.lag_last = lag
+            if lag > self.lag_max:
+                self.lag_max = lag
+
+    def empty(self):
+        return not self.size
+
+    def qsize(self):
+        return self.size
+
+    def full(self):
+        return self.size >= self.maxsize
+
+    def stats(self):
+        return {
+            "depth": self.size,
+            "max_depth": self.max_depth,
+            "dropped": self.dropped,
+            "conflated": self.conflated,
+            "dispatched": self.dispatched,
+            "lag_ms_last": self.lag_last,
+            "lag_ms_mean": self.lag_total / self.lag_count if self.lag_count else None,
+            "lag_ms_max": self.lag_max if self.lag_count else None,
+        }
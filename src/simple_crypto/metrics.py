@@ -0,0 +1,374 @@
+import sys
+import json
+import math
+import threading
+from collections import Counter as _Tally
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Counters and histograms keep one cell per writing thread, so the hot paths never take a
+# lock: only the owning thread writes a cell and readers sum over all of them. Histogram
+# buckets are logarithmic like HDR histograms, SUB_BUCKETS per power of two, so a percentile
+# (reported as its bucket's upper bound) is at most 1 / SUB_BUCKETS above the true value.
+SUB_BUCKETS = 16
+ZERO_BUCKET = -(1 << 30)
+
+
+def bucket_index(value: float):
+    if value <= 0:
+        return ZERO_BUCKET
+    mantissa, exponent = math.frexp(value)
+    return exponent * SUB_BUCKETS + int((mantissa - 0.5) * 2 * SUB_BUCKETS)
+
+
+def bucket_upper(index: int):
+    if index == ZERO_BUCKET:
+        return 0.0
+    exponent, sub = divmod(index, SUB_BUCKETS)
+    return math.ldexp(0.5 + (sub + 1) / (2 * SUB_BUCKETS), exponent)
+
+
+class Counter:
+    __slots__ = ("name", "labels", "cells", "lock")
+
+    def __init__(self, name: str, labels: dict):
+        self.name = name
+        self.labels = labels
+        self.cells = {}
+        self.lock = threading.Lock()
+
+    def _cell(self):
+        with self.lock:
+            cell = self.cells[threading.get_ident()] = [0]
+        return cell
+
+    def inc(self, amount=1):
+        cell = self.cells.get(threading.get_ident())
+        if cell is None:
+            cell = self._cell()
+        cell[0] += amount
+
+    def value(self):
+        with self.lock:
+            cells = list(self.cells.values())
+        return sum(cell[0] for cell in cells)
+
+
+class Histogram:
+    __slots__ = ("name", "labels", "cells", "lock")
+
+    def __init__(self, name: str, labels: dict):
+        self.name = name
+        self.labels = labels
+        self.cells = {}
+        self.lock = threading.Lock()
+
+    def _cell(self):
+        # [count, sum, max, {bucket index: count}]
+        with self.lock:
+            cell = self.cells[threading.get_ident()] = [0, 0.0, 0.0, {}]
+        return cell
+
+    def observe(self, value: float):
+        cell = self.cells.get(threading.get_ident())
+        if cell is None:
+            cell = self._cell()
+        cell[0] += 1
+        cell[1] += value
+        if value > cell[2]:
+            cell[2] = value
+        index = bucket_index(value)
+        buckets = cell[3]
+        buckets[index] = buckets.get(index, 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            cells = list(self.cells.values())
+        count, total, peak = 0, 0.0, 0.0
+        buckets = {}
+        for cell in cells:
+            count += cell[0]
+            total += cell[1]
+            peak = max(peak, cell[2])
+            # dict.copy runs without releasing the GIL, so a writer can't change it halfway
+            for index, n in cell[3].copy().items():
+                buckets[index] = buckets.get(index, 0) + n
+        return {"count": count, "sum": total, "max": peak, "buckets": {bucket_upper(index): buckets[index] for index in sorted(buckets)}}
+
+    def percentile(self, q: float, snapshot: dict | None = None):
+        # upper bound of the bucket holding the q-th percentile, capped at the largest value seen
+        if not 0 <= q <= 100:
+            raise ValueError("q must be between 0 and 100")
+        if snapshot is None:
+            snapshot = self.snapshot()
+        if not snapshot["count"]:
+            return None
+        rank = max(1, math.ceil(q / 100 * snapshot["count"]))
+        seen = 0
+        for upper, n in snapshot["buckets"].items():
+            seen += n
+            if seen >= rank:
+                return min(upper, snapshot["max"])
+        return snapshot["max"]
+
+
+class Gauge:
+    # Read when metrics are collected, either from set() or from the callback it was created with
+    __slots__ = ("name", "labels", "current", "function")
+
+    def __init__(self, name: str, labels: dict, function=None):
+        self.name = name
+        self.labels = labels
+        self.current = 0
+        self.function = function
+
+    def set(self, value):
+        self.current = value
+
+    def value(self):
+        if self.function is not None:
+            return self.function()
+        return self.current
+
+
+class _NullMetric:
+    # What a disabled registry hands out: every call is a no-op
+    __slots__ = ()
+
+    def inc(self, amount=1):
+        pass
+
+    def observe(self, value):
+        pass
+
+    def set(self, value):
+        pass
+
+    def value(self):
+        return 0
+
+
+NULL_METRIC = _NullMetric()
+
+
+class SamplingProfiler:
+    # Samples the stacks of running threads every `interval` seconds from a background thread
+    # through sys._current_frames, so the profiled code runs unmodified. Stacks are kept in the
+    # collapsed "outer;inner;leaf count" format flame graph tools read.
+    def __init__(self, interval: float = 0.01, max_depth: int = 64):
+        if interval <= 0:
+            raise ValueError("interval must be positive")
+        if not isinstance(max_depth, int) or max_depth <= 0:
+            raise ValueError("max_depth must be a positive integer")
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks = _Tally()
+        self.samples = 0
+        self.threads = None
+        self.thread = None
+        self.stopped = threading.Event()
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, threads: list | None = None):
+        # threads: Thread objects or idents to sample, None samples every thread but this one
+        if self.running:
+            return False
+        self.threads = None if threads is None else {t.ident if isinstance(t, threading.Thread) else t for t in threads}
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._sample_loop, daemon=True)
+        self.thread.start()
+        return True
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        return self
+
+    def _sample_loop(self):
+        own = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own or (self.threads is not None and ident not in self.threads):
+                    continue
+                names = []
+                while frame is not None and len(names) < self.max_depth:
+                    code = frame.f_code
+                    names.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(names))] += 1
+            self.samples += 1
+
+    def top(self, n: int = 20):
+        # [(function, samples it was the innermost frame in)]
+        leaves = _Tally()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        return leaves.most_common(n)
+
+    def collapsed(self):
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+
+class MetricsRegistry:
+    # Opt-in metrics for MarketAccess. Metrics are created on first use and cached by name and
+    # labels, collect() is the pull API and prometheus() renders the same values in the text
+    # exposition format. A disabled registry hands out no-op metrics, and the hot paths check
+    # `enabled` before reading the clock, so leaving metrics off costs one attribute check.
+    def __init__(self, enabled: bool = True, prefix: str = "simple_crypto"):
+        if not isinstance(enabled, bool):
+            raise ValueError("enabled must be a bool")
+        self.enabled = enabled
+        self.prefix = prefix
+        self.metrics = {}
+        self.lock = threading.Lock()
+        self.profiler = None
+        self.server = None
+
+    def _get(self, kind, name: str, labels: dict, *args):
+        if not self.enabled:
+            return NULL_METRIC
+        key = (name, tuple(labels.items()))
+        metric = self.metrics.get(key)
+        if metric is None:
+            with self.lock:
+                metric = self.metrics.get(key)
+                if metric is None:
+                    metric = self.metrics[key] = kind(name, labels, *args)
+        if type(metric) is not kind:
+            raise ValueError(f"Metric {name} is already registered as a {type(metric).__name__.lower()}")
+        return metric
+
+    def counter(self, name: str, **labels):
+        return self._get(Counter, name, labels)
+
+    def histogram(self, name: str, **labels):
+        return self._get(Histogram, name, labels)
+
+    def gauge(self, name: str, function=None, **labels):
+        if function is not None and not callable(function):
+            raise ValueError("function must be callable")
+        gauge = self._get(Gauge, name, labels, function)
+        if function is not None and gauge is not NULL_METRIC:
+            gauge.function = function
+        return gauge
+
+    def collect(self):
+        # {name: [{"labels": ..., "type": ..., value fields}]}
+        with self.lock:
+            metrics = list(self.metrics.values())
+        collected = {}
+        for metric in metrics:
+            entry = {"labels": dict(metric.labels)}
+            if isinstance(metric, Histogram):
+                snapshot = metric.snapshot()
+                entry.update(type="histogram", count=snapshot["count"], sum=snapshot["sum"], max=snapshot["max"],
+                             p50=metric.percentile(50, snapshot), p90=metric.percentile(90, snapshot), p99=metric.percentile(99, snapshot),
+                             buckets=snapshot["buckets"])
+            else:
+                entry.update(type="counter" if isinstance(metric, Counter) else "gauge", value=metric.value())
+            collected.setdefault(metric.name, []).append(entry)
+        return collected
+
+    @staticmethod
+    def _labels(labels: dict, extra: dict | None = None):
+        merged = dict(labels, **extra) if extra else labels
+        if not merged:
+            return ""
+        escaped = {key: str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for key, value in merged.items()}
+        return "{" + ",".join(f'{key}="{value}"' for key, value in escaped.items()) + "}"
+
+    def prometheus(self):
+        lines = []
+        for name, entries in sorted(self.collect().items()):
+            full = f"{self.prefix}_{name}" if self.prefix else name
+            lines.append(f"# TYPE {full} {entries[0]['type']}")
+            for entry in entries:
+                if entry["type"] != "histogram":
+                    lines.append(f"{full}{self._labels(entry['labels'])} {entry['value']}")
+                    continue
+                cumulative = 0
+                for upper, n in entry["buckets"].items():
+                    cumulative += n
+                    lines.append(f"{full}_bucket{self._labels(entry['labels'], {'le': repr(upper)})} {cumulative}")
+                lines.append(f"{full}_bucket{self._labels(entry['labels'], {'le': '+Inf'})} {entry['count']}")
+                lines.append(f"{full}_sum{self._labels(entry['labels'])} {entry['sum']}")
+                lines.append(f"{full}_count{self._labels(entry['labels'])} {entry['count']}")
+        return "\n".join(lines) + "\n"
+
+    def start_profiling(self, interval: float = 0.01, threads: list | None = None):
+        if self.profiler is not None and self.profiler.running:
+            return self.profiler
+        self.profiler = SamplingProfiler(interval)
+        self.profiler.start(threads)
+        return self.profiler
+
+    def stop_profiling(self):
+        if self.profiler is None:
+            return None
+        return self.profiler.stop()
+
+    def serve(self, port: int = 0, host: str = "127.0.0.1"):
+        # /metrics (Prometheus text), /metrics.json, /profile (collapsed stacks) and
+        # /profile/start?interval=0.005, /profile/stop to switch the profiler at runtime.
+        # Returns the port, which is picked by the OS with port=0.
+        if self.server is not None:
+            return self.server.server_port
+        self.server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        self.server.daemon_threads = True
+        self.server.registry = self
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.server.server_port
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        self.stop_profiling()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        registry = self.server.registry
+        path, _, query = self.path.partition("?")
+        params = dict(pair.split("=", 1) for pair in query.split("&") if "=" in pair)
+        content_type = "text/plain; version=0.0.4"
+        if path == "/metrics":
+            body = registry.prometheus()
+        elif path == "/metrics.json":
+            body = json.dumps(registry.collect(), default=str)
+            content_type = "application/json"
+        elif path == "/profile":
+            body = registry.profiler.collapsed() if registry.profiler is not None else ""
+        elif path == "/profile/start":
+            try:
+                registry.start_profiling(float(params.get("interval", 0.01)))
+            except ValueError as e:
+                self._reply(400, str(e), "text/plain")
+                return
+            body = "profiling\n"
+        elif path == "/profile/stop":
+            registry.stop_profiling()
+            body = "stopped\n"
+        else:
+            self._reply(404, "not found\n", "text/plain")
+            return
+        self._reply(200, body, content_type)
+
+    def _reply(self, status, body: str, content_type: str):
+        data = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+# shared by every MarketAccess created without a registry
+DISABLED = MetricsRegistry(enabled=False)
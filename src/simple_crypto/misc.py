@@ -1,6 +1,22 @@
 import os
-import pandas
-import aiofiles
+
+KLINE_COLUMNS = ["open_time", "open", "high", "low", "close", "volume", "close_time", "quote_volume", "count", "taker_buy_volume", "taker_buy_quote_volume", "ignore"]
+
+INTERVAL_MS = {
+    "1s": 1000,
+    "1m": 60000,
+    "3m": 180000,
+    "5m": 300000,
+    "15m": 900000,
+    "30m": 1800000,
+    "1h": 3600000,
+    "2h": 7200000,
+    "4h": 14400000,
+    "6h": 21600000,
+    "8h": 28800000,
+    "12h": 43200000,
+    "1d": 86400000,
+}
 
 def get_log_file(folder="Logs"):
     count = 1
@@ -10,8 +26,14 @@ def get_log_file(folder="Logs"):
         f.write("")
     return f"{folder}/log_{count}"
 
-async def async_csv_to_df(file_path: str):
+async def async_csv_to_df(file_path: str, names: list[str] | None = None):
+    import pandas
+    import aiofiles
+    from io import StringIO
     async with aiofiles.open(file_path, mode='r') as f:
         content = await f.read()
-    from io import StringIO
-    return pandas.read_csv(StringIO(content))
\ No newline at end of file
+    if names is not None:
+        # Binance kline dumps usually have no header row, but some mirrors add one
+        header = None if content[:1].isdigit() else 0
+        return pandas.read_csv(StringIO(content), header=header, names=names)
+    return pandas.read_csv(StringIO(content))
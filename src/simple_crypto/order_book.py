@@ -0,0 +1,148 @@
+import asyncio
+from bisect import bisect_left
+from colorama import Fore
+from src.simple_crypto.market_access import MarketAccess
+
+
+class OrderBook:
+    # Both sides are kept as parallel price/quantity lists sorted by ascending price, so the
+    # best bid is the last bid level and the best ask the first ask level. Finding a level is
+    # O(log n), adding or removing one shifts the rest of the list, O(depth). That shift is a
+    # single memmove, which for books of a few thousand levels stays cheaper than a tree's
+    # per-node overhead, and it keeps best price and top(n) reads plain slices.
+    __slots__ = ("symbol", "bid_prices", "bid_quantities", "ask_prices", "ask_quantities", "last_update_id", "synced")
+
+    def __init__(self, symbol: str):
+        if not isinstance(symbol, str):
+            raise ValueError("symbol must be a string")
+        self.symbol = symbol.upper()
+        self.bid_prices = []
+        self.bid_quantities = []
+        self.ask_prices = []
+        self.ask_quantities = []
+        self.last_update_id = None
+        self.synced = False
+
+    @staticmethod
+    def _set_level(prices: list, quantities: list, price: float, quantity: float):
+        i = bisect_left(prices, price)
+        if i < len(prices) and prices[i] == price:
+            if quantity == 0:
+                del prices[i]
+                del quantities[i]
+            else:
+                quantities[i] = quantity
+        elif quantity != 0:
+            prices.insert(i, price)
+            quantities.insert(i, quantity)
+
+    def load_snapshot(self, snapshot: dict):
+        bids = sorted((float(price), float(quantity)) for price, quantity in snapshot["bids"])
+        asks = sorted((float(price), float(quantity)) for price, quantity in snapshot["asks"])
+        self.bid_prices = [price for price, quantity in bids if quantity != 0]
+        self.bid_quantities = [quantity for price, quantity in bids if quantity != 0]
+        self.ask_prices = [price for price, quantity in asks if quantity != 0]
+        self.ask_quantities = [quantity for price, quantity in asks if quantity != 0]
+        self.last_update_id = snapshot["lastUpdateId"]
+        self.synced = True
+
+    def apply_diff(self, diff: dict):
+        # Returns False when an update was missed and the book needs a new snapshot
+        if not self.synced:
+            return False
+        first, last = diff["U"], diff["u"]
+        if last <= self.last_update_id:
+            return True
+        if first > self.last_update_id + 1:
+            self.synced = False
+            return False
+        for price, quantity in diff["b"]:
+            self._set_level(self.bid_prices, self.bid_quantities, float(price), float(quantity))
+        for price, quantity in diff["a"]:
+            self._set_level(self.ask_prices, self.ask_quantities, float(price), float(quantity))
+        self.last_update_id = last
+        return True
+
+    def best_bid(self):
+        if not self.bid_prices:
+            return None
+        return self.bid_prices[-1], self.bid_quantities[-1]
+
+    def best_ask(self):
+        if not self.ask_prices:
+            return None
+        return self.ask_prices[0], self.ask_quantities[0]
+
+    def spread(self):
+        if not self.bid_prices or not self.ask_prices:
+            return None
+        return self.ask_prices[0] - self.bid_prices[-1]
+
+    def top(self, n: int = 10):
+        bids = list(zip(self.bid_prices[:-n - 1:-1], self.bid_quantities[:-n - 1:-1]))
+        asks = list(zip(self.ask_prices[:n], self.ask_quantities[:n]))
+        return bids, asks
+
+    def __repr__(self):
+        return f"<OrderBook for {self.symbol} bid={self.best_bid()} ask={self.best_ask()}>"
+
+
+class OrderBookTracker(MarketAccess.BaseTracker):
+    # Keeps one OrderBook in sync with a depth stream: diffs are buffered while a REST
+    # snapshot is fetched, replayed on top of it, and a gap in update IDs triggers a resync.
+    def __init__(self, symbol: str, access: MarketAccess, currency: str = "USD", depth_limit: int = 1000):
+        super().__init__(symbol, access)
+        self.currency = currency
+        self.depth_limit = depth_limit
+        self.book = OrderBook(f"{symbol}{currency}")
+        self.buffer = []
+        self.resync_task = None
+
+    def on_event(self, event, msg):
+        if self.book.synced and self.book.apply_diff(msg):
+            return
+        self.buffer.append(msg)
+        if self.resync_task is None or self.resync_task.done():
+            self.access.logger.log(content=f"Fetching order book snapshot for {self.book.symbol}...", title="[ORDER-BOOK-RESYNC]", title_color=Fore.YELLOW)
+            self._start_resync()
+
+    def _start_resync(self):
+        self.resync_task = asyncio.get_running_loop().create_task(self.resync())
+        self.resync_task.add_done_callback(self._resync_done)
+
+    def _resync_done(self, task):
+        # nothing awaits the task, so a failed snapshot is reported here. The next diff retries,
+        # and the snapshot it fetches supersedes everything buffered so far, so the buffer is
+        # dropped rather than left to grow for as long as the snapshots keep failing.
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is not None:
+            self.buffer = []
+            self.access.logger.log(content=f"Order book snapshot for {self.book.symbol} failed: {error!r}", title="[ORDER-BOOK-ERROR]", title_color=Fore.RED)
+
+    async def resync(self):
+        snapshot = await self.access.request_async("/api/v3/depth", params={"symbol": self.book.symbol, "limit": self.depth_limit})
+        self.load(snapshot)
+
+    def load(self, snapshot: dict):
+        self.book.load_snapshot(snapshot)
+        buffered = self.buffer
+        self.buffer = []
+        for i, msg in enumerate(buffered):
+            if not self.book.apply_diff(msg):
+                # the snapshot is older than the first buffered diff, try again
+                self.buffer = buffered[i:]
+                self._start_resync()
+                return
+
+
+def get_order_book(access: MarketAccess, symbol: str, currency: str = "USD", event: str = "depth@100ms"):
+    # Every tracker on the same symbol shares one book, created on first use
+    key = f"{symbol.lower()}{currency.lower()}@{event}"
+    tracker = access.order_books.get(key)
+    if tracker is None:
+        tracker = OrderBookTracker(symbol, access, currency)
+        access.order_books[key] = tracker
+        access.subscribe(symbol, tracker, currency=currency, event=event)
+    return tracker.book
@@ -0,0 +1,217 @@
+import os
+import time
+import zlib
+import heapq
+import queue
+import struct
+import asyncio
+import threading
+from src.simple_crypto.decoding import json_loads
+
+# A recording is one file per stream made of independent chunks: a fixed header followed by a
+# zlib-compressed run of records. The header carries the receive time of the first and last
+# record so a reader can skip whole chunks without decompressing them, and a chunk cut short
+# by a crash only loses that chunk.
+CHUNK_MAGIC = b"SCR1"
+CHUNK_HEADER = struct.Struct("<4sIIqq")
+RECORD_HEADER = struct.Struct("<qI")
+
+
+def stream_file(root: str, stream: str):
+    return os.path.join(root, f"{stream}.rec")
+
+
+def read_stream(path: str, start: int | None = None, end: int | None = None):
+    # Yields (receive time in ns, raw message bytes) in the order they were recorded
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(CHUNK_HEADER.size)
+            if len(header) < CHUNK_HEADER.size:
+                return
+            magic, size, count, first, last = CHUNK_HEADER.unpack(header)
+            if magic != CHUNK_MAGIC:
+                raise ValueError(f"{path} is not a stream recording or is corrupted")
+            if (start is not None and last < start) or (end is not None and first > end):
+                f.seek(size, os.SEEK_CUR)
+                continue
+            compressed = f.read(size)
+            if len(compressed) < size:
+                return
+            payload = zlib.decompress(compressed)
+            offset = 0
+            for _ in range(count):
+                received, length = RECORD_HEADER.unpack_from(payload, offset)
+                offset += RECORD_HEADER.size
+                if (start is None or received >= start) and (end is None or received <= end):
+                    yield received, payload[offset:offset + length]
+                offset += length
+
+
+class StreamRecorder:
+    # Hooked into MarketAccess through its recorder argument: every raw frame a listener
+    # receives is stamped and buffered per stream on the event loop, and full chunks are
+    # compressed and written by a background thread so the loop never waits on zlib or disk.
+    def __init__(self, root: str = "Recordings", streams: list[str] | None = None, chunk_size: int = 1 << 20, flush_interval: float = 5.0, level: int = 6):
+        if not isinstance(chunk_size, int) or chunk_size <= 0:
+            raise ValueError("chunk_size must be a positive integer")
+        if flush_interval <= 0:
+            raise ValueError("flush_interval must be positive")
+        if not 0 <= level <= 9:
+            raise ValueError("level must be between 0 and 9")
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.streams = set(streams) if streams is not None else None
+        self.chunk_size = chunk_size
+        self.flush_interval = flush_interval
+        self.level = level
+        self.buffers = {}
+        self.records = 0
+        self.written = 0
+        self.last_flush = time.monotonic()
+        self.lock = threading.Lock()
+        self.chunks = queue.Queue()
+        self.files = {}
+        self.writer = threading.Thread(target=self._write_chunks, daemon=True)
+        self.writer.start()
+
+    def record(self, stream: str, message: str | bytes, received: int | None = None):
+        if self.streams is not None and stream not in self.streams:
+            return
+        if received is None:
+            received = time.time_ns()
+        if isinstance(message, str):
+            message = message.encode()
+        with self.lock:
+            buffer = self.buffers.get(stream)
+            if buffer is None:
+                # [raw records, record count, first receive time, last receive time]
+                buffer = self.buffers[stream] = [bytearray(), 0, received, received]
+            buffer[0] += RECORD_HEADER.pack(received, len(message))
+            buffer[0] += message
+            buffer[1] += 1
+            buffer[3] = received
+            self.records += 1
+            if len(buffer[0]) >= self.chunk_size:
+                self._hand_off(stream)
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def _hand_off(self, stream: str):
+        buffer = self.buffers.pop(stream)
+        self.chunks.put((stream, bytes(buffer[0]), buffer[1], buffer[2], buffer[3]))
+
+    def flush(self, wait: bool = False):
+        with self.lock:
+            for stream in list(self.buffers):
+                self._hand_off(stream)
+            self.last_flush = time.monotonic()
+        if wait:
+            self.chunks.join()
+
+    def _write_chunks(self):
+        while True:
+            chunk = self.chunks.get()
+            try:
+                if chunk is None:
+                    return
+                stream, payload, count, first, last = chunk
+                compressed = zlib.compress(payload, self.level)
+                f = self.files.get(stream)
+                if f is None:
+                    f = self.files[stream] = open(stream_file(self.root, stream), 'ab')
+                f.write(CHUNK_HEADER.pack(CHUNK_MAGIC, len(compressed), count, first, last))
+                f.write(compressed)
+                f.flush()
+                self.written += count
+            finally:
+                self.chunks.task_done()
+
+    def close(self):
+        self.flush()
+        self.chunks.put(None)
+        self.writer.join()
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+
+class StreamReplayer:
+    # Feeds recordings back through MarketAccess.msgs. Streams are merged on receive time with
+    # heapq.merge; ties go to the stream whose name sorts first, so a replay is deterministic.
+    def __init__(self, root: str = "Recordings", streams: list[str] | None = None, start: int | None = None, end: int | None = None):
+        if not os.path.isdir(root):
+            raise ValueError(f"Recording directory {root} does not exist")
+        available = sorted(name[:-4] for name in os.listdir(root) if name.endswith(".rec"))
+        if streams is None:
+            streams = available
+        missing = [stream for stream in streams if stream not in available]
+        if missing:
+            raise ValueError(f"No recordings for: {', '.join(missing)}")
+        self.root = root
+        self.streams = sorted(streams)
+        self.start = start
+        self.end = end
+
+    def _source(self, stream: str):
+        for received, raw in read_stream(stream_file(self.root, stream), self.start, self.end):
+            yield received, stream, raw
+
+    def records(self):
+        # (receive time in ns, stream, raw message bytes)
+        return heapq.merge(*[self._source(stream) for stream in self.streams], key=lambda record: record[0])
+
+    @staticmethod
+    def decode(raw: bytes):
+        data = json_loads(raw)
+        # frames recorded off a combined connection still carry their wrapper
+        if isinstance(data, dict) and "stream" in data and "data" in data:
+            return data["data"]
+        return data
+
+    def messages(self):
+        for received, stream, raw in self.records():
+            yield {'stream': stream, 'data': self.decode(raw)}
+
+    async def feed(self, market, speed: float | None = None, lossless: bool = True, end: bool = True):
+        # speed=None replays as fast as the trackers keep up, otherwise recorded gaps are
+        # replayed divided by speed. lossless holds a message back instead of letting the
+        # queue conflate or drop it, which also keeps the dispatch order independent of timing.
+        if speed is not None and speed <= 0:
+            raise ValueError("speed must be positive")
+        msgs = market.msgs
+        first = None
+        began = time.monotonic()
+        count = 0
+        for received, stream, raw in self.records():
+            if speed is not None:
+                if first is None:
+                    first = received
+                delay = began + (received - first) / 1e9 / speed - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            if lossless:
+                await msgs.wait_for_space(stream)
+            # trackers get the same dicts or typed messages the market's live listeners would give them
+            await msgs.put({'stream': stream, 'data': market.decoder.convert(stream, self.decode(raw))})
+            count += 1
+        if end:
+            await msgs.put({'stream': 'end', 'data': None})
+        return count
+
+    def run(self, market, speed: float | None = None, lossless: bool = True):
+        # Replays into the market's trackers without opening any connection, returns the number of messages fed
+        async def replay():
+            processor = asyncio.create_task(market.msg_processor())
+            count = await self.feed(market, speed, lossless)
+            await processor
+            return count
+
+        with market.connected_lock:
+            if market.connected:
+                raise ValueError("Cannot replay into a MarketAccess that is running")
+            market.connected = True
+        try:
+            return asyncio.run(replay())
+        finally:
+            with market.connected_lock:
+                market.connected = False
@@ -0,0 +1,190 @@
+import os
+import re
+import json
+import numpy as np
+from src.simple_crypto.misc import INTERVAL_MS
+from src.simple_crypto.kline_store import KlineStore, KlineDataset, KLINE_DTYPES
+from src.simple_crypto.market_access import MarketAccess
+
+INTERVAL_UNITS_MS = {"s": 1000, "m": 60000, "h": 3600000, "d": 86400000, "w": 604800000}
+# Binance's weekly klines open on Monday 00:00 UTC, four days after the epoch (a Thursday)
+WEEK_OFFSET_MS = 4 * INTERVAL_UNITS_MS["d"]
+
+
+def interval_ms(interval: str):
+    # Any "<n><unit>" interval, not only the ones Binance publishes (e.g. "7m", "90s", "2d")
+    if interval in INTERVAL_MS:
+        return INTERVAL_MS[interval]
+    match = re.fullmatch(r"([1-9][0-9]*)([smhdw])", interval) if isinstance(interval, str) else None
+    if match is None:
+        raise ValueError(f"Invalid interval {interval}. Must be a number followed by one of: {', '.join(INTERVAL_UNITS_MS)}")
+    return int(match.group(1)) * INTERVAL_UNITS_MS[match.group(2)]
+
+
+def bucket_offset(target_ms: int):
+    # where buckets start relative to the epoch: weeks (and multiples) on Mondays, the rest on the epoch
+    return WEEK_OFFSET_MS if target_ms % INTERVAL_UNITS_MS["w"] == 0 else 0
+
+
+def resample(columns: dict[str, np.ndarray], target_ms: int, drop_partial: bool = True):
+    # Buckets are aligned like Binance's own klines, so a 1m -> 1h resample gives the same
+    # rows as the 1h download. Every bucket boundary is found in one pass and each field is
+    # reduced with a single reduceat call. With drop_partial a leading bucket the source only
+    # covers the end of, and a trailing one it hasn't finished yet, are left out.
+    open_time = np.asarray(columns["open_time"], dtype=np.int64)
+    if not len(open_time):
+        return {name: np.zeros(0, dtype=dtype) for name, dtype in KLINE_DTYPES.items()}
+    offset = bucket_offset(target_ms)
+    buckets = (open_time - offset) // target_ms
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(buckets)] - 1
+    bucket_open = buckets[starts] * target_ms + offset
+    result = {
+        "open_time": bucket_open,
+        "open": np.asarray(columns["open"])[starts].astype(np.float64),
+        "high": np.maximum.reduceat(np.asarray(columns["high"], dtype=np.float64), starts),
+        "low": np.minimum.reduceat(np.asarray(columns["low"], dtype=np.float64), starts),
+        "close": np.asarray(columns["close"])[ends].astype(np.float64),
+        "close_time": bucket_open + target_ms - 1,
+    }
+    for name in ["volume", "quote_volume", "count", "taker_buy_volume", "taker_buy_quote_volume"]:
+        result[name] = np.add.reduceat(np.asarray(columns[name], dtype=KLINE_DTYPES[name]), starts)
+    if drop_partial:
+        first = 1 if int(open_time[0]) > int(bucket_open[0]) else 0
+        last = len(starts) - 1 if int(columns["close_time"][-1]) < int(result["close_time"][-1]) else len(starts)
+        result = {name: column[first:last] for name, column in result.items()}
+    return {name: result[name] for name in KLINE_DTYPES}
+
+
+class ResampleCache:
+    # Derived intervals live in a derived/<interval> directory inside the source dataset and
+    # remember the source meta they were built from. Any append or rewrite of the source
+    # changes its meta, and the derived interval is rebuilt on the next open.
+    def __init__(self, data_dir: str = "Data"):
+        self.store = KlineStore(data_dir)
+
+    def derived_dir(self, symbol: str, currency: str, source_interval: str, interval: str):
+        return os.path.join(self.store.dataset_dir(symbol, currency, source_interval), "derived", interval)
+
+    def _read_meta(self, path: str):
+        meta_file = os.path.join(path, "meta.json")
+        if not os.path.isfile(meta_file):
+            return None
+        with open(meta_file, 'r') as f:
+            return json.load(f)
+
+    def source_for(self, symbol: str, currency: str, interval: str):
+        # The coarsest stored interval that divides the target, the fewer rows to aggregate the better
+        target = interval_ms(interval)
+        stored = [name for name in INTERVAL_MS if target % INTERVAL_MS[name] == 0 and INTERVAL_MS[name] < target and self.store.read_meta(symbol, currency, name)["rows"]]
+        if not stored:
+            raise ValueError(f"No stored data for {symbol.upper()}{currency.upper()} fine enough to build {interval} klines")
+        return max(stored, key=lambda name: INTERVAL_MS[name])
+
+    def open(self, symbol: str, currency: str, interval: str, source_interval: str | None = None):
+        if source_interval is None:
+            source_interval = self.source_for(symbol, currency, interval)
+        target = interval_ms(interval)
+        if target % INTERVAL_MS[source_interval] != 0 or target <= INTERVAL_MS[source_interval]:
+            raise ValueError(f"{interval} is not a multiple of {source_interval}")
+        source_meta = self.store.read_meta(symbol, currency, source_interval)
+        path = self.derived_dir(symbol, currency, source_interval, interval)
+        meta = self._read_meta(path)
+        if meta is None or meta.get("source") != source_meta:
+            meta = self._build(path, self.store.open(symbol, currency, source_interval), source_meta, target)
+        return KlineDataset(path, meta)
+
+    def _build(self, path: str, source: KlineDataset, source_meta: dict, target: int):
+        columns = resample(source.columns, target)
+        os.makedirs(path, exist_ok=True)
+        for name, dtype in KLINE_DTYPES.items():
+            with open(os.path.join(path, f"{name}.bin.tmp"), 'wb') as f:
+                f.write(np.ascontiguousarray(columns[name], dtype=dtype).tobytes())
+            os.replace(os.path.join(path, f"{name}.bin.tmp"), os.path.join(path, f"{name}.bin"))
+        # derived rows are filed under the month their bucket opens in
+        opens = columns["open_time"]
+        labels = opens.astype("datetime64[ms]").astype("datetime64[M]")
+        starts = np.flatnonzero(np.r_[True, labels[1:] != labels[:-1]]) if len(opens) else np.zeros(0, dtype=np.int64)
+        stops = np.r_[starts[1:], len(opens)]
+        months = {str(labels[start]): [int(start), int(stop), int(opens[start]), int(columns["close_time"][stop - 1])] for start, stop in zip(starts, stops)}
+        meta = {"rows": len(opens), "months": months, "source": source_meta}
+        with open(os.path.join(path, "meta.json.tmp"), 'w') as f:
+            json.dump(meta, f)
+        os.replace(os.path.join(path, "meta.json.tmp"), os.path.join(path, "meta.json"))
+        return meta
+
+
+class KlineAggregator:
+    # Live counterpart of resample: takes closed source klines (the "k" object of a kline
+    # stream message) and returns the higher timeframe kline once its last source bar closes,
+    # with the same fields and bucket boundaries the batch resample produces. Like resample's
+    # drop_partial, a first bucket joined halfway through is never returned.
+    __slots__ = ("interval", "target", "offset", "drop_partial", "partial", "symbol", "bucket", "bar")
+
+    def __init__(self, interval: str, drop_partial: bool = True):
+        self.interval = interval
+        self.target = interval_ms(interval)
+        self.offset = bucket_offset(self.target)
+        self.drop_partial = drop_partial
+        self.partial = False
+        self.symbol = None
+        self.bucket = None
+        self.bar = None
+
+    def push(self, kline: dict):
+        # Returns the bars finished by this kline, usually none or one. A gap in the source
+        # finishes the previous bucket with whatever it had.
+        if not kline["x"]:
+            return []
+        bucket = (int(kline["t"]) - self.offset) // self.target
+        finished = []
+        if self.bar is not None and bucket != self.bucket:
+            self.bar["x"] = True
+            if not self.partial:
+                finished.append(self.bar)
+            self.bar = None
+            self.partial = False
+        if self.bar is None:
+            start = bucket * self.target + self.offset
+            self.partial = self.drop_partial and self.bucket is None and int(kline["t"]) > start
+            self.bucket = bucket
+            self.symbol = kline.get("s")
+            self.bar = {"t": start, "T": start + self.target - 1, "s": self.symbol, "i": self.interval,
+                        "o": float(kline["o"]), "c": float(kline["c"]), "h": float(kline["h"]), "l": float(kline["l"]),
+                        "v": 0.0, "n": 0, "x": False, "q": 0.0, "V": 0.0, "Q": 0.0}
+        bar = self.bar
+        bar["c"] = float(kline["c"])
+        bar["h"] = max(bar["h"], float(kline["h"]))
+        bar["l"] = min(bar["l"], float(kline["l"]))
+        bar["v"] += float(kline["v"])
+        bar["n"] += int(kline["n"])
+        bar["q"] += float(kline["q"])
+        bar["V"] += float(kline["V"])
+        bar["Q"] += float(kline["Q"])
+        if int(kline["T"]) >= bar["T"]:
+            bar["x"] = True
+            if not self.partial:
+                finished.append(bar)
+            self.bar = None
+            self.partial = False
+        return finished
+
+    def current(self):
+        # the bucket still being built, marked x=False like an open kline
+        return None if self.partial else self.bar
+
+
+class ResampleTracker(MarketAccess.BaseTracker):
+    # Subscribed to a kline_1m (or any finer) stream, forwards kline_<interval> events built
+    # from it to another tracker as if they came from the exchange
+    def __init__(self, symbol: str, access: MarketAccess, interval: str, target: MarketAccess.BaseTracker, currency: str = "USD"):
+        super().__init__(symbol, access)
+        if not isinstance(target, MarketAccess.BaseTracker):
+            raise ValueError("target must be a subclass of BaseTracker")
+        self.aggregator = KlineAggregator(interval)
+        self.target = target
+        self.event = f"{symbol.lower()}{currency.lower()}@kline_{interval}"
+
+    def on_event(self, event, msg):
+        for bar in self.aggregator.push(msg["k"]):
+            self.target.on_event(self.event, {"e": "kline", "E": bar["T"], "s": bar["s"], "k": bar})
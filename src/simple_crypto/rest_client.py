@@ -0,0 +1,148 @@
+import time
+import asyncio
+import threading
+
+REST_BASES = {
+    True: "https://api.binance.us",
+    False: "https://eapi.binance.com",
+}
+
+
+class RestClient:
+    # Shared keep-alive session for the REST API. Request weight is tracked per base URL from
+    # the X-MBX-USED-WEIGHT-1M header so callers slow down before the exchange starts
+    # answering 429s, and Retry-After is honoured when it does.
+    def __init__(self, timeout: float = 10, pool_size: int = 10, weight_limit: int = 1200, weight_margin: float = 0.9, max_retries: int = 3, bases: dict | None = None):
+        if not isinstance(timeout, (int, float)) or timeout <= 0:
+            raise ValueError("timeout must be a positive number")
+        if not isinstance(weight_limit, int) or weight_limit <= 0:
+            raise ValueError("weight_limit must be a positive integer")
+        if not 0 < weight_margin <= 1:
+            raise ValueError("weight_margin must be between 0 and 1")
+        if bases is None:
+            bases = REST_BASES
+        self.timeout = timeout
+        self.weight_limit = weight_limit
+        self.weight_margin = weight_margin
+        self.max_retries = max_retries
+        self.bases = bases
+        self.pool_size = pool_size
+        self._session = None
+        self.lock = threading.Lock()
+        self.used_weight = {}
+        self.backoff_until = {}
+
+    @property
+    def session(self):
+        # requests is imported with the first request, clients that never send one don't load it
+        if self._session is None:
+            with self.lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    self._session = session
+        return self._session
+
+    def delay(self, base: str):
+        now = time.time()
+        with self.lock:
+            delay = self.backoff_until.get(base, 0) - now
+            used, minute = self.used_weight.get(base, (0, None))
+            if minute == int(now // 60) and used >= self.weight_limit * self.weight_margin:
+                # the exchange resets the weight counter at the start of every minute
+                delay = max(delay, (minute + 1) * 60 - now)
+        return max(delay, 0)
+
+    def _record(self, base: str, response):
+        now = time.time()
+        with self.lock:
+            used = response.headers.get("X-MBX-USED-WEIGHT-1M")
+            if used is not None:
+                self.used_weight[base] = (int(used), int(now // 60))
+            if response.status_code in (418, 429):
+                retry_after = response.headers.get("Retry-After")
+                self.backoff_until[base] = now + (int(retry_after) if retry_after is not None else 60)
+
+    def _send(self, base: str, endpoint: str, params: dict | None):
+        response = self.session.get(f"{base}{endpoint}", params=params, timeout=self.timeout)
+        self._record(base, response)
+        return response
+
+    def _geo_blocked(self, response):
+        if response.status_code != 451:
+            return False
+        try:
+            return response.json().get("code") == 0
+        except ValueError:
+            return False
+
+    def _outcome(self, response, switched: bool, attempt: int):
+        # returns ("done", value), ("switch", None) or ("retry", None) and raises on hard failures
+        if response.status_code == 200:
+            return "done", response.json()
+        if self._geo_blocked(response) and not switched:
+            return "switch", None
+        if response.status_code == 429 or response.status_code >= 500:
+            if attempt < self.max_retries:
+                return "retry", None
+        raise ConnectionError(f"Error {response.status_code}: {response.text}")
+
+    def get(self, endpoint: str, us: bool = True, params: dict | None = None):
+        switched = False
+        attempt = 0
+        while True:
+            base = self.bases[us]
+            delay = self.delay(base)
+            if delay:
+                time.sleep(delay)
+            outcome, value = self._outcome(self._send(base, endpoint, params), switched, attempt)
+            if outcome == "done":
+                return value, us
+            if outcome == "switch":
+                us = not us
+                switched = True
+            else:
+                attempt += 1
+                if not self.delay(base):
+                    # server errors carry no Retry-After, so back off exponentially
+                    time.sleep(min(2 ** attempt, 30))
+
+    async def get_async(self, endpoint: str, us: bool = True, params: dict | None = None):
+        switched = False
+        attempt = 0
+        while True:
+            base = self.bases[us]
+            delay = self.delay(base)
+            if delay:
+                await asyncio.sleep(delay)
+            response = await asyncio.to_thread(self._send, base, endpoint, params)
+            outcome, value = self._outcome(response, switched, attempt)
+            if outcome == "done":
+                return value, us
+            if outcome == "switch":
+                us = not us
+                switched = True
+            else:
+                attempt += 1
+                if not self.delay(base):
+                    await asyncio.sleep(min(2 ** attempt, 30))
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+
+
+_shared_client = None
+_shared_lock = threading.Lock()
+
+
+def shared_client():
+    global _shared_client
+    with _shared_lock:
+        if _shared_client is None:
+            _shared_client = RestClient()
+        return _shared_client
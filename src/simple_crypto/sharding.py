@@ -0,0 +1,442 @@
+import os
+import time
+import asyncio
+import queue
+import pickle
+import struct
+import bisect
+import hashlib
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+from colorama import Fore
+from src.simple_crypto.market_access import MarketAccess
+
+# Single producer / single consumer byte ring in shared memory. The header holds the total
+# bytes ever written (head, producer owned), the capacity, and the total bytes ever read
+# (tail, consumer owned) on its own cache line. The counters go through a memoryview cast to
+# "Q" so each one is read and written as a single aligned 8 byte word; struct.pack_into
+# writes byte by byte and the other side could see half of an update. Records are a 4 byte
+# length plus payload, padded to 8 bytes, so the space left before the end of the buffer
+# always fits the wrap marker that sends the reader back to the start. A record may take at
+# most half the ring: the bytes skipped by a wrap are then shorter than the record, and an
+# empty ring always has room for both wherever the head happens to sit.
+RING_HEADER = 128
+HEAD, CAPACITY, TAIL = 0, 1, 8
+LENGTH = struct.Struct("<I")
+WRAP = 0xFFFFFFFF
+
+
+SPIN = 64 if (os.cpu_count() or 1) > 1 else 0
+
+
+def _backoff(attempt: int):
+    # spin briefly, then yield, then sleep: an idle shard costs next to no CPU. Spinning only
+    # pays with a spare core to spin on, on one core it takes the time from the other side.
+    if attempt < SPIN:
+        return
+    if attempt < SPIN + 64:
+        time.sleep(0)
+    else:
+        time.sleep(0.0005)
+
+
+class RingBuffer:
+    def __init__(self, capacity: int = 1 << 22, name: str | None = None):
+        # name=None creates a new ring, otherwise attaches to an existing one
+        if name is None:
+            if not isinstance(capacity, int) or capacity < 64 or capacity % 8:
+                raise ValueError("capacity must be a multiple of 8 and at least 64 bytes")
+            self.shm = shared_memory.SharedMemory(create=True, size=RING_HEADER + capacity)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self.name = self.shm.name
+        self.buf = self.shm.buf
+        self.counters = self.buf[:RING_HEADER].cast("Q")
+        if self.owner:
+            self.counters[HEAD] = 0
+            self.counters[TAIL] = 0
+            self.counters[CAPACITY] = capacity
+        self.capacity = self.counters[CAPACITY]
+        self.max_record = self.capacity // 2
+
+    def try_put(self, payload: bytes):
+        length = len(payload)
+        padded = (LENGTH.size + length + 7) & ~7
+        if padded > self.max_record:
+            raise ValueError(f"Record of {length} bytes exceeds half of a ring of {self.capacity} bytes")
+        buf = self.buf
+        head = self.counters[HEAD]
+        tail = self.counters[TAIL]
+        pos = head % self.capacity
+        to_end = self.capacity - pos
+        wrap = to_end if to_end < padded else 0
+        if self.capacity - (head - tail) < padded + wrap:
+            return False
+        if wrap:
+            LENGTH.pack_into(buf, RING_HEADER + pos, WRAP)
+            head += wrap
+            pos = 0
+        start = RING_HEADER + pos
+        LENGTH.pack_into(buf, start, length)
+        buf[start + LENGTH.size:start + LENGTH.size + length] = payload
+        # the record is complete before the head that publishes it moves
+        self.counters[HEAD] = head + padded
+        return True
+
+    def put(self, payload: bytes, timeout: float | None = None):
+        attempt = 0
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.try_put(payload):
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            _backoff(attempt)
+            attempt += 1
+        return True
+
+    def try_get(self):
+        buf = self.buf
+        tail = self.counters[TAIL]
+        if tail == self.counters[HEAD]:
+            return None
+        pos = tail % self.capacity
+        length = LENGTH.unpack_from(buf, RING_HEADER + pos)[0]
+        if length == WRAP:
+            tail += self.capacity - pos
+            pos = 0
+            length = LENGTH.unpack_from(buf, RING_HEADER)[0]
+        start = RING_HEADER + pos + LENGTH.size
+        payload = bytes(buf[start:start + length])
+        self.counters[TAIL] = tail + ((LENGTH.size + length + 7) & ~7)
+        return payload
+
+    def get(self, timeout: float | None = None):
+        attempt = 0
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            payload = self.try_get()
+            if payload is not None:
+                return payload
+            if deadline is not None and time.monotonic() > deadline:
+                return None
+            _backoff(attempt)
+            attempt += 1
+
+    def close(self):
+        self.counters.release()
+        self.counters = None
+        self.buf = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class HashRing:
+    # Consistent hashing of stream names onto shards: each shard owns `replicas` points on the
+    # ring, so adding a shard only moves about 1/n of the streams. blake2b rather than hash()
+    # keeps the mapping the same in every process and every run.
+    def __init__(self, shards: int, replicas: int = 64):
+        if not isinstance(shards, int) or shards <= 0:
+            raise ValueError("shards must be a positive integer")
+        points = sorted((self._hash(f"shard-{shard}-{replica}"), shard) for shard in range(shards) for replica in range(replicas))
+        self.keys = [key for key, shard in points]
+        self.shards = [shard for key, shard in points]
+
+    @staticmethod
+    def _hash(key: str):
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little")
+
+    def shard_for(self, stream: str):
+        index = bisect.bisect(self.keys, self._hash(stream))
+        return self.shards[index % len(self.shards)]
+
+
+class ShardMarket(MarketAccess):
+    # The MarketAccess trackers are built against inside a shard process. It never connects,
+    # events arrive from the parent, and emit() sends a result back to it.
+    def __init__(self, index: int, results: RingBuffer, logger=None):
+        super().__init__(logger=logger)
+        self.index = index
+        self.results = results
+
+    def emit(self, result):
+        self.results.put(pickle.dumps(("result", result), protocol=pickle.HIGHEST_PROTOCOL))
+
+
+async def _shard_loop(index: int, inbound: RingBuffer, outbound: RingBuffer):
+    # Trackers run on an event loop like they do in the parent, so the ones that start tasks
+    # (the order book's snapshot fetch) work. The market never runs a dispatcher here, its
+    # loop stays None and subscription changes don't try to wake one.
+    market = ShardMarket(index, outbound, logger=MarketAccess.BaseLogger(plain=True, level="warning"))
+    trackers = {}
+    idle = 0
+    handled = 0
+    while True:
+        payload = inbound.try_get()
+        if payload is None:
+            # the loop's backoff: pending tasks run on every pass, sleeping once idle a while
+            await asyncio.sleep(0 if idle < SPIN + 64 else 0.0005)
+            idle += 1
+            continue
+        idle = 0
+        command = pickle.loads(payload)
+        kind = command[0]
+        if kind == "events":
+            stock = market.stocks.get(command[1])
+            if stock is not None:
+                stock.notify_batch(command[1], command[2])
+        elif kind == "add":
+            key, stream, symbol, factory, args, kwargs = command[1:]
+            try:
+                trackers[key] = (stream, factory(symbol, market, *args, **kwargs))
+                market.stocks.add(stream, trackers[key][1])
+            except Exception as e:
+                market.logger.log(content=f"Shard {index} failed to build a tracker for {stream}: {e}", title="[SHARD-ERROR]", title_color=Fore.RED)
+        elif kind == "remove":
+            stream, tracker = trackers.pop(command[1], (None, None))
+            if tracker is not None:
+                market.stocks.remove(stream, tracker)
+        elif kind == "sync":
+            # everything sent before the sync has been handled
+            outbound.put(pickle.dumps(("synced", command[1]), protocol=pickle.HIGHEST_PROTOCOL))
+        elif kind == "stop":
+            return
+        handled += 1
+        if not handled % 16:
+            # a busy ring doesn't starve the tasks
+            await asyncio.sleep(0)
+
+
+def _shard_main(index: int, inbound_name: str, outbound_name: str):
+    inbound = RingBuffer(name=inbound_name)
+    outbound = RingBuffer(name=outbound_name)
+    try:
+        asyncio.run(_shard_loop(index, inbound, outbound))
+    finally:
+        inbound.close()
+        outbound.close()
+
+
+class ShardedExecutor:
+    # Runs trackers in worker processes so CPU heavy ones use more than one core. The parent
+    # MarketAccess keeps ingest and decoding; each sharded stream gets one routing tracker in
+    # the parent that ships the dispatcher's batches to the shard owning the stream, picked by
+    # consistent hashing. Trackers are created inside the shard from a picklable factory
+    # called as factory(symbol, shard_market, *args, **kwargs) and run on the shard's event
+    # loop, and whatever they emit() comes back through on_result(shard, result) or the results
+    # queue. A full ring blocks the dispatcher, which pushes back on the market's queue like
+    # the "block" policy does. A shard whose process dies is logged once and skipped from then
+    # on, its events are dropped.
+    def __init__(self, market: MarketAccess, shards: int | None = None, ring_size: int = 1 << 24, on_result=None, start_method: str = "spawn"):
+        if not isinstance(market, MarketAccess):
+            raise ValueError("market must be an instance of MarketAccess")
+        if shards is None:
+            shards = max(1, (os.cpu_count() or 2) - 1)
+        if not isinstance(shards, int) or shards <= 0:
+            raise ValueError("shards must be a positive integer")
+        if on_result is not None and not callable(on_result):
+            raise ValueError("on_result must be callable")
+        self.market = market
+        self.shards = shards
+        self.ring_size = ring_size
+        self.on_result = on_result
+        self.context = multiprocessing.get_context(start_method)
+        self.ring = HashRing(shards)
+        self.results = queue.Queue()
+        self.inbound = []
+        self.outbound = []
+        self.processes = []
+        # the rings are single producer: the dispatcher and the subscribe/sync/stop callers
+        # take the shard's lock around every write
+        self.send_locks = []
+        self.routes = {}
+        self.subscriptions = {}
+        self.next_key = 0
+        self.lock = threading.Lock()
+        self.synced = threading.Condition()
+        self.acks = {}
+        self.dead = set()
+        self.stopping = False
+        self.running = False
+        self.collector = None
+
+    def start(self):
+        if self.running:
+            return
+        self.dead = set()
+        self.stopping = False
+        for index in range(self.shards):
+            inbound = RingBuffer(self.ring_size)
+            outbound = RingBuffer(self.ring_size)
+            process = self.context.Process(target=_shard_main, args=(index, inbound.name, outbound.name), daemon=True)
+            process.start()
+            self.inbound.append(inbound)
+            self.outbound.append(outbound)
+            self.processes.append(process)
+            self.send_locks.append(threading.Lock())
+        self.running = True
+        self.collector = threading.Thread(target=self._collect, daemon=True)
+        self.collector.start()
+        self.market.logger.log(content=f"Started {self.shards} tracker shards", title="[SHARDS-STARTED]", title_color=Fore.GREEN)
+
+    def _send(self, shard: int, command):
+        # Returns False when the shard is dead and the command was dropped
+        if shard in self.dead:
+            return False
+        payload = pickle.dumps(command, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(payload) + 8 > self.ring_size // 2 and command[0] == "events" and len(command[2]) > 1:
+            # too big for one record, ship the batch in halves
+            half = len(command[2]) // 2
+            first = self._send(shard, ("events", command[1], command[2][:half]))
+            return self._send(shard, ("events", command[1], command[2][half:])) and first
+        with self.send_locks[shard]:
+            # a full ring is only waited on while the shard is alive to drain it
+            while not self.inbound[shard].put(payload, timeout=0.5):
+                if not self.processes[shard].is_alive():
+                    self._mark_dead(shard)
+                    return False
+        return True
+
+    def _mark_dead(self, shard: int):
+        with self.synced:
+            if shard in self.dead:
+                return
+            self.dead.add(shard)
+            self.synced.notify_all()
+        self.market.logger.log(content=f"Shard {shard} (process {self.processes[shard].pid}) died with exit code {self.processes[shard].exitcode}, dropping its events", title="[SHARD-ERROR]", title_color=Fore.RED)
+
+    def _check_alive(self):
+        for shard, process in enumerate(self.processes):
+            if shard not in self.dead and not process.is_alive():
+                self._mark_dead(shard)
+
+    def _deliver(self, shard: int, payload: bytes):
+        kind, result = pickle.loads(payload)
+        if kind == "synced":
+            with self.synced:
+                self.acks[result] = self.acks.get(result, 0) + 1
+                self.synced.notify_all()
+            return
+        if self.on_result is None:
+            self.results.put((shard, result))
+            return
+        try:
+            self.on_result(shard, result)
+        except Exception as e:
+            self.market.logger.log(content=f"on_result failed for shard {shard}: {e}", title="[SHARD-ERROR]", title_color=Fore.RED)
+
+    def _drain(self):
+        got = False
+        for shard, ring in enumerate(self.outbound):
+            payload = ring.try_get()
+            while payload is not None:
+                got = True
+                self._deliver(shard, payload)
+                payload = ring.try_get()
+        return got
+
+    def _collect(self):
+        # shares the GIL with the dispatcher, so it sleeps instead of spinning
+        checked = time.monotonic()
+        while self.running:
+            if not self._drain():
+                time.sleep(0.0005)
+            if not self.stopping and time.monotonic() - checked > 1:
+                checked = time.monotonic()
+                self._check_alive()
+
+    def sync(self, timeout: float | None = None):
+        # Waits until every live shard has handled what was sent to it so far, returns False on
+        # timeout or when a shard died
+        if not self.running:
+            raise ValueError("ShardedExecutor must be started before syncing")
+        with self.lock:
+            token = self.next_key
+            self.next_key += 1
+            sent = [shard for shard in range(self.shards) if self._send(shard, ("sync", token))]
+        with self.synced:
+            self.synced.wait_for(lambda: self.acks.get(token, 0) >= len(set(sent) - self.dead), timeout)
+            done = self.acks.pop(token, 0) == self.shards
+        return done
+
+    def shard_for(self, symbol: str, currency: str = "USD", event: str = "ticker"):
+        return self.ring.shard_for(f"{symbol.lower()}{currency.lower()}@{event}")
+
+    def subscribe(self, symbol: str, factory, currency: str = "USD", event: str = "ticker", *args, **kwargs):
+        # Returns a key for unsubscribe
+        if not self.running:
+            raise ValueError("ShardedExecutor must be started before subscribing")
+        if not callable(factory):
+            raise ValueError("factory must be callable")
+        stream = f"{symbol.lower()}{currency.lower()}@{event}"
+        shard = self.ring.shard_for(stream)
+        with self.lock:
+            key = self.next_key
+            self.next_key += 1
+            self._send(shard, ("add", key, stream, symbol, factory, args, kwargs))
+            self.subscriptions[key] = stream
+            route = self.routes.get(stream)
+            if route is None:
+                route = self.routes[stream] = _ShardRoute(symbol, self.market, self, shard, currency, event)
+                self.market.subscribe(symbol, route, currency, event)
+            route.count += 1
+        return key
+
+    def unsubscribe(self, key: int):
+        with self.lock:
+            if key not in self.subscriptions:
+                return False
+            stream = self.subscriptions.pop(key)
+            route = self.routes[stream]
+            self._send(route.shard, ("remove", key))
+            route.count -= 1
+            if not route.count:
+                del self.routes[stream]
+                self.market.unsubscribe(route.symbol, route, route.currency, route.event)
+        return True
+
+    def stop(self, timeout: float = 10):
+        if not self.running:
+            return
+        with self.lock:
+            for route in self.routes.values():
+                self.market.unsubscribe(route.symbol, route, route.currency, route.event)
+        self.routes = {}
+        self.subscriptions = {}
+        self.stopping = True
+        for shard in range(self.shards):
+            self._send(shard, ("stop",))
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                self.market.logger.log(content=f"Shard process {process.pid} failed to stop, terminating...", title="[SHARD-ERROR]", title_color=Fore.RED)
+                process.terminate()
+        self.running = False
+        self.collector.join()
+        # whatever the shards emitted before they stopped
+        self._drain()
+        for ring in self.inbound + self.outbound:
+            ring.close()
+        self.inbound, self.outbound, self.processes, self.send_locks = [], [], [], []
+        self.market.logger.log(content=f"Stopped {self.shards} tracker shards", title="[SHARDS-STOPPED]", title_color=Fore.GREEN)
+
+
+class _ShardRoute(MarketAccess.BaseTracker):
+    # Stands in for a stream's trackers in the parent and forwards whole dispatch batches
+    batched = True
+
+    def __init__(self, symbol: str, access: MarketAccess, executor: ShardedExecutor, shard: int, currency: str, event: str):
+        super().__init__(symbol, access)
+        self.executor = executor
+        self.shard = shard
+        self.currency = currency
+        self.event = event
+        self.count = 0
+
+    def on_events(self, event, msgs):
+        self.executor._send(self.shard, ("events", event, list(msgs)))
+
+    def on_event(self, event, msg):
+        self.on_events(event, [msg])
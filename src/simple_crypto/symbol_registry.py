@@ -0,0 +1,79 @@
+import os
+import json
+import time
+import threading
+
+SYMBOL_FIELDS = ["symbol", "status", "baseAsset", "quoteAsset"]
+
+
+class SymbolRegistry:
+    # Keeps the symbol list from /api/v3/exchangeInfo in memory, keyed by symbol, and only
+    # refetches the multi-MB payload once the TTL has run out.
+    def __init__(self, fetch, ttl: float = 3600, cache_file: str | None = None):
+        if not callable(fetch):
+            raise ValueError("fetch must be callable")
+        if not isinstance(ttl, (int, float)) or ttl < 0:
+            raise ValueError("ttl must be a non-negative number")
+        if cache_file is not None and not isinstance(cache_file, str):
+            raise ValueError("cache_file must be a string")
+        self.fetch = fetch
+        self.ttl = ttl
+        self.cache_file = cache_file
+        self.symbols = {}
+        self.loaded_at = None
+        self.lock = threading.Lock()
+        self._load_cache()
+
+    def _load_cache(self):
+        if self.cache_file is None or not os.path.isfile(self.cache_file):
+            return
+        try:
+            with open(self.cache_file, 'r') as f:
+                cached = json.load(f)
+            self.symbols = cached["symbols"]
+            self.loaded_at = cached["loaded_at"]
+        except (ValueError, KeyError):
+            self.symbols = {}
+            self.loaded_at = None
+
+    def _save_cache(self):
+        if self.cache_file is None:
+            return
+        directory = os.path.dirname(self.cache_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.cache_file + ".tmp", 'w') as f:
+            json.dump({"loaded_at": self.loaded_at, "symbols": self.symbols}, f)
+        os.replace(self.cache_file + ".tmp", self.cache_file)
+
+    def stale(self):
+        return self.loaded_at is None or time.time() - self.loaded_at > self.ttl
+
+    def refresh(self, force: bool = False):
+        with self.lock:
+            if not force and not self.stale():
+                return False
+            try:
+                info = self.fetch()
+            except OSError:
+                # an expired list is still better than none when the exchange is unreachable
+                if self.symbols:
+                    return False
+                raise
+            self.symbols = {s["symbol"]: {field: s.get(field) for field in SYMBOL_FIELDS} for s in info["symbols"]}
+            self.loaded_at = time.time()
+            self._save_cache()
+            return True
+
+    def get(self, symbol: str):
+        if self.stale():
+            self.refresh()
+        return self.symbols.get(symbol.upper())
+
+    def __contains__(self, symbol: str):
+        return self.get(symbol) is not None
+
+    def __len__(self):
+        if self.stale():
+            self.refresh()
+        return len(self.symbols)
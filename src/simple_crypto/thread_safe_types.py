@@ -1,5 +1,7 @@
+import time
 import threading
 from datetime import datetime
+from colorama import Fore
 
 class ThreadSafeCounter:
     def __init__(self, initial=0):
@@ -26,79 +28,132 @@ class ThreadSafeCounter:
             return self.value
 
 class ThreadSafeStock:
+    # Trackers are kept in an immutable tuple that is swapped out on every change, so
+    # notify can iterate a snapshot without holding the lock while trackers run.
     def __init__(self, event: str, trackers: list):
         if not isinstance(event, str):
             raise ValueError("event must be a string")
         if not isinstance(trackers, list):
             raise ValueError("trackers must be a list")
         self.event = event
-        self.trackers = trackers
+        self.trackers = tuple(trackers)
         self.lock = threading.Lock()
 
     def add_tracker(self, instance):
         with self.lock:
             if instance not in self.trackers:
-                self.trackers.append(instance)
+                self.trackers = self.trackers + (instance,)
                 return True
             return False
 
     def remove_tracker(self, instance):
         with self.lock:
             if instance in self.trackers:
-                self.trackers.remove(instance)
+                trackers = list(self.trackers)
+                trackers.remove(instance)
+                self.trackers = tuple(trackers)
                 return True
             return False
 
     def has_trackers(self):
-        with self.lock:
-            return len(self.trackers) > 0
+        return len(self.trackers) > 0
 
     def notify(self, event, data):
-        with self.lock:
-            for tracker in self.trackers:
+        for tracker in self.trackers:
+            try:
+                tracker.on_event(event, data)
+            except Exception as e:
+                self._report(tracker, event, e)
+                continue
+
+    def notify_batch(self, event, datas: list, metrics=None):
+        # a message that fails only costs that message, like notify: the rest still reach the tracker
+        for tracker in self.trackers:
+            if metrics is not None:
+                self._notify_timed(tracker, event, datas, metrics)
+            elif getattr(tracker, "batched", False):
                 try:
-                    tracker.on_event(event, data)
+                    tracker.on_events(event, datas)
                 except Exception as e:
-                    print(f"Error notifying tracker: {e}")
-                    continue
+                    self._report(tracker, event, e)
+            else:
+                for data in datas:
+                    try:
+                        tracker.on_event(event, data)
+                    except Exception as e:
+                        self._report(tracker, event, e)
+
+    @staticmethod
+    def _report(tracker, event, error):
+        # through the logger of the market the tracker belongs to
+        logger = getattr(getattr(tracker, "access", None), "logger", None)
+        if logger is None:
+            print(f"Error notifying tracker: {error}")
+            return
+        logger.log(content=f"{type(tracker).__name__} failed on {event}: {error!r}", title="[TRACKER-ERROR]", title_color=Fore.RED)
+
+    def _notify_timed(self, tracker, event, datas: list, metrics):
+        # batched trackers are timed per on_events call, the others per message
+        histogram = metrics.histogram("tracker_seconds", tracker=type(tracker).__name__)
+        if getattr(tracker, "batched", False):
+            started = time.perf_counter()
+            try:
+                tracker.on_events(event, datas)
+            except Exception as e:
+                self._report(tracker, event, e)
+            histogram.observe(time.perf_counter() - started)
+            return
+        for data in datas:
+            started = time.perf_counter()
+            try:
+                tracker.on_event(event, data)
+            except Exception as e:
+                self._report(tracker, event, e)
+            histogram.observe(time.perf_counter() - started)
 
     def __contains__(self, instance):
-        with self.lock:
-            return instance in self.trackers
+        return instance in self.trackers
 
 class ThreadSafeStockList:
-    def __init__(self):
+    # on_change(event) is called, outside the lock, whenever an event gains its first tracker
+    # or loses its last one, i.e. whenever the set of streams to listen to changes
+    def __init__(self, on_change=None):
+        if on_change is not None and not callable(on_change):
+            raise ValueError("on_change must be callable")
         self.stocks = {}
         self.lock = threading.Lock()
+        self.on_change = on_change
 
     def add(self, event: str, instance):
         if not isinstance(event, str):
             raise ValueError("event must be a string")
         with self.lock:
-            if event not in self.stocks:
-                self.stocks[event] = ThreadSafeStock(event, [instance])
-                return False
-            else:
+            if event in self.stocks:
                 self.stocks[event].add_tracker(instance)
                 return True
+            self.stocks[event] = ThreadSafeStock(event, [instance])
+        if self.on_change is not None:
+            self.on_change(event)
+        return False
 
     def remove(self, event: str, instance):
         if not isinstance(event, str):
             raise ValueError("event must be a string")
         with self.lock:
-            if event in self.stocks:
-                if self.stocks[event].remove_tracker(instance):
-                    if not self.stocks[event].has_trackers():
-                        del self.stocks[event]
-                    return True
+            if event not in self.stocks or not self.stocks[event].remove_tracker(instance):
                 return False
-            return False
+            emptied = not self.stocks[event].has_trackers()
+            if emptied:
+                del self.stocks[event]
+        if emptied and self.on_change is not None:
+            self.on_change(event)
+        return True
 
     def get(self, event: str):
         if not isinstance(event, str):
             raise ValueError("event must be a string")
-        with self.lock:
-            return self.stocks.get(event, None)
+        # a single dict lookup is atomic, only writers need the lock
+        return self.stocks.get(event, None)
 
     def __getitem__(self, event):
         return self.get(event)
@@ -0,0 +1,388 @@
+import math
+import numpy as np
+from src.simple_crypto.market_access import MarketAccess
+
+# Every indicator comes in two forms: a class updated one value at a time for live streams and
+# a function computing the whole series over historical arrays. Both perform the same float
+# operations in the same order, so a backtest sees exactly the values the live tracker would.
+# The series are NaN until the indicator has seen enough values.
+
+
+def _window_diffs(values: np.ndarray, period: int):
+    # value entering the window minus the one leaving it (0.0 while the window fills up)
+    leaving = np.zeros_like(values)
+    leaving[period:] = values[:-period]
+    return values - leaving
+
+
+class SMA:
+    __slots__ = ("period", "ring", "pos", "count", "total", "value")
+
+    def __init__(self, period: int = 20):
+        if not isinstance(period, int) or period <= 0:
+            raise ValueError("period must be a positive integer")
+        self.period = period
+        self.ring = [0.0] * period
+        self.pos = 0
+        self.count = 0
+        self.total = 0.0
+        self.value = None
+
+    @property
+    def ready(self):
+        return self.count >= self.period
+
+    def update(self, value: float):
+        old = self.ring[self.pos]
+        self.ring[self.pos] = value
+        self.pos = (self.pos + 1) % self.period
+        self.total += value - old
+        self.count += 1
+        if self.count >= self.period:
+            self.value = self.total / self.period
+        return self.value
+
+    def update_kline(self, kline: dict):
+        return self.update(float(kline["c"]))
+
+
+def sma(values, period: int = 20):
+    if not isinstance(period, int) or period <= 0:
+        raise ValueError("period must be a positive integer")
+    values = np.asarray(values, dtype=np.float64)
+    out = np.cumsum(_window_diffs(values, period)) / period
+    out[:period - 1] = np.nan
+    return out
+
+
+class EMA:
+    # Seeded with the SMA of the first `period` values, then e += alpha * (value - e)
+    __slots__ = ("period", "alpha", "seed", "value")
+
+    def __init__(self, period: int = 20, alpha: float | None = None):
+        if not isinstance(period, int) or period <= 0:
+            raise ValueError("period must be a positive integer")
+        if alpha is not None and not 0 < alpha <= 1:
+            raise ValueError("alpha must be between 0 and 1")
+        self.period = period
+        self.alpha = alpha if alpha is not None else 2 / (period + 1)
+        self.seed = SMA(period)
+        self.value = None
+
+    @property
+    def ready(self):
+        return self.value is not None
+
+    def update(self, value: float):
+        if self.value is None:
+            self.value = self.seed.update(value)
+        else:
+            self.value = self.value + self.alpha * (value - self.value)
+        return self.value
+
+    def update_kline(self, kline: dict):
+        return self.update(float(kline["c"]))
+
+
+def ema(values, period: int = 20, alpha: float | None = None):
+    # The recurrence is inherently sequential, so it runs as one tight loop over plain floats
+    alpha = EMA(period, alpha).alpha
+    values = np.asarray(values, dtype=np.float64)
+    out = np.full(len(values), np.nan)
+    if len(values) < period:
+        return out
+    value = out[period - 1] = sma(values[:period], period)[-1]
+    for i, x in enumerate(values[period:].tolist(), start=period):
+        value = value + alpha * (x - value)
+        out[i] = value
+    return out
+
+
+def _rsi_value(avg_gain: float, avg_loss: float):
+    if avg_loss == 0:
+        return 100.0
+    return 100 - 100 / (1 + avg_gain / avg_loss)
+
+
+class RSI:
+    # Wilder's RSI: plain averages of the first `period` changes, smoothed with (avg * (period - 1) + x) / period after that
+    __slots__ = ("period", "previous", "count", "gain_total", "loss_total", "avg_gain", "avg_loss", "value")
+
+    def __init__(self, period: int = 14):
+        if not isinstance(period, int) or period <= 0:
+            raise ValueError("period must be a positive integer")
+        self.period = period
+        self.previous = None
+        self.count = 0
+        self.gain_total = 0.0
+        self.loss_total = 0.0
+        self.avg_gain = None
+        self.avg_loss = None
+        self.value = None
+
+    @property
+    def ready(self):
+        return self.value is not None
+
+    def update(self, value: float):
+        previous = self.previous
+        self.previous = value
+        if previous is None:
+            return None
+        change = value - previous
+        gain = change if change > 0 else 0.0
+        loss = -change if change < 0 else 0.0
+        if self.avg_gain is None:
+            self.gain_total += gain
+            self.loss_total += loss
+            self.count += 1
+            if self.count < self.period:
+                return None
+            self.avg_gain = self.gain_total / self.period
+            self.avg_loss = self.loss_total / self.period
+        else:
+            self.avg_gain = (self.avg_gain * (self.period - 1) + gain) / self.period
+            self.avg_loss = (self.avg_loss * (self.period - 1) + loss) / self.period
+        self.value = _rsi_value(self.avg_gain, self.avg_loss)
+        return self.value
+
+    def update_kline(self, kline: dict):
+        return self.update(float(kline["c"]))
+
+
+def rsi(values, period: int = 14):
+    if not isinstance(period, int) or period <= 0:
+        raise ValueError("period must be a positive integer")
+    values = np.asarray(values, dtype=np.float64)
+    out = np.full(len(values), np.nan)
+    if len(values) <= period:
+        return out
+    changes = np.diff(values)
+    gains = np.where(changes > 0, changes, 0.0)
+    losses = np.where(changes < 0, -changes, 0.0)
+    # sequential sums, in the same order the live indicator adds them up
+    avg_gain = float(np.add.accumulate(gains[:period])[-1]) / period
+    avg_loss = float(np.add.accumulate(losses[:period])[-1]) / period
+    out[period] = _rsi_value(avg_gain, avg_loss)
+    for i, (gain, loss) in enumerate(zip(gains[period:].tolist(), losses[period:].tolist()), start=period + 1):
+        avg_gain = (avg_gain * (period - 1) + gain) / period
+        avg_loss = (avg_loss * (period - 1) + loss) / period
+        out[i] = _rsi_value(avg_gain, avg_loss)
+    return out
+
+
+class VWAP:
+    # Volume weighted average price over the last `period` values, or since the start when period is None
+    __slots__ = ("period", "pvs", "volumes", "pos", "count", "pv_total", "volume_total", "value")
+
+    def __init__(self, period: int | None = None):
+        if period is not None and (not isinstance(period, int) or period <= 0):
+            raise ValueError("period must be a positive integer or None")
+        self.period = period
+        self.pvs = [0.0] * period if period is not None else None
+        self.volumes = [0.0] * period if period is not None else None
+        self.pos = 0
+        self.count = 0
+        self.pv_total = 0.0
+        self.volume_total = 0.0
+        self.value = None
+
+    @property
+    def ready(self):
+        return self.value is not None
+
+    def update(self, price: float, volume: float):
+        pv = price * volume
+        if self.period is None:
+            self.pv_total += pv
+            self.volume_total += volume
+        else:
+            old_pv = self.pvs[self.pos]
+            old_volume = self.volumes[self.pos]
+            self.pvs[self.pos] = pv
+            self.volumes[self.pos] = volume
+            self.pos = (self.pos + 1) % self.period
+            self.pv_total += pv - old_pv
+            self.volume_total += volume - old_volume
+        self.count += 1
+        if self.period is None or self.count >= self.period:
+            self.value = self.pv_total / self.volume_total if self.volume_total else None
+        return self.value
+
+    def update_kline(self, kline: dict):
+        # typical price of the bar
+        return self.update((float(kline["h"]) + float(kline["l"]) + float(kline["c"])) / 3, float(kline["v"]))
+
+
+def vwap(prices, volumes, period: int | None = None):
+    if period is not None and (not isinstance(period, int) or period <= 0):
+        raise ValueError("period must be a positive integer or None")
+    prices = np.asarray(prices, dtype=np.float64)
+    volumes = np.asarray(volumes, dtype=np.float64)
+    pv = prices * volumes
+    if period is None:
+        pv_total, volume_total = np.cumsum(pv), np.cumsum(volumes)
+    else:
+        pv_total, volume_total = np.cumsum(_window_diffs(pv, period)), np.cumsum(_window_diffs(volumes, period))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out = np.where(volume_total != 0, pv_total / volume_total, np.nan)
+    if period is not None:
+        out[:period - 1] = np.nan
+    return out
+
+
+def typical_price(high, low, close):
+    return (np.asarray(high, dtype=np.float64) + np.asarray(low, dtype=np.float64) + np.asarray(close, dtype=np.float64)) / 3
+
+
+class Bollinger:
+    # Middle band is the SMA, the outer bands `k` population standard deviations away. The mean
+    # and the sum of squared deviations move with each value Welford style and are recomputed
+    # exactly once per lap of the ring, so neither cancellation in E[x^2] - mean^2 nor drift
+    # in running sums can build up on long, nearly flat series.
+    __slots__ = ("period", "k", "ring", "pos", "count", "mean", "m2", "value", "upper", "lower")
+
+    def __init__(self, period: int = 20, k: float = 2.0):
+        if not isinstance(period, int) or period <= 0:
+            raise ValueError("period must be a positive integer")
+        self.period = period
+        self.k = k
+        self.ring = [0.0] * period
+        self.pos = 0
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.value = None
+        self.upper = None
+        self.lower = None
+
+    @property
+    def ready(self):
+        return self.count >= self.period
+
+    def update(self, value: float):
+        old = self.ring[self.pos]
+        self.ring[self.pos] = value
+        self.pos = (self.pos + 1) % self.period
+        self.count += 1
+        if self.count < self.period:
+            return self.value
+        if self.pos == 0:
+            # a lap is complete (the first one fills the window), the ring is in time order
+            self.mean, self.m2 = _window_moments(self.ring, self.period)
+        else:
+            self.mean, self.m2 = _replace_moments(self.mean, self.m2, old, value, self.period)
+        std = math.sqrt(max(self.m2 / self.period, 0.0))
+        self.value = self.mean
+        self.upper = self.mean + self.k * std
+        self.lower = self.mean - self.k * std
+        return self.value
+
+    def update_kline(self, kline: dict):
+        return self.update(float(kline["c"]))
+
+
+def _window_moments(window: list, period: int):
+    # exact mean and sum of squared deviations of a full window
+    mean = math.fsum(window) / period
+    return mean, math.fsum([(x - mean) * (x - mean) for x in window])
+
+
+def _replace_moments(mean: float, m2: float, old: float, value: float, period: int):
+    # Welford update for `value` taking the place of `old` in a full window
+    delta = value - old
+    new_mean = mean + delta / period
+    return new_mean, m2 + delta * (value - new_mean + old - mean)
+
+
+def bollinger(values, period: int = 20, k: float = 2.0):
+    # Returns the (middle, upper, lower) series. The window moments are updated sequentially
+    # like the live indicator's, so this is one tight loop over plain floats too.
+    if not isinstance(period, int) or period <= 0:
+        raise ValueError("period must be a positive integer")
+    values = np.asarray(values, dtype=np.float64)
+    middle, upper, lower = np.full(len(values), np.nan), np.full(len(values), np.nan), np.full(len(values), np.nan)
+    xs = values.tolist()
+    mean = m2 = 0.0
+    for i in range(period - 1, len(xs)):
+        if (i + 1) % period == 0:
+            mean, m2 = _window_moments(xs[i + 1 - period:i + 1], period)
+        else:
+            mean, m2 = _replace_moments(mean, m2, xs[i - period], xs[i], period)
+        std = math.sqrt(max(m2 / period, 0.0))
+        middle[i] = mean
+        upper[i] = mean + k * std
+        lower[i] = mean - k * std
+    return middle, upper, lower
+
+
+class IndicatorTracker(MarketAccess.BaseTracker):
+    # Feeds every closed bar of a kline stream to its indicators and keeps their latest values.
+    # Subclasses can override on_update to act on the new values.
+    def __init__(self, symbol: str, access: MarketAccess, **indicators):
+        super().__init__(symbol, access)
+        if not indicators:
+            raise ValueError("At least one indicator must be given")
+        for name, indicator in indicators.items():
+            if not hasattr(indicator, "update_kline"):
+                raise ValueError(f"Indicator {name} must provide an update_kline(kline) method")
+        self.indicators = indicators
+        self.values = {name: None for name in indicators}
+
+    def on_event(self, event, msg):
+        # raw dicts and typed Kline messages both answer get("k")
+        kline = msg.get("k") if hasattr(msg, "get") else None
+        if kline is None or not kline["x"]:
+            return
+        for name, indicator in self.indicators.items():
+            self.values[name] = indicator.update_kline(kline)
+        self.on_update()
+
+    def on_update(self):
+        pass
+
+
+class SMATracker(IndicatorTracker):
+    def __init__(self, symbol: str, access: MarketAccess, period: int = 20):
+        super().__init__(symbol, access, sma=SMA(period))
+
+    @property
+    def value(self):
+        return self.values["sma"]
+
+
+class EMATracker(IndicatorTracker):
+    def __init__(self, symbol: str, access: MarketAccess, period: int = 20):
+        super().__init__(symbol, access, ema=EMA(period))
+
+    @property
+    def value(self):
+        return self.values["ema"]
+
+
+class RSITracker(IndicatorTracker):
+    def __init__(self, symbol: str, access: MarketAccess, period: int = 14):
+        super().__init__(symbol, access, rsi=RSI(period))
+
+    @property
+    def value(self):
+        return self.values["rsi"]
+
+
+class VWAPTracker(IndicatorTracker):
+    def __init__(self, symbol: str, access: MarketAccess, period: int | None = None):
+        super().__init__(symbol, access, vwap=VWAP(period))
+
+    @property
+    def value(self):
+        return self.values["vwap"]
+
+
+class BollingerTracker(IndicatorTracker):
+    def __init__(self, symbol: str, access: MarketAccess, period: int = 20, k: float = 2.0):
+        super().__init__(symbol, access, bollinger=Bollinger(period, k))
+
+    @property
+    def bands(self):
+        band = self.indicators["bollinger"]
+        return band.value, band.upper, band.lower
@@ -1,5 +1,7 @@
 from src.simple_crypto import MarketAccess
 import time
+import pytest
+from http.server import BaseHTTPRequestHandler
 from src.simple_crypto import misc
 
 
@@ -20,5 +22,1323 @@ def test_historical_data():
     MarketAccess.get_history("BTC", "USD", "1m", 1)
     MarketAccess.get_history("ETH", "USD", "1h", 1)
 
+def test_rolling_window():
+    import numpy as np
+    import pandas as pd
+    from src.simple_crypto.alg_testing.rolling_window import RollingWindow
+    rng = np.random.default_rng(1)
+    rows = 500
+    size = 60
+    data = pd.DataFrame({
+        "open": rng.random(rows), "high": rng.random(rows) + 1, "low": rng.random(rows) - 1, "close": rng.random(rows),
+        "volume": rng.random(rows) * 100, "quote_volume": rng.random(rows) * 1000, "close_time": np.arange(rows) * 60000 + 59999
+    })
+    window = RollingWindow(size)
+    for i, row in enumerate(zip(*[data[c].tolist() for c in ["open", "high", "low", "close", "volume", "quote_volume", "close_time"]])):
+        window.push(*row)
+        if not window.full:
+            continue
+        current = data.iloc[i - size + 1:i + 1]
+        frame = window.mini_ticker("BTCUSD")
+        assert frame["E"] == current.iloc[-1]["close_time"]
+        assert frame["c"] == current.iloc[-1]["close"]
+        assert frame["o"] == current.iloc[0]["open"]
+        assert frame["h"] == current["high"].max()
+        assert frame["l"] == current["low"].min()
+        assert np.isclose(frame["v"], current["volume"].sum())
+        assert np.isclose(frame["q"], current["quote_volume"].sum())
+
+def _write_kline_csv(path, month_start, rows, interval_ms=60000, header=False, micros=False):
+    import numpy as np
+    open_time = month_start + np.arange(rows) * interval_ms
+    # the 2025+ dumps carry microsecond timestamps
+    scale = 1000 if micros else 1
+    with open(path, 'w') as f:
+        if header:
+            f.write("open_time,open,high,low,close,volume,close_time,quote_volume,count,taker_buy_volume,taker_buy_quote_volume,ignore\n")
+        for i, t in enumerate(open_time):
+            f.write(f"{t * scale},{i}.5,{i + 1}.0,{i}.0,{i}.25,1.5,{(t + interval_ms) * scale - 1},3.0,{i},0.5,1.0,0\n")
+
+
+def test_kline_store(tmp_path):
+    import os
+    from src.simple_crypto.kline_store import KlineStore
+    os.makedirs(tmp_path / "BTC")
+    _write_kline_csv(tmp_path / "BTC" / "BTC-USD-1m-2024-03.csv", 1709251200000, 10)
+    _write_kline_csv(tmp_path / "BTC" / "BTC-USD-1m-2024-01.csv", 1704067200000, 5, header=True)
+    _write_kline_csv(tmp_path / "BTC" / "BTC-USD-1m-2025-01.csv", 1735689600000, 4, micros=True)
+    store = KlineStore(str(tmp_path))
+    assert store.convert_csvs() == 3
+    assert store.convert_csvs() == 0
+    dataset = store.open("BTC", "USD", "1m")
+    assert dataset.months == ["2024-01", "2024-03", "2025-01"]
+    assert len(dataset) == 19
+    # microseconds come back as milliseconds
+    assert list(dataset.month("2025-01")["open_time"]) == [1735689600000 + n * 60000 for n in range(4)]
+    assert dataset.month("2025-01")["close_time"][0] == 1735689659999
+    assert dataset["open_time"][0] == 1704067200000
+    assert dataset.month("2024-03")["close"][-1] == 9.25
+    assert dataset["count"].dtype.kind == "i"
+
+
+class _RangeHandler(BaseHTTPRequestHandler):
+    files = {}
+    requests_seen = []
+
+    def do_GET(self):
+        # /drop/... serves the same archives but cuts the connection halfway through
+        drop = self.path.startswith("/drop/")
+        body = self.files.get(self.path.removeprefix("/drop") if drop else self.path)
+        self.requests_seen.append((self.path, self.headers.get("Range")))
+        if body is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        start = 0
+        if self.headers.get("Range"):
+            start = int(self.headers["Range"].removeprefix("bytes=").split("-")[0])
+            self.send_response(206)
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body) - start))
+        self.end_headers()
+        if drop:
+            self.wfile.write(body[start:start + (len(body) - start) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(body[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+def test_history_downloader(tmp_path):
+    import io
+    import os
+    import threading
+    import zipfile
+    from http.server import ThreadingHTTPServer
+    from src.simple_crypto.downloader import HistoryDownloader, months_back
+    months = [month.strftime('%Y-%m') for month in months_back(3)]
+    for symbol in ["BTC", "ETH"]:
+        for month in months:
+            csv = tmp_path / "src.csv"
+            _write_kline_csv(csv, 1704067200000, 20)
+            buffer = io.BytesIO()
+            with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+                zip_ref.write(csv, f"{symbol}USD-1m-{month}.csv")
+            _RangeHandler.files[f"/{symbol}USD/1m/{symbol}USD-1m-{month}.zip"] = buffer.getvalue()
+    for month in months:
+        # an empty archive for the first SOL month, the other months still get stored
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as zip_ref:
+            if month != months[0]:
+                zip_ref.write(csv, f"SOLUSD-1m-{month}.csv")
+        _RangeHandler.files[f"/SOLUSD/1m/SOLUSD-1m-{month}.zip"] = buffer.getvalue()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _RangeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        base = f"http://127.0.0.1:{server.server_port}"
+        downloader = HistoryDownloader(str(tmp_path / "Data"), workers=4, logger=MarketAccess.BaseLogger(plain=True, level="error"),
+                                       sources=[base + "/missing/{pair}.zip", base + "/drop/{pair}/{interval}/{pair}-{interval}-{month}.zip", base + "/{pair}/{interval}/{pair}-{interval}-{month}.zip"])
+        # leave a half finished transfer behind to check that it gets resumed
+        os.makedirs(downloader.partial_dir)
+        archive = _RangeHandler.files[f"/BTCUSD/1m/BTCUSD-1m-{months[0]}.zip"]
+        with open(os.path.join(downloader.partial_dir, f"BTCUSD-1m-{months[0]}.zip.part"), 'wb') as f:
+            f.write(archive[:len(archive) // 2])
+        # a stale partial that no source can complete into a valid archive
+        with open(os.path.join(downloader.partial_dir, f"ETHUSD-1m-{months[1]}.zip.part"), 'wb') as f:
+            f.write(b"stale" * 100)
+        available = downloader.download(["BTC", "ETH", "SOL"], "USD", "1m", 3)
+        downloader.close()
+    finally:
+        server.shutdown()
+    assert available == {("BTC", "USD", "1m"): months, ("ETH", "USD", "1m"): months, ("SOL", "USD", "1m"): months[1:]}
+    # resumed on the dropping source, finished on the next one
+    assert (f"/drop/BTCUSD/1m/BTCUSD-1m-{months[0]}.zip", f"bytes={len(archive) // 2}-") in _RangeHandler.requests_seen
+    assert (f"/ETHUSD/1m/ETHUSD-1m-{months[1]}.zip", None) in _RangeHandler.requests_seen
+    assert len(downloader.store.open("ETH", "USD", "1m")) == 60
+    assert os.listdir(downloader.partial_dir) == []
+
+
+def test_data_index(tmp_path):
+    import os
+    from src.simple_crypto.data_index import DataIndex
+    from src.simple_crypto.kline_store import KlineStore
+    os.makedirs(tmp_path / "BTC")
+    _write_kline_csv(tmp_path / "BTC" / "BTC-USD-1m-2024-01.csv", 1704067200000, 5)
+    _write_kline_csv(tmp_path / "BTC" / "BTC-USD-1m-2024-02.csv", 1706745600000, 7)
+    index = DataIndex(str(tmp_path))
+    assert index.refresh()
+    assert not index.refresh()
+    assert index.entries("BTC", "USD", "1m")["2024-02"]["rows"] == 7
+    assert index.months_covering("BTC", "USD", "1m", 1704067200000 + 60000, 1706745600000) == ["2024-01", "2024-02"]
+    assert index.months_covering("BTC", "USD", "1m", 1706745600000 + 60000, 1706745600000 + 120000) == ["2024-02"]
+    KlineStore(str(tmp_path)).convert_csvs()
+    # a fresh instance reloads the persisted manifest and only rescans the changed coin
+    index = DataIndex(str(tmp_path))
+    assert index.refresh()
+    assert index.available()["BTC"]["USD"]["1m"]["2024-01"] == os.path.join(str(tmp_path), "BTC", "BTC-USD-1m")
+
+
+def test_combined_listener():
+    import asyncio
+    import json
+    import websockets
+    from src.simple_crypto.market_access import MarketAccess
+
+    async def scenario():
+        paths = []
+        control = []
+
+        async def handler(connection):
+            paths.append(connection.request.path)
+            streams = set(connection.request.path.split("streams=")[1].split("/"))
+
+            async def feed():
+                n = 0
+                while True:
+                    for stream in sorted(streams):
+                        await connection.send(json.dumps({"stream": stream, "data": {"n": n}}))
+                    n += 1
+                    await asyncio.sleep(0.01)
+
+            feeder = asyncio.create_task(feed())
+            try:
+                async for frame in connection:
+                    request = json.loads(frame)
+                    control.append(request)
+                    if request["method"] == "SUBSCRIBE":
+                        streams.update(request["params"])
+                    else:
+                        streams.difference_update(request["params"])
+                    await connection.send(json.dumps({"result": None, "id": request["id"]}))
+            finally:
+                feeder.cancel()
+
+        async with websockets.serve(handler, "127.0.0.1", 0) as server:
+            port = server.sockets[0].getsockname()[1]
+            market = MarketAccess(logger=MarketAccess.BaseLogger(plain=True), combined=True, stream_url=f"ws://127.0.0.1:{port}")
+            listener = MarketAccess.CombinedListener(market, ["btcusd@trade", "ethusd@trade"], max_streams=3)
+            task = asyncio.create_task(listener.start())
+            await asyncio.sleep(0.1)
+            listener.subscribe(["solusd@trade"])
+            listener.unsubscribe(["btcusd@trade"])
+            with pytest.raises(ValueError):
+                listener.subscribe(["adausd@trade", "dogeusd@trade"])
+            await asyncio.sleep(0.2)
+            listener.stop()
+            await asyncio.wait_for(task, 5)
+        seen = set()
+        while not market.msgs.empty():
+            seen.add((await market.msgs.get())['stream'])
+        return paths, control, seen
+
+    paths, control, seen = asyncio.run(scenario())
+    assert paths == ["/stream?streams=btcusd@trade/ethusd@trade"]
+    assert {"method": "SUBSCRIBE", "params": ["solusd@trade"], "id": 2} in control
+    assert {"method": "UNSUBSCRIBE", "params": ["btcusd@trade"], "id": 1} in control
+    assert {"btcusd@trade", "ethusd@trade", "solusd@trade"} == seen
+
+
+def test_symbol_registry(tmp_path):
+    from src.simple_crypto.market_access import MarketAccess
+    from src.simple_crypto.symbol_registry import SymbolRegistry
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return {"symbols": [{"symbol": "BTCUSD", "status": "TRADING", "baseAsset": "BTC", "quoteAsset": "USD", "filters": []},
+                            {"symbol": "ETHUSD", "status": "TRADING", "baseAsset": "ETH", "quoteAsset": "USD", "filters": []}]}
+
+    cache = str(tmp_path / "symbols.json")
+    registry = SymbolRegistry(fetch, ttl=60, cache_file=cache)
+    assert "btcusd" in registry
+    assert "DOGEUSD" not in registry
+    assert registry.get("ETHUSD")["baseAsset"] == "ETH"
+    assert len(calls) == 1
+    # a warm restart inside the TTL doesn't hit the exchange at all
+    assert "ETHUSD" in SymbolRegistry(fetch, ttl=60, cache_file=cache)
+    assert len(calls) == 1
+    assert "ETHUSD" in SymbolRegistry(fetch, ttl=0, cache_file=cache)
+    assert len(calls) == 2
+
+    market = MarketAccess(logger=MarketAccess.BaseLogger(plain=True))
+    market.symbols = registry
+    btc = MarketAccess.BaseTracker("BTC", market)
+    eth = MarketAccess.BaseTracker("ETH", market)
+    with pytest.raises(ValueError):
+        market.subscribe_many([("BTC", btc), ("DOGE", eth)])
+    assert market.stocks.keys() == []
+    assert market.subscribe_many([("BTC", btc), ("ETH", eth, "USD", "trade"), ("BTC", eth)]) == [True, True, False]
+    assert sorted(market.stocks.keys()) == ["btcusd@ticker", "ethusd@trade"]
+
+
+class _ExchangeHandler(BaseHTTPRequestHandler):
+    responses = []
+
+    def do_GET(self):
+        status, headers, body = self.responses.pop(0) if self.responses else (200, {}, b"{}")
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_rest_client():
+    import asyncio
+    import threading
+    import time
+    from http.server import ThreadingHTTPServer
+    from src.simple_crypto.rest_client import RestClient
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _ExchangeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    try:
+        client = RestClient(bases={True: base + "/us", False: base + "/com"}, weight_limit=100)
+        _ExchangeHandler.responses[:] = [(451, {}, b'{"code": 0, "msg": "restricted location"}'), (200, {}, b'{"ok": 2}')]
+        assert asyncio.run(client.get_async("/api/v3/ping", us=False)) == ({"ok": 2}, True)
+        _ExchangeHandler.responses[:] = [(400, {}, b'{"code": -1121}')]
+        with pytest.raises(ConnectionError):
+            client.get("/api/v3/ping", us=False)
+        _ExchangeHandler.responses[:] = [(429, {"Retry-After": "1"}, b"{}"), (200, {"X-MBX-USED-WEIGHT-1M": "95"}, b'{"ok": 1}')]
+        started = time.time()
+        assert client.get("/api/v3/ping") == ({"ok": 1}, True)
+        assert time.time() - started >= 1
+        # 95 of 100 weight used this minute, so the next call has to wait for the reset
+        assert client.delay(base + "/us") > 0
+        assert client.delay(base + "/com") == 0
+        client.close()
+    finally:
+        server.shutdown()
+
+
+def test_batched_dispatch():
+    import asyncio
+    from src.simple_crypto.market_access import MarketAccess
+
+    class Recorder(MarketAccess.BaseTracker):
+        def __init__(self, symbol, access):
+            super().__init__(symbol, access)
+            self.calls = []
+
+        def on_event(self, event, msg):
+            self.calls.append((event, msg))
+            # subscribing from inside a callback used to deadlock on the stock lock
+            self.access.stocks.add(event, late)
+
+    class BatchRecorder(Recorder):
+        batched = True
+
+        def on_events(self, event, msgs):
+            self.calls.append((event, list(msgs)))
+
+    market = MarketAccess(logger=MarketAccess.BaseLogger(plain=True), dispatch_batch=4)
+    single = Recorder("BTC", market)
+    batch = BatchRecorder("BTC", market)
+    late = MarketAccess.BaseTracker("BTC", market)
+    market.stocks.add("btcusd@trade", single)
+    market.stocks.add("btcusd@trade", batch)
+    market.stocks.add("ethusd@trade", batch)
+
+    async def scenario():
+        for n in range(6):
+            await market.msgs.put({'stream': "btcusd@trade" if n % 3 else "ethusd@trade", 'data': n})
+        await market.msgs.put({'stream': 'end', 'data': None})
+        await market.msg_processor()
+
+    asyncio.run(scenario())
+    assert single.calls == [("btcusd@trade", n) for n in [1, 2, 4, 5]]
+    assert batch.calls == [("ethusd@trade", [0, 3]), ("btcusd@trade", [1, 2]), ("btcusd@trade", [4, 5])]
+    assert late in market.stocks.get("btcusd@trade")
+
+
+def test_message_queue_policies():
+    import asyncio
+    import time
+    from src.simple_crypto.message_queue import MessageQueue
+
+    async def scenario():
+        queue = MessageQueue(maxsize=3, policies={"aggTrade": "drop_oldest"})
+        for n in range(3):
+            await queue.put({'stream': "btcusd@bookTicker", 'data': {"u": n}})
+        # conflated streams keep one slot each, holding their newest message
+        assert queue.qsize() == 1
+        await queue.put({'stream': "btcusd@aggTrade", 'data': {"a": 1}})
+        await queue.put({'stream': "btcusd@aggTrade", 'data': {"a": 2}})
+        await queue.put({'stream': "btcusd@aggTrade", 'data': {"a": 3}})
+        # aggTrade drops its own oldest message, never another stream's
+        blocked = asyncio.create_task(queue.put({'stream': "btcusd@depth@100ms", 'data': {"E": time.time() * 1000 - 50}}))
+        await asyncio.sleep(0.01)
+        assert not blocked.done()
+        assert queue.get_nowait()['data'] == {"u": 2}
+        await asyncio.wait_for(blocked, 1)
+        # with nothing of their own queued, drop_oldest and conflate streams wait for space too
+        for stream in ["ethusd@aggTrade", "ethusd@bookTicker"]:
+            waiting = asyncio.create_task(queue.put({'stream': stream, 'data': {}}))
+            await asyncio.sleep(0.01)
+            assert not waiting.done()
+            waiting.cancel()
+        space = asyncio.create_task(queue.wait_for_space())
+        await asyncio.sleep(0.01)
+        assert not space.done()
+        drained = [await queue.get() for _ in range(3)]
+        await asyncio.wait_for(space, 1)
+        assert [msg['data'] for msg in drained[:2]] == [{"a": 2}, {"a": 3}]
+        for msg in drained:
+            queue.record_dispatch(msg['data'])
+        return queue.stats(), drained
+
+    stats, drained = asyncio.run(scenario())
+    assert drained[-1]['stream'] == "btcusd@depth@100ms"
+    assert stats["dropped"] == 1
+    assert stats["conflated"] == 2
+    assert stats["depth"] == 0
+    assert stats["max_depth"] == 3
+    assert stats["lag_ms_last"] >= 50
+
+
+def test_order_book():
+    import asyncio
+    from src.simple_crypto.market_access import MarketAccess
+    from src.simple_crypto.order_book import OrderBook, OrderBookTracker
+    book = OrderBook("BTCUSD")
+    book.load_snapshot({"lastUpdateId": 10, "bids": [["99.0", "1"], ["98.0", "2"]], "asks": [["101.0", "1"], ["102.0", "3"]]})
+    assert book.apply_diff({"U": 5, "u": 10, "b": [["99.0", "0"]], "a": []})
+    assert book.best_bid() == (99.0, 1.0)
+    assert book.apply_diff({"U": 9, "u": 12, "b": [["99.5", "4"], ["98.0", "0"]], "a": [["100.5", "2"]]})
+    assert book.best_bid() == (99.5, 4.0)
+    assert book.best_ask() == (100.5, 2.0)
+    assert book.top(2) == ([(99.5, 4.0), (99.0, 1.0)], [(100.5, 2.0), (101.0, 1.0)])
+    assert not book.apply_diff({"U": 14, "u": 15, "b": [], "a": []})
+    assert not book.synced
+
+    market = MarketAccess(logger=MarketAccess.BaseLogger(plain=True))
+    snapshots = [{"lastUpdateId": 20, "bids": [["50.0", "1"]], "asks": [["51.0", "1"]]}]
+
+    async def fake_request(endpoint, params=None):
+        assert params == {"symbol": "ETHUSD", "limit": 1000}
+        return snapshots.pop(0)
+
+    market.request_async = fake_request
+
+    async def scenario():
+        tracker = OrderBookTracker("ETH", market)
+        tracker.on_event("ethusd@depth@100ms", {"U": 15, "u": 19, "b": [["49.0", "1"]], "a": []})
+        tracker.on_event("ethusd@depth@100ms", {"U": 20, "u": 22, "b": [["50.5", "2"]], "a": []})
+        await tracker.resync_task
+        tracker.on_event("ethusd@depth@100ms", {"U": 23, "u": 23, "b": [], "a": [["51.0", "0"], ["52.0", "1"]]})
+        return tracker.book
+
+    synced = asyncio.run(scenario())
+    assert synced.synced
+    assert synced.best_bid() == (50.5, 2.0)
+    assert synced.best_ask() == (52.0, 1.0)
+    assert synced.top(5)[0] == [(50.5, 2.0), (50.0, 1.0)]
+
+    logged = []
+    market.logger.log = lambda content, title=None, **kwargs: logged.append(title)
+
+    async def unreachable(endpoint, params=None):
+        raise ConnectionError("snapshot unavailable")
+
+    market.request_async = unreachable
+
+    async def failing():
+        tracker = OrderBookTracker("ETH", market)
+        # an outage doesn't pile up diffs: each failed snapshot drops what it would have replayed
+        for n in range(3):
+            tracker.on_event("ethusd@depth@100ms", {"U": 15 + n, "u": 19 + n, "b": [], "a": []})
+            await asyncio.wait([tracker.resync_task])
+            await asyncio.sleep(0)
+            assert tracker.buffer == []
+        return tracker
+
+    tracker = asyncio.run(failing())
+    assert logged.count("[ORDER-BOOK-ERROR]") == 3
+
+
+def _synthetic_klines(rows, seed=0, start=1704067200000, interval_ms=60000):
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.001, rows)))
+    open_ = np.concatenate([[100.0], close[:-1]])
+    open_time = start + np.arange(rows, dtype=np.int64) * interval_ms
+    return {
+        "open_time": open_time, "open": open_, "high": np.maximum(open_, close) * 1.0005, "low": np.minimum(open_, close) * 0.9995,
+        "close": close, "volume": rng.random(rows) * 10, "close_time": open_time + interval_ms - 1, "quote_volume": rng.random(rows) * 1000,
+        "count": np.ones(rows, dtype=np.int64), "taker_buy_volume": np.zeros(rows), "taker_buy_quote_volume": np.zeros(rows),
+    }
+
+
+def test_backtest_modes():
+    import numpy as np
+    from src.simple_crypto.alg_testing.tester import AlgTester
+
+    class Crossover:
+        def signals(self, columns):
+            close = columns["close"]
+            fast = np.convolve(close, np.ones(5) / 5)[:len(close)]
+            slow = np.convolve(close, np.ones(20) / 20)[:len(close)]
+            return (fast > slow).astype(float)
+
+    class HoldFromStart:
+        def __init__(self, market, wallet, coin, currency):
+            self.wallet = wallet
+            self.coin = coin
+            self.bought = False
+
+        def on_kline(self, kline):
+            if not self.bought:
+                spend = self.wallet.balance / 2 if self.coin == "BTC" else self.wallet.balance
+                self.wallet.buy(self.coin, spend / kline.close, spend)
+                self.bought = True
+
+    data = {"BTC": _synthetic_klines(500, seed=1), "ETH": _synthetic_klines(500, seed=2)}
+    tester = AlgTester(initial_balance=1000)
+    result = tester.backtest_vectorized(Crossover(), ["BTC", "ETH"], data=data, fee=0.001)
+    # check the vectorized curve against a plain bar by bar simulation
+    close = data["BTC"]["close"]
+    target = Crossover().signals(data["BTC"])
+    equity, held = 500.0, 0.0
+    for i in range(len(close)):
+        if i:
+            equity *= 1 + held * (close[i] / close[i - 1] - 1)
+        equity *= 1 - 0.001 * abs(target[i] - held)
+        held = target[i]
+    assert np.isclose(result["coins"]["BTC"]["final_balance"], equity)
+    assert np.isclose(result["final_balance"], result["coins"]["BTC"]["final_balance"] + result["coins"]["ETH"]["final_balance"])
+
+    hold = tester.backtest_vectorized(type("Hold", (), {"signals": lambda self, columns: np.ones(len(columns["close"]))})(), ["BTC", "ETH"], data=data, fee=0)
+    events = tester.backtest_events(HoldFromStart, ["BTC", "ETH"], data=data)
+    assert np.isclose(events["final_balance"], hold["final_balance"])
+    assert np.all(np.diff(events["times"]) >= 0)
+    assert len(events["equity"]) == 1000
+
+    # any wallet with balance, buy and position(symbol) will do, not just Portfolio
+    class DictWallet:
+        def __init__(self, initial_balance, currency):
+            self.balance = initial_balance
+            self.held = {}
+
+        def buy(self, symbol, amount, cost, time=0):
+            self.balance -= cost
+            self.held[symbol] = self.held.get(symbol, 0) + amount
+            return True
+
+        def position(self, symbol):
+            return self.held.get(symbol, 0.0)
+
+    plain = AlgTester(initial_balance=1000, wallet_class=DictWallet).backtest_events(HoldFromStart, ["BTC", "ETH"], data=data)
+    assert np.allclose(plain["equity"], events["equity"])
+    with pytest.raises(ValueError):
+        AlgTester(wallet_class=lambda initial_balance, currency: object()).backtest_events(HoldFromStart, ["BTC"], data=data)
+
+
+class SweepCrossover:
+    def __init__(self, fast, slow):
+        self.fast = fast
+        self.slow = slow
+
+    def signals(self, columns):
+        import numpy as np
+        close = np.asarray(columns["close"])
+        fast = np.convolve(close, np.ones(self.fast) / self.fast)[:len(close)]
+        slow = np.convolve(close, np.ones(self.slow) / self.slow)[:len(close)]
+        return (fast > slow).astype(float)
+
+
+def test_parameter_sweep(tmp_path):
+    import json
+    from src.simple_crypto.downloader import months_back
+    from src.simple_crypto.kline_store import KlineStore
+    from src.simple_crypto.alg_testing.sweep import Sweep, walk_forward_splits, walk_forward_report
+    store = KlineStore(str(tmp_path))
+    month = months_back(1)[0].strftime('%Y-%m')
+    store.append_month("BTC", "USD", "1m", month, _synthetic_klines(1000, seed=3))
+    checkpoint = str(tmp_path / "sweep.jsonl")
+    sweep = Sweep(SweepCrossover, {"fast": [3, 5], "slow": [20, 40]}, "BTC", "1m", data_dir=str(tmp_path), workers=2,
+                  checkpoint=checkpoint, splits=lambda rows: walk_forward_splits(rows, 400, 200))
+    table = sweep.run()
+    assert len(table) == 3 * 2 * 4
+    assert set(table["phase"]) == {"train", "test"}
+    report = walk_forward_report(table, ["fast", "slow"])
+    assert len(report) == 3
+    assert (report["phase"] == "test").all()
+    # lose a few results as if the sweep crashed, a rerun only recomputes those
+    with open(checkpoint) as f:
+        lines = f.readlines()
+    with open(checkpoint, 'w') as f:
+        f.writelines(lines[:-5] + [lines[-5][:10]])
+    rerun = sweep.run()
+    assert len(rerun) == len(table)
+    valid = 0
+    with open(checkpoint) as f:
+        for line in f:
+            try:
+                json.loads(line)
+                valid += 1
+            except ValueError:
+                pass
+    assert valid == len(table)
+    # the same checkpoint with another fee holds nothing this sweep can reuse
+    costly = Sweep(SweepCrossover, {"fast": [3, 5], "slow": [20, 40]}, "BTC", "1m", data_dir=str(tmp_path), workers=2, fee=0.01,
+                   checkpoint=checkpoint, splits=lambda rows: walk_forward_splits(rows, 400, 200))
+    costly_table = costly.run()
+    assert len(costly_table) == len(table) and set(costly_table["config"]).isdisjoint(table["config"])
+    with open(checkpoint) as f:
+        assert len(f.readlines()) == 2 * len(table) + 1
+    # same settings over a window that gained an earlier month: nothing is reused
+    full = Sweep(SweepCrossover, {"fast": [3, 5], "slow": [20, 40]}, "BTC", "1m", data_dir=str(tmp_path), workers=2, months=2, checkpoint=checkpoint)
+    first = full.run()
+    store.append_month("BTC", "USD", "1m", months_back(2)[0].strftime('%Y-%m'), _synthetic_klines(500, seed=4, start=1704067200000 - 500 * 60000))
+    grown = full.run()
+    assert len(grown) == len(first) == 4 and set(grown["config"]).isdisjoint(first["config"])
+    assert (grown["rows"] == 1500).all()
+
+
+def test_portfolio_ledger():
+    import numpy as np
+    from src.simple_crypto.alg_testing.portfolio import Portfolio, PercentageFee, BpsSlippage
+    from src.simple_crypto.alg_testing.testing_wallet import TestWallet
+    wallet = TestWallet(initial_balance=100)
+    assert wallet.buy("BTC", 2, 50)
+    assert not wallet.buy("BTC", 2, 60)
+    assert not wallet.sell("ETH", 1, 10)
+    assert "ETH" not in wallet.asset_index
+    # coins is cached between fills
+    assert wallet.coins is wallet.coins and wallet.coins == {"BTC": 2} and wallet.position("BTC") == 2
+    assert wallet.sell("BTC", 2, 70)
+    assert wallet.balance == 120 and wallet.coins == {} and wallet.position("BTC") == 0 and wallet.position("ETH") == 0
+
+    portfolio = Portfolio(initial_balance=1000, assets=["BTC", "ETH"], fee_model=PercentageFee(0.001), slippage_model=BpsSlippage(10), capacity=2)
+    accepted = portfolio.apply_fills(["BTC", "ETH", "BTC"], [2, 5, -1], [100, 50, 110], [1, 2, 3])
+    assert accepted.all()
+    assert np.allclose(portfolio.positions, [1, 5])
+    spent = 2 * 100.1 * 1.001 + 5 * 50.05 * 1.001 - 1 * 109.89 * 0.999
+    assert np.isclose(portfolio.balance, 1000 - spent)
+    # the second buy would overdraw, so only that fill is rejected
+    accepted = portfolio.apply_fills(["ETH", "ETH", "BTC"], [-5, 100, -1], [60, 60, 120], [4, 5, 6])
+    assert accepted.tolist() == [True, False, True]
+    assert np.allclose(portfolio.positions, [0, 0])
+    assert len(portfolio.history()) == 5
+    assert portfolio.deposit(100, time=7)
+    equity = portfolio.equity_curve([0, 2, 3, 7], np.array([[100, 50], [105, 50], [110, 55], [130, 70]]))
+    assert equity[0] == 1000
+    assert np.isclose(equity[1], portfolio.history()["cash"][1] + 2 * 105 + 5 * 50)
+    assert np.isclose(equity[-1], portfolio.balance)
+    assert np.isclose(portfolio.mark_to_market([130, 70]), portfolio.balance)
+
+
+def test_get_peaks(tmp_path):
+    import numpy as np
+    from src.simple_crypto.base_processor import get_peaks, sliding_max, PeakDetector
+    values = np.random.default_rng(3).normal(size=50)
+    assert np.allclose(sliding_max(values, 7), [values[i:i + 7].max() for i in range(44)])
+    close = np.round(np.random.default_rng(4).normal(size=2000).cumsum(), 1)
+    times = np.arange(2000) * 60000
+    expected = []
+    for i in range(len(close) - 5):
+        left, right = close[max(0, i - 5):i], close[i + 1:i + 6]
+        if close[i] > left.max(initial=-np.inf) and close[i] >= right.max():
+            expected.append((int(times[i]), close[i], "peak"))
+        if close[i] < left.min(initial=np.inf) and close[i] <= right.min():
+            expected.append((int(times[i]), close[i], "trough"))
+    assert get_peaks({"close": close, "close_time": times}, area=5) == expected
+    detector = PeakDetector(5)
+    streamed = []
+    for t, c in zip(times.tolist(), close.tolist()):
+        streamed += detector.on_kline({"k": {"x": True, "T": t, "c": str(c)}})
+    assert streamed == expected
+    # two rising files back to back: the seam between them is the only extreme past the first bar
+    _write_kline_csv(tmp_path / "a.csv", 1704067200000, 10)
+    _write_kline_csv(tmp_path / "b.csv", 1704067800000, 10, header=True)
+    peaks = get_peaks([str(tmp_path / "a.csv"), str(tmp_path / "b.csv")], area=3)
+    assert peaks == [(1704067259999, 0.25, "trough"), (1704067799999, 9.25, "peak"), (1704067859999, 0.25, "trough")]
+
+
+def test_indicators():
+    import numpy as np
+    from src.simple_crypto.market_access import MarketAccess
+    from src.simple_crypto.trackers import SMA, EMA, RSI, VWAP, Bollinger, sma, ema, rsi, vwap, bollinger, typical_price, IndicatorTracker, BollingerTracker
+    columns = _synthetic_klines(600, seed=5)
+    close, volume = columns["close"], columns["volume"]
+    typical = typical_price(columns["high"], columns["low"], close)
+    live = {"sma": SMA(20), "ema": EMA(20), "rsi": RSI(14), "vwap": VWAP(30), "bollinger": Bollinger(20)}
+    market = MarketAccess(logger=MarketAccess.BaseLogger(plain=True))
+    tracker = IndicatorTracker("BTC", market, **live)
+    bands = BollingerTracker("BTC", market, 20)
+    series = {name: [] for name in live}
+    upper = []
+    for i in range(len(close)):
+        kline = {"k": {"x": True, "h": str(columns["high"][i]), "l": str(columns["low"][i]), "c": str(close[i]), "v": str(volume[i])}}
+        tracker.on_event("kline_1m", kline)
+        bands.on_event("kline_1m", kline)
+        for name in live:
+            series[name].append(np.nan if tracker.values[name] is None else tracker.values[name])
+        upper.append(np.nan if bands.bands[1] is None else bands.bands[1])
+    # an open bar doesn't move anything
+    tracker.on_event("kline_1m", {"k": {"x": False, "h": "1", "l": "1", "c": "1", "v": "1"}})
+    assert tracker.values["sma"] == series["sma"][-1]
+    assert np.array_equal(series["sma"], sma(close, 20), equal_nan=True)
+    assert np.array_equal(series["ema"], ema(close, 20), equal_nan=True)
+    assert np.array_equal(series["rsi"], rsi(close, 14), equal_nan=True)
+    assert np.array_equal(series["vwap"], vwap(typical, volume, 30), equal_nan=True)
+    assert np.array_equal(series["bollinger"], bollinger(close, 20)[0], equal_nan=True)
+    assert np.array_equal(upper, bollinger(close, 20)[1], equal_nan=True)
+    assert np.isclose(series["sma"][-1], close[-20:].mean())
+    assert np.isclose(bollinger(close, 20)[2][-1], close[-20:].mean() - 2 * close[-20:].std())
+    assert np.isnan(series["rsi"][13]) and 0 <= series["rsi"][14] <= 100
+    # a stablecoin-like series: long, nearly flat and with tiny moves
+    flat = 1.0001 + np.random.default_rng(6).normal(0, 1e-6, 200000)
+    stable = Bollinger(20)
+    for value in flat.tolist():
+        stable.update(value)
+    assert np.isclose((stable.upper - stable.value) / 2, flat[-20:].std(), rtol=1e-6, atol=0)
+    assert np.allclose((bollinger(flat, 20)[1] - bollinger(flat, 20)[0])[-5:] / 2, [flat[i - 19:i + 1].std() for i in range(len(flat) - 5, len(flat))], rtol=1e-6, atol=0)
+
+
+def test_stream_recorder(tmp_path):
+    import asyncio
+    import json
+    import os
+    import websockets
+    from src.simple_crypto.market_access import MarketAccess
+    from src.simple_crypto.recorder import StreamRecorder, StreamReplayer, read_stream, stream_file
+
+    async def capture(market):
+        async def handler(connection):
+            for n in range(30):
+                for stream in ["btcusd@bookTicker", "ethusd@trade"]:
+                    await connection.send(json.dumps({"stream": stream, "data": {"n": n}}))
+            await asyncio.sleep(1)
+
+        async with websockets.serve(handler, "127.0.0.1", 0) as server:
+            market.stream_url = f"ws://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+            listener = MarketAccess.CombinedListener(market, ["btcusd@bookTicker", "ethusd@trade"])
+            task = asyncio.create_task(listener.start())
+            await asyncio.sleep(0.3)
+            listener.stop()
+            await asyncio.wait_for(task, 5)
+
+    root = str(tmp_path / "live")
+    recorder = StreamRecorder(root, chunk_size=256)
+    asyncio.run(capture(MarketAccess(logger=MarketAccess.BaseLogger(plain=True), recorder=recorder)))
+    recorder.close()
+    assert recorder.written == 60
+
+    class Collector(MarketAccess.BaseTracker):
+        def __init__(self, symbol, access):
+            super().__init__(symbol, access)
+            self.seen = []
+
+        def on_event(self, event, msg):
+            self.seen.append((event, msg["n"]))
+
+    market = MarketAccess(logger=MarketAccess.BaseLogger(plain=True), queue_size=4)
+    collector = Collector("BTC", market)
+    market.stocks.add("btcusd@bookTicker", collector)
+    market.stocks.add("ethusd@trade", collector)
+    # bookTicker conflates in the queue, a lossless replay still delivers every frame in order
+    assert StreamReplayer(root).run(market) == 60
+    assert [n for event, n in collector.seen if event == "btcusd@bookTicker"] == list(range(30))
+    assert [n for event, n in collector.seen if event == "ethusd@trade"] == list(range(30))
+
+    root = str(tmp_path / "merge")
+    recorder = StreamRecorder(root, chunk_size=64)
+    for n in range(20):
+        recorder.record("b@trade", json.dumps({"n": n}), received=1000 + 10 * n)
+        recorder.record("a@trade", json.dumps({"stream": "a@trade", "data": {"n": n}}), received=1005 + 10 * n if n % 2 else 1000 + 10 * n)
+    recorder.close()
+    replayer = StreamReplayer(root, start=1050, end=1100)
+    merged = [(message['stream'], message['data']['n']) for message in replayer.messages()]
+    # equal receive times go to the stream that sorts first
+    assert merged[:4] == [("b@trade", 5), ("a@trade", 5), ("a@trade", 6), ("b@trade", 6)]
+    assert len(merged) == 12
+    assert merged == [(message['stream'], message['data']['n']) for message in replayer.messages()]
+    # a chunk cut short by a crash is dropped, the ones before it still read
+    path = stream_file(root, "b@trade")
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) - 3)
+    assert 0 < len(list(read_stream(path))) < 20
+
+
+def test_back_market_replay(tmp_path):
+    import numpy as np
+    from src.simple_crypto.market_access import MarketAccess
+    from src.simple_crypto.downloader import months_back
+    from src.simple_crypto.kline_store import KlineStore
+    from src.simple_crypto.alg_testing.back_market import BackMarket
+    from src.simple_crypto.alg_testing.tester import AlgTester
+    store = KlineStore(str(tmp_path))
+    month = months_back(1)[0].strftime('%Y-%m')
+    start = int(months_back(1)[0].timestamp()) * 1000
+    btc = _synthetic_klines(1600, seed=1, start=start)
+    store.append_month("BTC", "USD", "1m", month, btc)
+    store.append_month("ETH", "USD", "1m", month, _synthetic_klines(1600, seed=2, start=start + 30000))
+    store.append_month("BTC", "USD", "1h", month, _synthetic_klines(30, seed=3, start=start, interval_ms=3600000))
+
+    class Collector(MarketAccess.BaseTracker):
+        seen = []
+
+        def on_event(self, event, msg):
+            Collector.seen.append((msg["E"], event, msg))
+
+    logger = MarketAccess.BaseLogger(plain=True)
+    market = BackMarket(data_dir=str(tmp_path), logger=logger, download=False, queue_size=64)
+    for symbol, event in [("BTC", "kline_1m"), ("ETH", "kline_1m"), ("BTC", "kline_1h"), ("BTC", "miniTicker"), ("ETH", "ticker")]:
+        market.subscribe(symbol, Collector(symbol, market), event=event)
+    with pytest.raises(ValueError):
+        market.subscribe("BTC", Collector("BTC", market), event="depth")
+    market.run()
+    seen = Collector.seen
+    assert market.replayed == len(seen) == 1600 * 2 + 30 + 161 * 2
+    # one timeline across coins and intervals
+    assert [t for t, event, msg in seen] == sorted(t for t, event, msg in seen)
+    assert seen[0][1] == "btcusd@kline_1m" and seen[1][1] == "ethusd@kline_1m"
+    mini = [msg for t, event, msg in seen if event == "btcusd@miniTicker"]
+    assert mini[-1]["h"] == btc["high"][-1440:].max() and np.isclose(mini[-1]["v"], btc["volume"][-1440:].sum())
+    ticker = [msg for t, event, msg in seen if event == "ethusd@ticker"][0]
+    assert ticker["C"] - ticker["O"] == 86400000 - 1 and ticker["n"] == 1440
+    assert np.isclose(ticker["p"], ticker["c"] - ticker["o"])
+    hourly = [msg["k"] for t, event, msg in seen if event == "btcusd@kline_1h"]
+    assert hourly[0]["i"] == "1h" and hourly[0]["x"]
+
+    # a typed decoder types the replayed klines like live ones
+    from src.simple_crypto.decoding import MessageDecoder, Kline
+    Collector.seen = []
+    typed = BackMarket(data_dir=str(tmp_path), logger=logger, download=False, decoder=MessageDecoder(typed=True))
+    typed.subscribe("BTC", Collector("BTC", typed), event="kline_1m")
+    typed.run()
+    bars = [msg for t, event, msg in Collector.seen]
+    assert all(isinstance(bar, Kline) for bar in bars) and bars[0].close == btc["close"][0] and bars[0]["k"].open_time == btc["open_time"][0]
+
+    class Holder:
+        def __init__(self, market, wallet, coin, currency):
+            self.wallet = wallet
+            self.tracker = Buyer(coin, market, wallet)
+            market.subscribe(coin, self.tracker, currency, "kline_1m")
+
+    class Buyer(MarketAccess.BaseTracker):
+        def __init__(self, symbol, access, wallet):
+            super().__init__(symbol, access)
+            self.wallet = wallet
+
+        def on_event(self, event, msg):
+            if not self.wallet.coins:
+                self.wallet.buy(self.symbol, 1, msg["k"]["c"])
+
+    tester = AlgTester(initial_balance=1000, currency="USD")
+    wallet = tester.backtest(Holder, lambda market_class, **kwargs: BackMarket(market_class, logger=logger, download=False, **kwargs), data_dir=str(tmp_path))
+    assert wallet.coins == {"BTC": 1} and np.isclose(wallet.balance, 1000 - btc["close"][0])
+
+
+def test_resample(tmp_path):
+    import os
+    import numpy as np
+    import pandas as pd
+    from src.simple_crypto.market_access import MarketAccess
+    from src.simple_crypto.downloader import months_back
+    from src.simple_crypto.kline_store import KlineStore
+    from src.simple_crypto.resample import resample, interval_ms, ResampleCache, KlineAggregator, ResampleTracker
+    from src.simple_crypto.alg_testing.tester import AlgTester
+    first, second = months_back(2)
+    first_start = int(first.replace(day=1, hour=0, minute=0, second=0, microsecond=0).timestamp()) * 1000
+    second_start = int(second.replace(day=1, hour=0, minute=0, second=0, microsecond=0).timestamp()) * 1000
+    store = KlineStore(str(tmp_path))
+    # the last 1000 minutes of one month and the first 500 of the next
+    tail = _synthetic_klines(1000, seed=1, start=second_start - 1000 * 60000)
+    store.append_month("BTC", "USD", "1m", first.strftime('%Y-%m'), tail)
+    head = _synthetic_klines(500, seed=2, start=second_start)
+    head["count"] = np.arange(500, dtype=np.int64)
+    store.append_month("BTC", "USD", "1m", second.strftime('%Y-%m'), head)
+    source = {name: np.concatenate([tail[name], head[name]]) for name in tail}
+
+    hourly = resample(source, 3600000)
+    frame = pd.DataFrame(source)
+    frame["bucket"] = frame["open_time"] // 3600000
+    expected = frame.groupby("bucket").agg(open=("open", "first"), high=("high", "max"), low=("low", "min"), close=("close", "last"), volume=("volume", "sum"), count=("count", "sum"))
+    # the leading hour only has its last 40 minutes and the trailing one its first 20
+    expected = expected.iloc[1:-1]
+    assert np.array_equal(hourly["open_time"], expected.index.to_numpy() * 3600000)
+    for name in ["open", "high", "low", "close", "count"]:
+        assert np.array_equal(hourly[name], expected[name].to_numpy())
+    assert np.allclose(hourly["volume"], expected["volume"].to_numpy())
+    assert len(resample(source, 3600000, drop_partial=False)["open_time"]) == len(hourly["open_time"]) + 2
+    # weeks open on Mondays like Binance's 1w klines, 2024-01-03 is a Wednesday
+    hours = _synthetic_klines(24 * 21, seed=4, start=1704240000000, interval_ms=3600000)
+    weekly = resample(hours, interval_ms("1w"))
+    assert weekly["open_time"].tolist() == [1704672000000, 1705276800000]
+    aggregator = KlineAggregator("1w")
+    bars = [bar for t in hours["open_time"].tolist() for bar in aggregator.push({"t": t, "T": t + 3599999, "o": 1, "h": 1, "l": 1, "c": 1, "v": 1, "n": 1, "q": 1, "V": 1, "Q": 1, "x": True})]
+    assert [bar["t"] for bar in bars] == weekly["open_time"].tolist()
+
+    cache = ResampleCache(str(tmp_path))
+    assert cache.source_for("BTC", "USD", "7m") == "1m"
+    dataset = cache.open("BTC", "USD", "1h")
+    assert np.array_equal(dataset["close"], hourly["close"])
+    assert dataset.months == [first.strftime('%Y-%m'), second.strftime('%Y-%m')]
+    assert dataset.month(second.strftime('%Y-%m'))["open_time"][0] == second_start
+    meta_file = os.path.join(cache.derived_dir("BTC", "USD", "1m", "1h"), "meta.json")
+    built = os.stat(meta_file).st_mtime_ns
+    cache.open("BTC", "USD", "1h")
+    assert os.stat(meta_file).st_mtime_ns == built
+    # a bucket can straddle two source months, and appending to the source rebuilds the cache
+    custom = cache.open("BTC", "USD", "7m")
+    assert np.array_equal(custom["high"], resample(source, 420000)["high"])
+    earlier = months_back(1, first)[0]
+    store.append_month("BTC", "USD", "1m", earlier.strftime('%Y-%m'), _synthetic_klines(60, seed=3, start=first_start - 40 * 86400000))
+    # one more hour in front, and the partial hour that used to lead is now complete enough to keep
+    assert len(cache.open("BTC", "USD", "1h")) == len(hourly["open_time"]) + 2
+
+    columns = AlgTester().load_klines("BTC", str(tmp_path), 2, "5m", download=False, resample_from="1m")
+    assert np.array_equal(columns["close"], resample(source, 300000)["close"])
+
+    class Collector(MarketAccess.BaseTracker):
+        def __init__(self, symbol, access):
+            super().__init__(symbol, access)
+            self.bars = []
+
+        def on_event(self, event, msg):
+            self.bars.append((event, msg["k"]))
+
+    market = MarketAccess(logger=MarketAccess.BaseLogger(plain=True))
+    collector = Collector("BTC", market)
+    tracker = ResampleTracker("BTC", market, "1h", collector)
+    for n in range(len(source["open_time"])):
+        kline = {"t": source["open_time"][n], "T": source["close_time"][n], "s": "BTCUSD", "o": str(source["open"][n]), "h": str(source["high"][n]), "l": str(source["low"][n]),
+                 "c": str(source["close"][n]), "v": str(source["volume"][n]), "n": source["count"][n], "x": True, "q": str(source["quote_volume"][n]), "V": "0", "Q": "0"}
+        tracker.on_event("btcusd@kline_1m", {"k": dict(kline, x=False)})
+        tracker.on_event("btcusd@kline_1m", {"k": kline})
+    assert len(collector.bars) == len(hourly["open_time"])
+    assert collector.bars[0][0] == "btcusd@kline_1h"
+    assert [bar["c"] for event, bar in collector.bars] == hourly["close"].tolist()
+    assert [bar["n"] for event, bar in collector.bars] == hourly["count"].tolist()
+    assert np.allclose([bar["v"] for event, bar in collector.bars], hourly["volume"])
+    assert tracker.aggregator.current()["x"] is False
+
+
+def test_async_logger(tmp_path, capsys):
+    from src.simple_crypto.market_access import MarketAccess
+    log_file = tmp_path / "log_1"
+    log_file.write_text("")
+    logger = MarketAccess.BaseLogger([str(log_file)], plain=True, level="info", asynchronous=True, rate_limit=5, flush_interval=10)
+    market = MarketAccess(logger=logger)
+    for n in range(20):
+        MarketAccess.BaseTracker("BTC", market).on_event("btcusd@trade", {"n": n})
+        logger.log(content=f"tick {n}", title="[TICK]")
+    logger.log(content="disconnected", title="[LISTENER-WARNING]")
+    logger.log(content="dropped", title="[DEBUG]", level="debug")
+    # nothing is written on the calling thread until the batch is flushed
+    assert log_file.read_text() == ""
+    logger.flush()
+    lines = log_file.read_text().splitlines()
+    assert [line.split("] ", 1)[1] for line in lines] == [f"[TICK] tick {n}" for n in range(5)] + ["[LISTENER-WARNING] disconnected"]
+    assert "Received event" not in capsys.readouterr().out
+    # the next second reports how many records the limit held back
+    logger.rate_window -= 1
+    logger.log(content="tick again", title="[TICK]")
+    logger.close()
+    assert log_file.read_text().splitlines()[-2].endswith("[TICK] Suppressed 15 messages over the rate limit")
+    assert log_file.read_text().splitlines()[-1].endswith("[TICK] tick again")
+    # after close the logger falls back to writing synchronously
+    logger.log(content="late", title="[TICK]")
+    assert log_file.read_text().splitlines()[-1].endswith("[TICK] late")
+
+    # the rate counters stay exact with many threads logging at once
+    import threading
+    shared = MarketAccess.BaseLogger(plain=True, rate_limit=10)
+    workers = [threading.Thread(target=lambda: [shared._allowed("[TICK]", 100.5) for _ in range(5000)]) for _ in range(8)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert shared.rate_counts == {"[TICK]": 40000} and shared.suppressed == {"[TICK]": 39990}
+
+
+def test_typed_messages():
+    from src.simple_crypto.market_access import MarketAccess
+    from src.simple_crypto.decoding import MessageDecoder, Trade, Kline, DepthUpdate, BookTicker
+    from src.simple_crypto.order_book import OrderBook
+    from src.simple_crypto.trackers import SMATracker
+    trade = b'{"e":"trade","E":1700000000001,"s":"BTCUSD","t":7,"p":"42000.50","q":"0.010","T":1700000000000,"m":true,"M":true}'
+    kline = b'{"e":"kline","E":1700000060000,"s":"BTCUSD","k":{"t":1700000000000,"T":1700000059999,"s":"BTCUSD","i":"1m","f":1,"L":9,"o":"1.5","c":"2.5","h":"3","l":"1","v":"10","n":9,"x":true,"q":"20","V":"4","Q":"8","B":"0"}}'
+    depth = b'{"e":"depthUpdate","E":1700000000002,"s":"BTCUSD","U":11,"u":12,"b":[["99.5","2.0"]],"a":[["100.5","0"]]}'
+    book = b'{"u":5,"s":"BTCUSD","b":"99.5","B":"1","a":"100.5","A":"2"}'
+    plain = MessageDecoder()
+    assert plain.decode("btcusd@trade", trade)["p"] == "42000.50"
+    typed = MessageDecoder(typed=True)
+    message = typed.decode("btcusd@trade", trade)
+    assert message == Trade(1700000000001, "BTCUSD", 7, 42000.5, 0.01, 1700000000000, True)
+    assert message["p"] == 42000.5 and message["e"] == "trade" and message.get("X") is None and "M" not in message
+    bar = typed.decode("btcusd@kline_1m", kline)
+    assert isinstance(bar, Kline) and bar["k"] is bar and (bar.open, bar.close, bar.trades, bar.closed) == (1.5, 2.5, 9, True)
+    assert typed.decode("btcusd@bookTicker", book) == BookTicker(5, "BTCUSD", 99.5, 1.0, 100.5, 2.0)
+    diff = typed.decode("btcusd@depth@100ms", depth)
+    assert isinstance(diff, DepthUpdate) and diff.bids == [(99.5, 2.0)] and diff.asks == [(100.5, 0.0)]
+    # streams without a message type stay dicts, combined frames are unwrapped
+    assert typed.decode_combined(b'{"stream":"btcusd@ticker","data":{"e":"24hrTicker","c":"1"}}') == ("btcusd@ticker", {"e": "24hrTicker", "c": "1"})
+    assert typed.decode_combined(b'{"result":null,"id":1}') == (None, {"result": None, "id": 1})
+    # typed messages drop into code written against the raw dicts
+    order_book = OrderBook("BTCUSD")
+    order_book.load_snapshot({"lastUpdateId": 10, "bids": [["99.0", "1.0"]], "asks": [["100.5", "3.0"]]})
+    assert order_book.apply_diff(diff) and order_book.best_bid() == (99.5, 2.0) and order_book.best_ask() is None
+    market = MarketAccess(logger=MarketAccess.BaseLogger(plain=True), decoder=typed)
+    tracker = SMATracker("BTC", market, period=1)
+    tracker.on_event("btcusd@kline_1m", bar)
+    assert tracker.value == 2.5
+    market.msgs.record_dispatch(message)
+    assert market.msgs.lag_count == 1
+    with pytest.raises(ValueError):
+        MarketAccess(logger=MarketAccess.BaseLogger(plain=True), decoder="orjson")
+
+
+def test_benchmark_harness():
+    from benchmarks import bench_ingest, compare
+    result = bench_ingest(symbols=2, events=("trade", "depth@100ms"), messages=50, timeout=30)
+    assert result["received"] == result["sent"] == 200
+    assert 0 <= result["latency"]["p50_ms"] <= result["latency"]["p99_ms"] <= result["latency"]["max_ms"]
+    baseline = {"results": {"ingest": {"messages_per_second": 1000.0, "latency": {"p99_ms": 2.0}, "received": 10}}}
+    current = {"results": {"ingest": {"messages_per_second": 950.0, "latency": {"p99_ms": 3.0}, "received": 5}}}
+    assert list(compare(baseline, current, tolerance=0.1)) == ["ingest.latency.p99_ms"]
+
+
+def test_metrics():
+    import asyncio
+    import threading
+    import time
+    import urllib.request
+    from src.simple_crypto.market_access import MarketAccess
+    from src.simple_crypto.metrics import MetricsRegistry, NULL_METRIC, DISABLED
+
+    registry = MetricsRegistry()
+    counter = registry.counter("hits_total", stream="btcusd@trade")
+    histogram = registry.histogram("work_seconds")
+
+    def work():
+        for n in range(1, 1001):
+            counter.inc()
+            histogram.observe(n / 1000)
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert registry.counter("hits_total", stream="btcusd@trade") is counter and counter.value() == 4000
+    # log buckets keep percentiles within 1/16 of the true value
+    assert abs(histogram.percentile(50) - 0.5) <= 0.5 / 16 and histogram.percentile(100) == 1.0
+    with pytest.raises(ValueError):
+        registry.histogram("hits_total", stream="btcusd@trade")
+    text = registry.prometheus()
+    assert 'simple_crypto_hits_total{stream="btcusd@trade"} 4000' in text
+    assert 'simple_crypto_work_seconds_bucket{le="+Inf"} 4000' in text
+    assert DISABLED.counter("hits_total") is NULL_METRIC and DISABLED.collect() == {}
+
+    class Slow(MarketAccess.BaseTracker):
+        def on_event(self, event, msg):
+            time.sleep(0.001)
+
+    market = MarketAccess(logger=MarketAccess.BaseLogger(plain=True), metrics=registry)
+    market.stocks.add("btcusd@trade", Slow("BTC", market))
+
+    async def feed():
+        market.connected = True
+        processor = asyncio.create_task(market.msg_processor())
+        for n in range(20):
+            stream, data = market.decode_frame("btcusd@trade", b'{"e":"trade","E":1,"s":"BTCUSD","n":%d}' % n)
+            await market.msgs.put({'stream': stream, 'data': data})
+        market.connected = False
+        await market.msgs.put({'stream': 'end', 'data': None})
+        await processor
+
+    asyncio.run(feed())
+    collected = registry.collect()
+    assert collected["messages_total"][0]["value"] == 20
+    assert collected["decode_seconds"][0]["count"] == 20
+    assert collected["queue_wait_seconds"][0]["count"] == 21
+    assert collected["tracker_seconds"][0]["labels"] == {"tracker": "Slow"} and collected["tracker_seconds"][0]["p50"] >= 0.001
+    assert collected["queue_dispatched"][0]["value"] == 20
+
+    def spin(seconds):
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            pass
+
+    port = registry.serve()
+    try:
+        base = f"http://127.0.0.1:{port}"
+        assert "simple_crypto_messages_total" in urllib.request.urlopen(base + "/metrics").read().decode()
+        urllib.request.urlopen(base + "/profile/start?interval=0.002").read()
+        spin(0.3)
+        urllib.request.urlopen(base + "/profile/stop").read()
+        assert registry.profiler.samples > 10
+        assert any(name.startswith("spin ") for name, count in registry.profiler.top(5))
+        assert "spin (" in urllib.request.urlopen(base + "/profile").read().decode()
+    finally:
+        registry.close()
+
+
+def test_subscription_reconciliation():
+    import asyncio
+    import threading
+    import time
+    from http.server import ThreadingHTTPServer
+    from src.simple_crypto.market_access import MarketAccess
+    from src.simple_crypto.rest_client import RestClient
+
+    class FakeListener:
+        running = set()
+        started = 0
+
+        def __init__(self, event, market_access):
+            self.event = event
+            self.stopped = asyncio.Event()
+
+        async def start(self):
+            FakeListener.started += 1
+            FakeListener.running.add(self.event)
+            await self.stopped.wait()
+            FakeListener.running.discard(self.event)
+
+        def stop(self):
+            self.stopped.set()
+
+    def wait_for(condition, timeout=5):
+        deadline = time.perf_counter() + timeout
+        while not condition() and time.perf_counter() < deadline:
+            time.sleep(0.001)
+        return condition()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _ExchangeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    try:
+        market = MarketAccess(logger=MarketAccess.BaseLogger(plain=True, level="error"), listener_class=FakeListener, rest_client=RestClient(bases={True: base, False: base}))
+        tracker = MarketAccess.BaseTracker("BTC", market)
+        market.stocks.add("btcusd@trade", tracker)
+        market.start()
+        assert wait_for(lambda: FakeListener.running == {"btcusd@trade"})
+        streams = [f"c{n}usd@trade" for n in range(3000)]
+        started = time.perf_counter()
+        for stream in streams:
+            market.stocks.add(stream, tracker)
+        assert wait_for(lambda: len(FakeListener.running) == 3001)
+        for stream in streams[:2000]:
+            market.stocks.remove(stream, tracker)
+        assert wait_for(lambda: len(FakeListener.running) == 1001)
+        # no polling interval to wait out, the churn is bounded by the work itself
+        assert time.perf_counter() - started < 2
+        # a second tracker on a stream doesn't start another listener
+        market.stocks.add("btcusd@trade", MarketAccess.BaseTracker("BTC", market))
+        market.stocks.remove("btcusd@trade", tracker)
+        time.sleep(0.05)
+        assert "btcusd@trade" in FakeListener.running and FakeListener.started == 3001
+        market.stop()
+        assert FakeListener.running == set() and market.loop is None
+    finally:
+        server.shutdown()
+
+
+def _shard_echo(symbol, access, tag):
+    # module level so shard processes can unpickle it as a factory
+    from src.simple_crypto.market_access import MarketAccess
+
+    class Echo(MarketAccess.BaseTracker):
+        def on_event(self, event, msg):
+            import os
+            self.access.emit((tag, event, msg["n"], os.getpid()))
+
+    return Echo(symbol, access)
+
+
+def _shard_book(symbol, access):
+    # an order book in a shard, fetching its snapshot from a stub instead of the REST API
+    from src.simple_crypto.order_book import OrderBookTracker
+
+    async def snapshot(endpoint, params=None):
+        return {"lastUpdateId": 20, "bids": [["50.0", "1"]], "asks": [["51.0", "1"]]}
+
+    class Book(OrderBookTracker):
+        def load(self, snapshot):
+            super().load(snapshot)
+            self.access.emit(("loaded", self.book.best_bid()))
+
+    access.request_async = snapshot
+    return Book(symbol, access)
+
+
+def test_sharded_trackers():
+    import asyncio
+    import os
+    import time
+    from src.simple_crypto.market_access import MarketAccess
+    from src.simple_crypto.sharding import RingBuffer, HashRing, ShardedExecutor
+
+    ring = RingBuffer(64)
+    try:
+        # 20 byte records wrap around a 64 byte ring many times over
+        for n in range(50):
+            assert ring.try_put(b"x" * 10 + str(n).zfill(10).encode())
+            assert ring.try_put(b"y" * 20)
+            assert not ring.try_put(b"z" * 20)
+            assert ring.try_get() == b"x" * 10 + str(n).zfill(10).encode()
+            assert ring.try_get() == b"y" * 20
+        assert ring.try_get() is None
+        with pytest.raises(ValueError):
+            ring.try_put(b"z" * 64)
+    finally:
+        ring.close()
+
+    streams = [f"c{n}usd@trade" for n in range(1000)]
+    four, five = HashRing(4), HashRing(5)
+    assert [four.shard_for(stream) for stream in streams] == [HashRing(4).shard_for(stream) for stream in streams]
+    assert min(sum(four.shard_for(stream) == shard for stream in streams) for shard in range(4)) > 150
+    # a fifth shard only takes streams over, it doesn't reshuffle the others
+    moved = [stream for stream in streams if four.shard_for(stream) != five.shard_for(stream)]
+    assert all(five.shard_for(stream) == 4 for stream in moved) and len(moved) < 350
+
+    market = MarketAccess(logger=MarketAccess.BaseLogger(plain=True, level="error"))
+    market.symbols.symbols = {f"{coin}USD": {"symbol": f"{coin}USD"} for coin in ["BTC", "ETH", "SOL"]}
+    market.symbols.loaded_at = time.time()
+    executor = ShardedExecutor(market, shards=2, ring_size=1 << 16)
+    executor.start()
+    try:
+        keys = [executor.subscribe(coin, _shard_echo, "USD", "trade", coin) for coin in ["BTC", "ETH", "SOL"]]
+        executor.subscribe("BTC", _shard_echo, "USD", "trade", "BTC2")
+        assert len(market.stocks.keys()) == 3
+
+        async def feed():
+            market.connected = True
+            processor = asyncio.create_task(market.msg_processor())
+            for n in range(300):
+                for coin in ["btc", "eth", "sol"]:
+                    await market.msgs.put({'stream': f"{coin}usd@trade", 'data': {"n": n, "pad": "p" * 200}})
+            market.connected = False
+            await market.msgs.put({'stream': 'end', 'data': None})
+            await processor
+
+        asyncio.run(feed())
+        assert executor.sync(30)
+        assert executor.results.qsize() == 1200
+        results = [executor.results.get(timeout=30)[1] for _ in range(1200)]
+        for tag in ["BTC", "ETH", "SOL", "BTC2"]:
+            assert [n for result_tag, event, n, pid in results if result_tag == tag] == list(range(300))
+        assert os.getpid() not in {pid for tag, event, n, pid in results}
+        assert executor.unsubscribe(keys[0]) and not executor.unsubscribe(keys[0])
+        assert "btcusd@trade" in market.stocks.keys()
+
+        # subscribing from another thread while the dispatcher feeds the same shards
+        import threading
+        extra = []
+
+        def churn():
+            for n in range(100):
+                extra.append(executor.subscribe("ETH", _shard_echo, "USD", "trade", f"X{n}"))
+            for key in extra[::2]:
+                assert executor.unsubscribe(key)
+
+        churner = threading.Thread(target=churn)
+        churner.start()
+        asyncio.run(feed())
+        churner.join()
+        assert executor.sync(30)
+        while not executor.results.empty():
+            executor.results.get_nowait()
+        market.stocks.get("ethusd@trade").notify_batch("ethusd@trade", [{"n": -1}])
+        assert executor.sync(30)
+        answered = []
+        while not executor.results.empty():
+            answered.append(executor.results.get_nowait()[1][0])
+        assert sorted(answered) == sorted(["ETH"] + [f"X{n}" for n in range(1, 100, 2)])
+
+        # trackers that start tasks run on the shard's event loop
+        executor.subscribe("SOL", _shard_book, "USD", "depth")
+        market.stocks.get("solusd@depth").notify_batch("solusd@depth", [{"U": 15, "u": 19, "b": [], "a": []}, {"U": 18, "u": 22, "b": [["50.5", "2"]], "a": []}])
+        assert executor.results.get(timeout=30)[1] == ("loaded", (50.5, 2.0))
+
+        # a dead shard fails the sync instead of hanging it, and its commands are dropped
+        executor.processes[0].terminate()
+        executor.processes[0].join()
+        started = time.monotonic()
+        assert not executor.sync(30) and time.monotonic() - started < 10
+        assert executor.dead == {0} and not executor._send(0, ("sync", -1))
+    finally:
+        executor.stop()
+    assert market.stocks.keys() == [] and executor.processes == []
+
+
+def test_lazy_imports():
+    import src.simple_crypto as package
+    from src.simple_crypto.market_access import MarketAccess as direct
+    from src.simple_crypto.alg_testing.back_market import BackMarket
+    from benchmarks import bench_import, over_budget
+    # one class however it's reached
+    assert package.MarketAccess is direct and MarketAccess is direct
+    assert package.alg_testing.BackMarket is BackMarket
+    assert "trackers" in dir(package) and "Sweep" in dir(package.alg_testing)
+    with pytest.raises(AttributeError):
+        package.missing
+
+    result = bench_import(["src.simple_crypto", "thread_safe_types", "market_access"], repeat=1)
+    assert result["src.simple_crypto"]["heavy_modules"] == [] and result["thread_safe_types"]["heavy_modules"] == []
+    assert result["market_access"]["heavy_modules"] == []
+    assert over_budget({"results": {"import": result}}) == [f"import.{module}" for module, value in result.items() if value["over_budget"]]
+    assert over_budget({"results": {"import": {"market_access": {"over_budget": True}}}}) == ["import.market_access"]
+
+def test_tracker_errors_logged():
+    from src.simple_crypto.thread_safe_types import ThreadSafeStock
+    from src.simple_crypto.metrics import MetricsRegistry
+
+    class Logger:
+        records = []
+
+        def log(self, content, title=None, title_color=None, **kwargs):
+            self.records.append((title, content))
+
+    class Access:
+        logger = Logger()
+
+    class Broken:
+        access = Access()
+        batched = False
+        seen = []
+
+        def on_event(self, event, data):
+            if data % 2:
+                raise RuntimeError(f"bad {data}")
+            self.seen.append(data)
+
+    stock = ThreadSafeStock("btcusd@trade", [Broken()])
+    stock.notify("btcusd@trade", 1)
+    # a failing message doesn't cost the rest of its batch, timed or not
+    stock.notify_batch("btcusd@trade", [2, 3, 4, 6])
+    stock.notify_batch("btcusd@trade", [8, 9, 10], MetricsRegistry())
+    assert Broken.seen == [2, 4, 6, 8, 10]
+    assert [title for title, content in Logger.records] == ["[TRACKER-ERROR]"] * 3
+    assert "RuntimeError('bad 3')" in Logger.records[1][1]
+
+
+def test_ring_record_cap():
+    from src.simple_crypto.sharding import RingBuffer
+    ring = RingBuffer(64)
+    try:
+        # a 28 byte payload pads to 32, half the ring: once drained it fits wherever the head
+        # is, the 4 byte records in between walk the head through every offset
+        for n in range(8):
+            for payload in (bytes([n]) * 4, bytes([n]) * 28):
+                assert ring.try_put(payload)
+                assert ring.try_get() == payload
+                assert ring.try_get() is None
+        with pytest.raises(ValueError):
+            ring.try_put(bytes(44))
+    finally:
+        ring.close()
+
 if __name__ == "__main__":
     test_historical_data()
\ No newline at end of file